@@ -0,0 +1,106 @@
+"""Benchmark of CopyEngine and PipelineCopyEngine in each I/O mode.
+
+Copies a file the size of a large track and shows the throughput of each engine and
+how much the page cache grew during the copy. In the bulk and direct modes the cache
+should barely grow, however big the file. Run from the repository root with:
+
+    python -m benchmarks.bench_copy_engine [in directory] [out directory]
+
+The files are written to the directories given, the current directory by default,
+as a temporary directory on tmpfs would be all page cache. The pipelined engines
+only differ from the others when the out directory is on another device, such as
+an SD card, where reading and writing at the same time should raise the throughput
+towards that of the slower device.
+"""
+
+import os
+from pathlib import Path
+import sys
+import tempfile
+import time
+
+from gdipak.copy_engine import CopyEngine, PipelineCopyEngine
+
+# The size of the copied file, about that of the largest tracks.
+FILE_SIZE = 512 * 1024 * 1024
+# The engine of each I/O mode, without and with the pipeline that --pipeline turns on.
+ENGINES = {
+    "buffered": CopyEngine(reflink=False),
+    "bulk": CopyEngine(reflink=False, bulk=True),
+    "direct": CopyEngine(reflink=False, direct=True),
+    "pipeline buffered": PipelineCopyEngine(reflink=False),
+    "pipeline bulk": PipelineCopyEngine(reflink=False, bulk=True),
+    "pipeline direct": PipelineCopyEngine(reflink=False, direct=True),
+}
+
+
+def get_cached_bytes() -> int | None:
+    """Gets the size of the page cache.
+
+    Returns:
+        The number of bytes cached, or None if it is not known on this platform.
+    """
+    try:
+        with open("/proc/meminfo", encoding="UTF-8") as meminfo:
+            for line in meminfo:
+                if line.startswith("Cached:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def make_file(file_path: Path, size: int) -> None:
+    """Writes a file of random data and drops it from the page cache, so that every
+    mode starts by reading from the device.
+
+    Args:
+        file_path: The file.
+        size: The number of bytes.
+    """
+    block = os.urandom(1024 * 1024)
+    with open(file_path, "wb") as file:
+        for offset in range(0, size, len(block)):
+            file.write(block[: size - offset])
+        file.flush()
+        os.fsync(file.fileno())
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def run(
+    in_dir: str | Path = ".", out_dir: str | Path = None, size: int = FILE_SIZE
+) -> None:
+    """Times copying a file with each engine and prints the results.
+
+    Args:
+        in_dir: The directory the copied file is written to.
+        out_dir: Optional. The directory the copies are written to. If left None
+          in_dir is used.
+        size: The number of bytes in the copied file.
+    """
+    out_dir = in_dir if out_dir is None else out_dir
+    prefix = ".gdipak-bench-"
+    with tempfile.TemporaryDirectory(
+        dir=in_dir, prefix=prefix
+    ) as in_temp, tempfile.TemporaryDirectory(dir=out_dir, prefix=prefix) as out_temp:
+        in_file = Path(in_temp) / "in.bin"
+        out_file = Path(out_temp) / "out.bin"
+        print(f"{'engine':>17} {'seconds':>9} {'MB/s':>8} {'cache MB':>9}")
+        for mode, engine in ENGINES.items():
+            make_file(in_file, size)
+            cached = get_cached_bytes()
+            start = time.perf_counter()
+            # Flushed so the time includes writing the data to the device.
+            engine(in_file, out_file, sync=True)
+            seconds = time.perf_counter() - start
+            growth = "?"
+            if cached is not None:
+                growth = f"{(get_cached_bytes() - cached) / 1e6:.1f}"
+            throughput = size / seconds / 1e6
+            print(f"{mode:>17} {seconds:>9.3f} {throughput:>8.1f} {growth:>9}")
+            out_file.unlink()
+
+
+if __name__ == "__main__":
+    run(*sys.argv[1:3])
@@ -0,0 +1,54 @@
+"""Benchmark of GdiConverter on GDI files of increasing size.
+
+The time per line should stay about the same as the number of lines grows, showing
+that the conversion takes linear time. Run from the repository root with:
+
+    python -m benchmarks.bench_gdi_converter
+"""
+
+import timeit
+from typing import List
+
+from gdipak.gdi_converter import GdiConverter
+
+# The number of track lines in each generated file. Real files have up to 99, the
+# larger sizes stand in for the malformed files left by bad rips.
+LINE_COUNTS = (100, 1000, 10000, 100000)
+
+
+def make_contents(line_count: int) -> bytes:
+    """Creates the contents of a GDI file with irregular whitespace.
+
+    Args:
+        line_count: The number of track lines.
+
+    Returns:
+        The file contents.
+    """
+    lines = [f"{line_count}\r\n"]
+    for index in range(1, line_count + 1):
+        file_name = f"Some Game (USA) (Track {index}).bin"
+        lines.append(f' {index}    {index * 600}\t\t4 2352  "{file_name}"  0\r\n')
+    return "".join(lines).encode()
+
+
+def run(line_counts: List[int] = LINE_COUNTS, repeat: int = 3) -> None:
+    """Times the conversion of each file size and prints the results.
+
+    Args:
+        line_counts: The number of track lines in each file.
+        repeat: The number of times each conversion is timed, the fastest is kept.
+    """
+    print(f"{'lines':>8} {'bytes':>10} {'seconds':>9} {'us/line':>8}")
+    for line_count in line_counts:
+        contents = make_contents(line_count)
+        converter = GdiConverter(file_contents=contents)
+        seconds = min(
+            timeit.repeat(converter.convert_file_contents, number=1, repeat=repeat)
+        )
+        per_line = seconds / line_count * 1e6
+        print(f"{line_count:>8} {len(contents):>10} {seconds:>9.4f} {per_line:>8.2f}")
+
+
+if __name__ == "__main__":
+    run()
@@ -1,15 +1,281 @@
 """Parses GDI formatted game dumps and formats them for
 consumption by the Madsheep SD card maker for GDEMU"""
 
+from functools import partial
+import json
+from pathlib import Path
 from sys import argv
-from typing import List
-from gdipak.arg_parser import ArgParser, OperatingMode
-from gdipak.file_utils import get_subdirs_in_dir, transpose_path
-from gdipak.packer import CopyPacker, MovePacker
+from typing import Callable, Collection, Iterable, List
+from gdipak.arg_parser import ArgParser, DedupMode, IoMode, OperatingMode, SyncMode
+from gdipak.copy_engine import CopyEngine, PipelineCopyEngine
+from gdipak.dedup import Duplicate, find_duplicates
+from gdipak.file_utils import GameDir, iter_game_dirs, transpose_path, write_name_file
+from gdipak.job_state import JobState
+from gdipak.pack_record import PackRecord
+from gdipak.packer import CopyPacker, LinkPacker, MovePacker
+from gdipak.planner import (
+    GamePlan,
+    PreflightError,
+    find_problems,
+    measure_throughput,
+    plan_game,
+    summarize,
+)
+from gdipak.redump import DatIndex
+from gdipak.scheduler import run_jobs
+from gdipak.sync import SyncBatch
 
 __version__ = 0.1
 
 
+def get_packer_class(mode: OperatingMode) -> type:
+    """Chooses the packer for the operating mode.
+
+    Args:
+        mode: The operating mode selected by the user.
+
+    Returns:
+        The packer class.
+    """
+    if mode == OperatingMode.MODIFY:
+        return MovePacker
+    if mode == OperatingMode.LINK:
+        return LinkPacker
+    return CopyPacker
+
+
+def get_copy_engine(args: dict) -> CopyEngine:
+    """Creates the copy engine for the I/O mode, pipelined if it was asked for. A
+    single engine is shared by every game of a run, so that what it learns about the
+    devices is kept.
+
+    Args:
+        args: The validated command line arguments.
+
+    Returns:
+        The copy engine.
+    """
+    engine_class = PipelineCopyEngine if args["pipeline"] else CopyEngine
+    return engine_class(
+        bulk=args["io_mode"] == IoMode.BULK, direct=args["io_mode"] == IoMode.DIRECT
+    )
+
+
+def find_games(args: dict) -> Iterable[GameDir]:
+    """Finds the games to package.
+
+    Args:
+        args: The validated command line arguments.
+
+    Returns:
+        The games, found lazily in recursive mode. The games are packaged as they
+        are found, so the output directory is never searched.
+    """
+    if args["recursive"] is None:
+        return [GameDir(args["in_dir"], None)]
+    return iter_game_dirs(args["in_dir"], exclude=args["out_dir"])
+
+
+def get_game_out_dir(game: GameDir, args: dict) -> Path:
+    """Gets the directory a game is packaged to.
+
+    Args:
+        game: The directory containing the game.
+        args: The validated command line arguments.
+
+    Returns:
+        The game's output directory.
+    """
+    if args["recursive"] is None:
+        return Path(args["out_dir"])
+    return transpose_path(game.path, args["in_dir"], args["out_dir"], args["recursive"])
+
+
+def package_game(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    game: GameDir,
+    args: dict,
+    state: JobState = None,
+    dat_index: DatIndex = None,
+    sync_batch: SyncBatch = None,
+    engine: CopyEngine = None,
+) -> None:
+    """Packages the game in a single directory, recording its progress if there is a
+    job state.
+
+    Args:
+        game: The directory containing the game. If its files are None the directory
+          is searched for them.
+        args: The validated command line arguments.
+        state: Optional. The job state of the run.
+        dat_index: Optional. The DAT to verify the game against.
+        sync_batch: Optional. The files to flush once the run is finished.
+        engine: Optional. The copy engine used to copy the files. If left None one
+          is created for the I/O mode.
+    """
+    if state is None:
+        _package_game(
+            game, args, dat_index=dat_index, sync_batch=sync_batch, engine=engine
+        )
+        return
+    done_tracks = state.start_game(game.path)
+    try:
+        _package_game(
+            game,
+            args,
+            done_tracks,
+            partial(state.track_done, game.path),
+            dat_index,
+            sync_batch,
+            engine,
+        )
+    except Exception as ex:
+        state.finish_game(game.path, ex)
+        raise
+    state.finish_game(game.path)
+
+
+def _package_game(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    game: GameDir,
+    args: dict,
+    done_tracks: Collection[Path] = (),
+    on_track_done: Callable[[Path], None] = None,
+    dat_index: DatIndex = None,
+    sync_batch: SyncBatch = None,
+    engine: CopyEngine = None,
+) -> None:
+    """Packages the game in a single directory.
+
+    Args:
+        game: The directory containing the game. If its files are None the directory
+          is searched for them.
+        args: The validated command line arguments.
+        done_tracks: Tracks that an earlier run already packaged.
+        on_track_done: Optional. Called with each track file once it is packaged.
+        dat_index: Optional. The DAT to verify the game against before it is packed.
+        sync_batch: Optional. The files to flush once the run is finished.
+        engine: Optional. The copy engine used to copy the files. If left None one
+          is created for the I/O mode.
+    """
+    game_out_dir = get_game_out_dir(game, args)
+    packer_class = get_packer_class(args["mode"])
+    packer_args = {}
+    if issubclass(packer_class, CopyPacker):
+        packer_args["engine"] = get_copy_engine(args) if engine is None else engine
+    packer = packer_class(
+        in_dir=game.path,
+        out_dir=game_out_dir,
+        game_files=game.files,
+        sync=args["sync"],
+        **packer_args,
+    )
+    record = PackRecord(game_out_dir) if args["incremental"] else None
+    if record and record.is_current(packer.game_files):
+        return
+    # A game that is being resumed was verified by the run that started it, and in
+    # 'MODIFY' mode some of its tracks are no longer where they were.
+    if dat_index and not done_tracks:
+        result = dat_index.verify_game(game.path, packer.game_files)
+        print(f"{game.path}: {result}")
+    # Only trust the earlier run if its output is still there.
+    skip_tracks = [file for file in done_tracks if packer.get_work_file(file).exists()]
+    packer.package_game(
+        create_name_file=args["namefile"],
+        track_jobs=args["track_jobs"],
+        skip_tracks=skip_tracks,
+        on_track_done=on_track_done,
+        checksums=args["checksums"],
+        sync_batch=sync_batch,
+    )
+    if record:
+        out_files = [packer.get_out_file(file) for file in packer.game_files]
+        record.save(packer.game_files, out_files)
+
+
+def link_duplicate(
+    duplicate: Duplicate, args: dict, sync_batch: SyncBatch = None
+) -> None:
+    """Hard links the packaged files of the original game into the duplicate's output
+    directory.
+
+    Args:
+        duplicate: The duplicate game. The original must already be packaged.
+        args: The validated command line arguments.
+        sync_batch: Optional. The files to flush once the run is finished.
+    """
+    original_out_dir = get_game_out_dir(duplicate.original, args)
+    packer = LinkPacker(
+        in_dir=duplicate.game.path,
+        out_dir=get_game_out_dir(duplicate.game, args),
+        game_files=duplicate.game.files,
+        sync=args["sync"],
+    )
+    out_files = []
+    for file in packer.game_files:
+        out_file = packer.get_out_file(file)
+        packer.file_action(original_out_dir / out_file.name, out_file)
+        out_files.append(out_file)
+    if args["namefile"]:
+        out_files.append(write_name_file(packer.out_dir, packer.gdi_file))
+    if args["sync"] == SyncMode.END and sync_batch is not None:
+        sync_batch.add_files(out_files)
+    elif args["sync"] != SyncMode.NONE:
+        batch = SyncBatch()
+        batch.add_files(out_files)
+        batch.flush()
+
+
+def plan_games(games: Iterable[GameDir], args: dict) -> List[GamePlan]:
+    """Plans packing the games without packing them.
+
+    Args:
+        games: The games to plan.
+        args: The validated command line arguments.
+
+    Returns:
+        The plan of each game.
+    """
+    game_plans = []
+    for game in games:
+        out_dir = get_game_out_dir(game, args)
+        planned = plan_game(game, out_dir, args["mode"])
+        game_files = [file.source for file in planned]
+        skip = bool(args["incremental"]) and PackRecord(out_dir).is_current(game_files)
+        game_plans.append(GamePlan(game, out_dir, planned, skip))
+    return game_plans
+
+
+def format_plan(
+    game_plans: List[GamePlan],
+    args: dict,
+    duplicates: List[Duplicate] = (),
+    problems: List[str] = (),
+) -> dict:
+    """Creates the printable form of a plan.
+
+    Args:
+        game_plans: The plan of each game.
+        args: The validated command line arguments.
+        duplicates: Optional. The games that were found to be duplicates.
+        problems: Optional. The problems found by the preflight checks.
+
+    Returns:
+        A JSON compatible dictionary of the plan of each game and the totals.
+    """
+    planned = []
+    for game_plan in game_plans:
+        if not game_plan.skip:
+            planned.extend(game_plan.files)
+    return {
+        "games": [game_plan.to_dict() for game_plan in game_plans],
+        "duplicates": [
+            {"game": str(duplicate.game), "original": str(duplicate.original)}
+            for duplicate in duplicates
+        ],
+        "problems": list(problems),
+        "totals": summarize(planned, measure_throughput(args["out_dir"])),
+    }
+
+
 def main(args: List[str] = None):
     """Normal execution when run as script.
 
@@ -20,27 +286,54 @@ def main(args: List[str] = None):
     arg_parser = ArgParser(__version__)
     args = arg_parser(args[1:])
 
-    in_dir = args["in_dir"]
-    recursive_mode = args["recursive"]
-    out_dir = args["out_dir"]
-    if args["mode"] == OperatingMode.MODIFY:
-        packer_class = MovePacker
-    else:
-        packer_class = CopyPacker
-
-    game_dirs = []
-    if recursive_mode is None:
-        game_dirs.append(in_dir)
-    elif recursive_mode is not None:
-        game_dirs.extend(get_subdirs_in_dir(in_dir))
-
-    for game_dir in game_dirs:
-        if recursive_mode is None:
-            game_out_dir = out_dir
+    dat_index = None if args["verify"] is None else DatIndex(args["verify"])
+    # In 'END' sync mode every written file is flushed once the run is finished.
+    sync_batch = SyncBatch() if args["sync"] == SyncMode.END else None
+    package = partial(
+        package_game,
+        args=args,
+        dat_index=dat_index,
+        sync_batch=sync_batch,
+        engine=get_copy_engine(args),
+    )
+    discover = partial(find_games, args)
+    duplicates = []
+    if args["dedup"] is not None:
+        # Every game has to be found before they can be compared.
+        unique_games, duplicates = find_duplicates(find_games(args))
+        discover = partial(list, unique_games)
+        if args["dedup"] == DedupMode.SKIP:
+            for duplicate in duplicates:
+                print(f"Skipping {duplicate}")
+
+    if args["plan"] or args["preflight"]:
+        games = list(discover())
+        discover = partial(list, games)
+        game_plans = plan_games(games, args)
+        # Checksums are computed from the copied data, so hashed files are not cloned.
+        problems = find_problems(game_plans, reflink=not args["checksums"])
+        if args["plan"]:
+            plan = format_plan(game_plans, args, duplicates, problems)
+            print(json.dumps(plan, indent=1))
+            return
+        if problems:
+            raise PreflightError(problems)
+
+    try:
+        if args["state_db"] is None:
+            run_jobs(package, discover(), args["jobs"])
         else:
-            game_out_dir = transpose_path(game_dir, in_dir, out_dir, recursive_mode)
-        packer = packer_class(in_dir=game_dir, out_dir=game_out_dir)
-        packer.package_game(create_name_file=args["namefile"])
+            with JobState(args["state_db"], args["in_dir"], args["out_dir"]) as state:
+                games = state.games(discover)
+                run_jobs(partial(package, state=state), games, args["jobs"])
+
+        if args["dedup"] == DedupMode.LINK:
+            link = partial(link_duplicate, args=args, sync_batch=sync_batch)
+            run_jobs(link, duplicates, args["jobs"])
+    finally:
+        # The games that were finished are flushed even if others failed.
+        if sync_batch is not None:
+            sync_batch.flush()
 
 
 if __name__ == "__main__":
@@ -6,6 +6,9 @@ from sys import exit as sys_exit
 
 from argparse import ArgumentParser
 
+from gdipak.checksums import MANIFEST_FILE_NAME
+from gdipak.pack_record import RECORD_FILE_NAME
+
 
 @enum.unique
 class RecursiveMode(enum.Enum):
@@ -29,6 +32,50 @@ class OperatingMode(enum.Enum):
     COPY = "COPY"
     # In move mode the input files are moved to the output directory and then modified.
     MODIFY = "MODIFY"
+    # In link mode the output track files are hard links to the input files, only the
+    # GDI file is copied. The input files are not modified.
+    LINK = "LINK"
+
+
+@enum.unique
+class DedupMode(enum.Enum):
+    """Enum for what is done with games that are copies of other games."""
+
+    # Duplicates are not packed.
+    SKIP = "SKIP"
+    # The duplicate's output files are hard links to the original's output files.
+    LINK = "LINK"
+
+
+@enum.unique
+class SyncMode(enum.Enum):
+    """Enum for how often the written files are flushed to the output device."""
+
+    # Files are never flushed, the operating system writes them when it chooses.
+    # Fastest, but a power cut can corrupt any game written shortly before it.
+    NONE = "NONE"
+    # Each game's files are flushed together once the game is written, before it is
+    # published to its output directory.
+    GAME = "GAME"
+    # Each file is flushed as soon as it is written. Slowest.
+    FILE = "FILE"
+    # Every file is flushed together once the whole run is finished.
+    END = "END"
+
+
+@enum.unique
+class IoMode(enum.Enum):
+    """Enum for how copied data passes through the page cache."""
+
+    # Data is read and written through the page cache as usual.
+    BUFFERED = "BUFFERED"
+    # The copied data is dropped from the page cache as the copy goes on, so the
+    # amount of memory packing uses for the cache stays the same however many games
+    # are packed.
+    BULK = "BULK"
+    # Like 'BULK', and the data bypasses the page cache entirely on the file systems
+    # that support it.
+    DIRECT = "DIRECT"
 
 
 class ArgParser:
@@ -89,11 +136,43 @@ class ArgParser:
 
         args["mode"] = OperatingMode(args["mode"])
 
+        self.__validate_run_args(args)
+
         if args["recursive"] is not None:
             args["recursive"] = RecursiveMode(args["recursive"])
 
+        if args["dedup"] is not None:
+            args["dedup"] = DedupMode(args["dedup"])
+
+        args["sync"] = SyncMode(args["sync"])
+
+        args["io_mode"] = IoMode(args["io_mode"])
+
         return args
 
+    def __validate_run_args(self, args: dict) -> None:
+        """Validates the arguments that control how the run is carried out. Exits on
+        failure.
+
+        Args:
+            args: A dictionary of args from argparse, with the mode converted.
+        """
+        if args["verify"] is not None and not Path(args["verify"]).is_file():
+            print("DAT file is not a file.")
+            sys_exit(0)
+
+        if args["jobs"] < 1:
+            print("Jobs must be a positive number.")
+            sys_exit(0)
+
+        if args["track_jobs"] < 1:
+            print("Track jobs must be a positive number.")
+            sys_exit(0)
+
+        if args["incremental"] and args["mode"] == OperatingMode.MODIFY:
+            print("Incremental mode can not be used with 'MODIFY' mode.")
+            sys_exit(0)
+
     def __setup(self) -> ArgumentParser:
         """Creates the argument parser.
 
@@ -143,7 +222,7 @@ class ArgParser:
             "-m",
             "--mode",
             action="store",
-            choices=("COPY", "MODIFY"),
+            choices=("COPY", "MODIFY", "LINK"),
             type=str.upper,
             dest="mode",
             required=True,
@@ -151,7 +230,12 @@ class ArgParser:
                 will not be moved, modified, or deleted. In 'MODIFY' mode the input
                 files will be moved to the output directory and then edited in
                 place. Note that 'COPY' mode will use roughly 2x the initial disk
-                space.""",
+                space, unless the output is on the same copy-on-write file system
+                (btrfs, XFS) as the input, in which case the copies share the
+                original files' data. In 'LINK' mode the output track files are
+                hard links to the input files and only the GDI file is copied, the
+                original files are not modified. If the output is on a different
+                file system than the input the track files are copied instead.""",
         )
         parser.add_argument(
             "-r",
@@ -179,5 +263,145 @@ class ArgParser:
             help="""If specified will create a *.txt file with the original name of the
             *.gdi file""",
         )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            action="store",
+            type=int,
+            default=1,
+            dest="jobs",
+            required=False,
+            help="""The number of games to process at the same time. Only useful with
+                the 'recursive' argument. Defaults to 1.""",
+            metavar="N",
+        )
+        parser.add_argument(
+            "-t",
+            "--track-jobs",
+            action="store",
+            type=int,
+            default=1,
+            dest="track_jobs",
+            required=False,
+            help="""The number of track files of each game to process at the same
+                time. Defaults to 1.""",
+            metavar="N",
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            dest="incremental",
+            required=False,
+            help=f"""If specified a {RECORD_FILE_NAME} file is written to each game's
+                output directory, and games whose source files and output files have
+                not changed since they were last packed are skipped. Can not be used
+                with 'MODIFY' mode.""",
+        )
+        parser.add_argument(
+            "--state-db",
+            action="store",
+            dest="state_db",
+            required=False,
+            help="""A database file used to record the progress of the run. If the
+                run is interrupted, running again with the same database resumes
+                where it stopped. Games and tracks that were finished are skipped.""",
+            metavar="DATABASE_FILE",
+        )
+        parser.add_argument(
+            "--checksums",
+            action="store_true",
+            dest="checksums",
+            required=False,
+            help=f"""If specified a {MANIFEST_FILE_NAME} file with the size, CRC32, MD5
+                and SHA-1 of each output file is written to each game's output
+                directory. The checksums are computed while the files are copied.""",
+        )
+        parser.add_argument(
+            "--verify",
+            action="store",
+            dest="verify",
+            required=False,
+            help="""A Redump DAT file. If specified the tracks of each game are
+                checked against it before the game is packed, and each game is
+                reported as a match, a bad dump or an unknown dump. Checking reads
+                every track once more to compute its SHA-1.""",
+            metavar="DAT_FILE",
+        )
+        parser.add_argument(
+            "--dedup",
+            action="store",
+            choices=("SKIP", "LINK"),
+            type=str.upper,
+            dest="dedup",
+            required=False,
+            help="""If specified games whose tracks are the same as those of another
+                game are found before packing starts. Only the first copy is packed.
+                In 'SKIP' mode the other copies are left out of the output. In
+                'LINK' mode their output files are hard links to the first copy's
+                output files.""",
+        )
+        parser.add_argument(
+            "--plan",
+            action="store_true",
+            dest="plan",
+            required=False,
+            help="""If specified nothing is packed. Instead the source, destination,
+                action and size of every file that would be packed is printed as
+                JSON, along with the totals and an estimate of how long packing
+                would take. The estimate is based on a short write to the output
+                directory.""",
+        )
+        parser.add_argument(
+            "--preflight",
+            action="store_true",
+            dest="preflight",
+            required=False,
+            help="""If specified every game is found and checked before any are
+                packed. The run stops without packing anything if an output device
+                does not have enough free space for the files that will be copied,
+                or if two games would be packed to the same output directory.""",
+        )
+        parser.add_argument(
+            "--sync",
+            action="store",
+            choices=("NONE", "GAME", "FILE", "END"),
+            type=str.upper,
+            default="NONE",
+            dest="sync",
+            required=False,
+            help="""Chooses when the written files are flushed to the output device,
+                trading speed for safety against power cuts. In 'NONE' mode files
+                are never flushed. In 'GAME' mode each game's files are flushed
+                together once the game is written. In 'FILE' mode each file is
+                flushed as soon as it is written. In 'END' mode every file is
+                flushed once the run is finished. Defaults to 'NONE'.""",
+        )
+        parser.add_argument(
+            "--io-mode",
+            action="store",
+            choices=("BUFFERED", "BULK", "DIRECT"),
+            type=str.upper,
+            default="BUFFERED",
+            dest="io_mode",
+            required=False,
+            help="""Chooses how copied data passes through the page cache. In
+                'BUFFERED' mode it is cached as usual. In 'BULK' mode the kernel is
+                told the files are read sequentially and the copied data is dropped
+                from the cache as the copy goes on, so packing a large library does
+                not push everything else out of memory. 'DIRECT' mode is like
+                'BULK', and uses O_DIRECT so the data bypasses the cache entirely
+                where the file system supports it. Defaults to 'BUFFERED'.""",
+        )
+        parser.add_argument(
+            "--pipeline",
+            action="store_true",
+            dest="pipeline",
+            required=False,
+            help="""If specified, copied files are read on one thread while they are
+                written on another. Files on different devices are then always
+                copied through gdipak rather than inside the kernel, so that the
+                source keeps reading while the destination writes. Try it when
+                copying from a slow hard disk to an SD card.""",
+        )
 
         return parser
@@ -0,0 +1,98 @@
+"""Checksums of game files and the per-game checksum manifest."""
+
+import hashlib
+from pathlib import Path
+from typing import Dict
+import zlib
+
+from gdipak.copy_engine import DEFAULT_BLOCK_SIZE
+
+ALGORITHMS = ("crc32", "md5", "sha1")
+# Written to each game's output directory, next to disc.gdi.
+MANIFEST_FILE_NAME = "checksums.txt"
+
+
+class MultiHasher:
+    """Computes the size and all of the checksums of some data in a single pass."""
+
+    def __init__(self) -> None:
+        self.size = 0
+        self._crc32 = 0
+        # Used to identify dumps, not for security.
+        self._hashes = {
+            "md5": hashlib.md5(usedforsecurity=False),
+            "sha1": hashlib.sha1(usedforsecurity=False),
+        }
+
+    def update(self, data: bytes | memoryview) -> None:
+        """Adds more data.
+
+        Args:
+            data: The next part of the data.
+        """
+        self.size += len(data)
+        self._crc32 = zlib.crc32(data, self._crc32)
+        for hasher in self._hashes.values():
+            hasher.update(data)
+
+    def hexdigests(self) -> Dict[str, str]:
+        """Gets the checksums of the data so far.
+
+        Returns:
+            A dictionary of algorithm name to lower case hex digest.
+        """
+        digests = {"crc32": f"{self._crc32:08x}"}
+        for name, hasher in self._hashes.items():
+            digests[name] = hasher.hexdigest()
+        return digests
+
+
+def hash_file(
+    file_path: str | Path,
+    hasher: MultiHasher = None,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> MultiHasher:
+    """Computes the checksums of a file.
+
+    Args:
+        file_path: The file to read.
+        hasher: Optional. The hasher to add the file's contents to, a hashlib hash
+          object can be given too. If left None a new MultiHasher is created.
+        block_size: The number of bytes to read at a time.
+
+    Returns:
+        The hasher.
+    """
+    hasher = MultiHasher() if hasher is None else hasher
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    with open(file_path, "rb", buffering=0) as file:
+        while True:
+            read = file.readinto(buffer)
+            if not read:
+                break
+            hasher.update(view[:read])
+    return hasher
+
+
+def write_manifest(out_dir: str | Path, hashers: Dict[str, MultiHasher]) -> Path:
+    """Writes the checksums of a game's files.
+
+    Each line holds the size, the checksums in the order of ALGORITHMS and the name
+    of one file, separated by spaces.
+
+    Args:
+        out_dir: The game's output directory.
+        hashers: A dictionary of file name to the hasher of that file's contents.
+
+    Returns:
+        The path to the manifest.
+    """
+    lines = ["# size " + " ".join(ALGORITHMS) + " name\n"]
+    for name in sorted(hashers):
+        digests = hashers[name].hexdigests()
+        checksums = " ".join(digests[algorithm] for algorithm in ALGORITHMS)
+        lines.append(f"{hashers[name].size} {checksums} {name}\n")
+    manifest_path = Path(out_dir) / MANIFEST_FILE_NAME
+    manifest_path.write_text("".join(lines), encoding="UTF-8")
+    return manifest_path
@@ -0,0 +1,648 @@
+"""Copy engine used to duplicate track data from the input files to the output
+files."""
+
+import ctypes
+import errno
+import mmap
+import os
+from pathlib import Path
+import queue
+import tempfile
+import threading
+from typing import List, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Not available on Windows, which has no reflink support to offer anyway.
+    fcntl = None
+
+# The default amount of data moved per read/write call. Large enough to keep the
+# number of system calls low, small enough that memory use stays flat no matter how
+# big a track is.
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+# The amount of data requested per kernel copy call. The kernel never needs a buffer
+# for this, so it is only limited by what a single call will accept.
+KERNEL_COPY_SIZE = 1024 * 1024 * 1024
+# Errors raised by the kernel copy calls when the files or file systems involved do
+# not support them. Any of these means "try the next method", not "the copy failed".
+UNSUPPORTED_ERRNOS = frozenset(
+    (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP)
+)
+# The number of buffers passed between the reader and writer threads of a pipelined
+# copy. Two keep both devices busy, the others absorb differences in speed.
+DEFAULT_BUFFER_COUNT = 4
+# In bulk mode, the amount of data copied between requests to drop the copied data
+# from the page cache. Bounds the cache used by a copy however big the file is.
+BULK_WINDOW_SIZE = 16 * 1024 * 1024
+# The alignment of the buffers, offsets and lengths of O_DIRECT reads and writes. A
+# page is a multiple of the logical block size of all common devices.
+DIRECT_ALIGNMENT = mmap.PAGESIZE
+# The ioctl request that makes the destination file share the source file's blocks
+# on copy-on-write file systems (btrfs, XFS, bcachefs...). From linux/fs.h.
+FICLONE = 0x40049409
+# File systems that do not know about FICLONE reject it as an unknown ioctl.
+REFLINK_UNSUPPORTED_ERRNOS = UNSUPPORTED_ERRNOS | {errno.ENOTTY}
+# The fallocate mode that allocates blocks without changing the file's size. From
+# linux/falloc.h.
+FALLOC_FL_KEEP_SIZE = 0x01
+
+try:
+    _LIBC = ctypes.CDLL(None, use_errno=True)
+    # fallocate64 takes 64 bit offsets on every platform. musl only has fallocate,
+    # whose offsets are always 64 bit.
+    _FALLOCATE = getattr(_LIBC, "fallocate64", None) or _LIBC.fallocate
+except (AttributeError, OSError, TypeError):  # pragma: no cover
+    # Only Linux has fallocate.
+    _FALLOCATE = None
+else:
+    _FALLOCATE.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64)
+    _FALLOCATE.restype = ctypes.c_int
+
+
+def fallocate(fd: int, mode: int, offset: int, length: int) -> None:
+    """Allocates space in a file with the fallocate system call, which the os module
+    does not expose. Unlike os.posix_fallocate, it never falls back to writing
+    zeros when the file system can not allocate space ahead of time.
+
+    Args:
+        fd: A file descriptor open for writing.
+        mode: FALLOC_FL_* flags, or 0.
+        offset: The start of the range to allocate.
+        length: The length of the range to allocate.
+
+    Raises:
+        OSError if the space could not be allocated.
+    """
+    if _FALLOCATE(fd, mode, offset, length) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+
+def _copy_file_range(src_fd: int, dst_fd: int, count: int) -> int:
+    """Copies data between two files without it leaving the kernel."""
+    return os.copy_file_range(src_fd, dst_fd, count)
+
+
+def _sendfile(src_fd: int, dst_fd: int, count: int) -> int:
+    """Copies data between two files without it leaving the kernel."""
+    return os.sendfile(dst_fd, src_fd, None, count)
+
+
+# The kernel copy methods available on this platform, in order of preference.
+KERNEL_COPY_METHODS = tuple(
+    method
+    for name, method in (
+        ("copy_file_range", _copy_file_range),
+        ("sendfile", _sendfile),
+    )
+    if hasattr(os, name)
+)
+
+
+def supports_reflink(directory: str | Path) -> bool:
+    """Checks if files in a directory can be cloned, by cloning a temporary file.
+
+    Args:
+        directory: An existing directory.
+
+    Returns:
+        True if the directory's file system supports cloning files.
+    """
+    if fcntl is None:  # pragma: no cover
+        return False
+    with tempfile.TemporaryFile(dir=directory) as src, tempfile.TemporaryFile(
+        dir=directory
+    ) as dst:
+        src.write(bytes(4096))
+        src.flush()
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError as ex:
+            if ex.errno not in REFLINK_UNSUPPORTED_ERRNOS:
+                raise
+            return False
+    return True
+
+
+def is_same_file(in_file: str | Path, out_file: str | Path) -> bool:
+    """Checks if two paths name the same file, however they are written. Relative
+    and absolute paths, symbolic links and hard links to the file all match.
+
+    Args:
+        in_file: An existing file.
+        out_file: Another path. It does not have to exist.
+
+    Returns:
+        True if out_file exists and is in_file.
+    """
+    return os.path.exists(out_file) and os.path.samefile(in_file, out_file)
+
+
+def _open_direct(path: str, flags: int) -> int:
+    """Opens a file with O_DIRECT, or without it if its file system does not support
+    it. Used as the opener of open().
+
+    Args:
+        path: The file.
+        flags: The flags open() chose for the mode.
+
+    Returns:
+        The file descriptor.
+    """
+    try:
+        return os.open(path, flags | os.O_DIRECT, 0o666)
+    except OSError as ex:
+        if ex.errno != errno.EINVAL:
+            raise
+        return os.open(path, flags, 0o666)
+
+
+def _is_direct(file) -> bool:
+    """Checks if a file was opened with O_DIRECT.
+
+    Args:
+        file: A file object.
+
+    Returns:
+        True if reads and writes bypass the page cache.
+    """
+    return bool(fcntl.fcntl(file.fileno(), fcntl.F_GETFL) & os.O_DIRECT)
+
+
+class CopyEngine:
+    """Clones files on copy-on-write file systems, copies them inside the kernel
+    when the platform allows it, otherwise copies them in fixed size blocks through
+    a single reusable buffer. Files that are not cloned have their full size
+    allocated before any data is written.
+
+    In bulk mode the copies keep out of the page cache, so that packing a whole
+    library does not push everything else out of memory."""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        zero_copy: bool = True,
+        reflink: bool = True,
+        preallocate: bool = True,
+        bulk: bool = False,
+        direct: bool = False,
+    ) -> None:
+        """Setup the copy engine.
+
+        Args:
+            block_size: The number of bytes to read and write at a time when the
+              data has to pass through this process.
+            zero_copy: If True, copy_file_range and then sendfile are tried before
+              falling back to copying through this process.
+            reflink: If True, the output file shares the input file's data blocks
+              when both are on the same copy-on-write file system.
+            preallocate: If True, the output file's blocks are allocated all at
+              once before the data is written, so the file system can keep them
+              together rather than growing the file a block at a time. Unfragmented
+              tracks load faster on GDEMU's FAT32 SD cards.
+            bulk: If True, the kernel is told the input file is read sequentially,
+              and the copied data of both files is dropped from the page cache as
+              the copy goes on. Output data is dropped once it has been written to
+              the device.
+            direct: If True, implies bulk. Files are opened with O_DIRECT, so the
+              data bypasses the page cache entirely, on the file systems that
+              support it. The data then always passes through this process, in
+              page aligned blocks.
+
+        Raises:
+            ValueError if block_size is not a positive number.
+        """
+        if block_size < 1:
+            raise ValueError("block_size must be a positive number of bytes")
+        self.direct = direct and hasattr(os, "O_DIRECT")
+        if self.direct:
+            # Rounded up to a whole number of aligned blocks.
+            block_size = -(-block_size // DIRECT_ALIGNMENT) * DIRECT_ALIGNMENT
+        self.block_size = block_size
+        self.zero_copy = zero_copy
+        self.reflink = reflink and fcntl is not None
+        self.preallocate = preallocate and _FALLOCATE is not None
+        self.bulk = (bulk or direct) and hasattr(os, "posix_fadvise")
+        # (source device, destination device) pairs on which cloning has failed,
+        # so that a library on a file system without reflinks only pays once.
+        self._no_reflink_devices = set()
+
+    def __call__(
+        self,
+        in_file: str | Path,
+        out_file: str | Path,
+        hasher=None,
+        sync: bool = False,
+    ) -> int:
+        """Copies the contents of in_file to out_file.
+
+        Args:
+            in_file: a path to a file from which to copy data.
+            out_file: a path to which to write the data. Will be created or
+              truncated.
+            hasher: Optional. An object with an update method, such as a
+              checksums.MultiHasher, that is given all of the data as it is copied.
+              The data has to pass through this process for that, so the file is
+              neither cloned nor copied inside the kernel.
+            sync: If True, out_file is flushed to its device before it is closed.
+
+        Returns:
+            The number of bytes copied. A file copied onto itself is left as it is,
+            its size is returned.
+        """
+        if is_same_file(in_file, out_file):
+            # Opening out_file would truncate in_file before it is read.
+            with open(in_file, "rb", buffering=0) as src:
+                return self._read_all(src, hasher)
+        opener = _open_direct if self.direct else None
+        with open(in_file, "rb", buffering=0, opener=opener) as src, open(
+            out_file, "wb", buffering=0, opener=opener
+        ) as dst:
+            copied = self._copy(src, dst, hasher)
+            if sync:
+                os.fsync(dst.fileno())
+        return copied
+
+    def _copy(self, src, dst, hasher=None) -> int:
+        """Copies from one file to another with the fastest method available.
+
+        Args:
+            src: A file object opened for reading in binary mode.
+            dst: An empty file object opened for writing in binary mode.
+            hasher: Optional. Given all of the data as it is copied.
+
+        Returns:
+            The number of bytes copied.
+        """
+        if hasher is None and self.reflink and self._clone(src, dst):
+            return os.fstat(dst.fileno()).st_size
+        allocated = self._preallocate(src, dst) if self.preallocate else 0
+        if self.bulk:
+            os.posix_fadvise(src.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        src_direct = self.direct and _is_direct(src)
+        dst_direct = self.direct and _is_direct(dst)
+        if hasher is not None or src_direct or dst_direct:
+            copied = self._stream_copy(src, dst, hasher, src_direct or dst_direct)
+        else:
+            copied = 0
+            finished = False
+            if self.zero_copy:
+                copied, finished = self._kernel_copy(src, dst)
+            if not finished:
+                # Both files' offsets are where the kernel copy left them.
+                copied += self._stream_copy(src, dst)
+        if copied != os.fstat(dst.fileno()).st_size or copied < allocated:
+            # The input file shrank while it was copied, leaving allocated space
+            # past the end of the output file, or the last block was padded to be
+            # written with O_DIRECT.
+            os.ftruncate(dst.fileno(), copied)
+        if self.bulk:
+            self._drop_cache(src, dst)
+        return copied
+
+    @staticmethod
+    def _preallocate(src, dst) -> int:
+        """Allocates space for all of src's data in dst, without changing dst's
+        size. Nothing is done if the file system does not support allocating space
+        ahead of time.
+
+        Allocating with posix_fallocate would grow dst to its full size, which FAT
+        does by writing zeros to the whole file, and which glibc does the same way
+        on the file systems that do not support fallocate. The data would then be
+        written twice. FAT allocates the clusters without writing them when the
+        size is kept.
+
+        Args:
+            src: A file object opened for reading in binary mode.
+            dst: An empty file object opened for writing in binary mode.
+
+        Returns:
+            The number of bytes allocated.
+
+        Raises:
+            OSError if there is not enough free space.
+        """
+        size = os.fstat(src.fileno()).st_size
+        if not size:
+            return 0
+        try:
+            fallocate(dst.fileno(), FALLOC_FL_KEEP_SIZE, 0, size)
+        except OSError as ex:
+            if ex.errno not in UNSUPPORTED_ERRNOS:
+                raise
+            return 0
+        return size
+
+    @staticmethod
+    def _drop_cache(src, dst, length: int = 0) -> None:
+        """Asks the kernel to drop the start of both files from the page cache.
+
+        Pages of dst that have not been written to the device yet are kept, so the
+        whole copied range is given each time to also drop the pages that were
+        still being written the time before.
+
+        Args:
+            src: A file object opened for reading in binary mode.
+            dst: A file object opened for writing in binary mode.
+            length: The number of bytes from the start of the files. If 0 the whole
+              of both files is dropped.
+        """
+        for file in (src, dst):
+            os.posix_fadvise(file.fileno(), 0, length, os.POSIX_FADV_DONTNEED)
+
+    def _clone(self, src, dst) -> bool:
+        """Makes dst share src's data blocks without copying them.
+
+        Args:
+            src: A file object opened for reading in binary mode.
+            dst: An empty file object opened for writing in binary mode.
+
+        Returns:
+            True if the file was cloned, False if the file systems do not support it.
+        """
+        devices = (os.fstat(src.fileno()).st_dev, os.fstat(dst.fileno()).st_dev)
+        if devices in self._no_reflink_devices:
+            return False
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError as ex:
+            if ex.errno not in REFLINK_UNSUPPORTED_ERRNOS:
+                raise
+            self._no_reflink_devices.add(devices)
+            return False
+        return True
+
+    def _kernel_copy(self, src, dst) -> Tuple[int, bool]:
+        """Copies from one file to another using the kernel copy methods.
+
+        Each method continues from the current file offsets, so a method that turns
+        out to be unsupported part way through hands off to the next one without
+        losing or repeating any data.
+
+        Args:
+            src: A file object opened for reading in binary mode.
+            dst: A file object opened for writing in binary mode.
+
+        Returns:
+            2-tuple:
+            - The number of bytes copied.
+            - True if the whole file was copied, False if no method could finish.
+        """
+        # In bulk mode the cache is dropped after every window.
+        count = BULK_WINDOW_SIZE if self.bulk else KERNEL_COPY_SIZE
+        copied = 0
+        for method in KERNEL_COPY_METHODS:
+            try:
+                while True:
+                    sent = method(src.fileno(), dst.fileno(), count)
+                    if not sent:
+                        return copied, True
+                    copied += sent
+                    if self.bulk:
+                        self._drop_cache(src, dst, src.tell())
+            except OSError as ex:
+                if ex.errno not in UNSUPPORTED_ERRNOS:
+                    raise
+        return copied, False
+
+    def _stream_copy(self, src, dst, hasher=None, direct: bool = False) -> int:
+        """Copies from one unbuffered file object to another.
+
+        The buffer is allocated once per copy and refilled in place with readinto,
+        so the amount of memory used does not depend on the size of the file.
+
+        Args:
+            src: A file object opened for reading in binary mode.
+            dst: A file object opened for writing in binary mode.
+            hasher: Optional. Given each block of data as it is copied.
+            direct: If True, one of the files was opened with O_DIRECT. The buffer
+              is page aligned and the last block is padded to a whole number of
+              aligned blocks, the caller has to cut dst back to the data copied.
+
+        Returns:
+            The number of bytes copied.
+        """
+        buffer = self._new_buffer(direct)
+        view = memoryview(buffer)
+        copied = 0
+        dropped = 0
+        while True:
+            read = src.readinto(buffer)
+            if not read:
+                break
+            if hasher is not None:
+                hasher.update(view[:read])
+            self._write_block(dst, view, read, direct)
+            copied += read
+            if self.bulk and copied - dropped >= BULK_WINDOW_SIZE:
+                self._drop_cache(src, dst, src.tell())
+                dropped = copied
+        return copied
+
+    def _read_all(self, src, hasher=None) -> int:
+        """Reads a file without copying it.
+
+        Args:
+            src: A file object opened for reading in binary mode.
+            hasher: Optional. Given each block of data as it is read.
+
+        Returns:
+            The number of bytes in the file.
+        """
+        if hasher is None:
+            return os.fstat(src.fileno()).st_size
+        buffer = self._new_buffer()
+        view = memoryview(buffer)
+        size = 0
+        while True:
+            read = src.readinto(buffer)
+            if not read:
+                return size
+            hasher.update(view[:read])
+            size += read
+
+    def _new_buffer(self, direct: bool = False) -> bytearray | mmap.mmap:
+        """Allocates a buffer of one block.
+
+        Args:
+            direct: If True, the buffer is page aligned for O_DIRECT.
+
+        Returns:
+            The buffer.
+        """
+        if direct:
+            # Anonymous memory maps are always page aligned.
+            return mmap.mmap(-1, self.block_size)
+        return bytearray(self.block_size)
+
+    @classmethod
+    def _write_block(cls, dst, view: memoryview, read: int, direct: bool) -> None:
+        """Writes the data read into a buffer.
+
+        Args:
+            dst: A file object opened for writing in binary mode.
+            view: A view of the whole buffer.
+            read: The number of bytes read into the buffer.
+            direct: If True, dst may have been opened with O_DIRECT. A partial block
+              is padded with zeros to a whole number of aligned blocks.
+        """
+        length = read
+        # Regular files only return a partial block at their end.
+        if direct and read % DIRECT_ALIGNMENT:
+            length = -(-read // DIRECT_ALIGNMENT) * DIRECT_ALIGNMENT
+            view[read:length] = bytes(length - read)
+        cls._write_all(dst, view[:length])
+
+    @staticmethod
+    def _write_all(dst, data: memoryview) -> None:
+        """Writes all of the data, unbuffered writes are allowed to be partial.
+
+        Args:
+            dst: A file object opened for writing in binary mode.
+            data: The bytes to write.
+        """
+        while data:
+            written = dst.write(data)
+            data = data[written:]
+
+
+class PipelineCopyEngine(CopyEngine):
+    """A copy engine that reads and writes at the same time.
+
+    When the data passes through this process, a reader thread fills a small ring
+    of buffers while the calling thread writes the filled ones, so that the source
+    device keeps reading while the destination device writes. Files on different
+    devices are always copied this way, as the kernel copy methods also read and
+    write in turn. Files on the same device are still copied inside the kernel.
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, buffer_count: int = DEFAULT_BUFFER_COUNT, **kwargs) -> None:
+        """Setup the copy engine.
+
+        Args:
+            buffer_count: The number of buffers passed between the threads. Each
+              holds one block, so a copy uses buffer_count * block_size bytes.
+            kwargs: Passed to CopyEngine.
+
+        Raises:
+            ValueError if buffer_count is less than 2 or block_size is not a
+            positive number.
+        """
+        if buffer_count < 2:
+            raise ValueError("buffer_count must be at least 2")
+        super().__init__(**kwargs)
+        self.buffer_count = buffer_count
+
+    def _kernel_copy(self, src, dst) -> Tuple[int, bool]:
+        """Copies from one file to another using the kernel copy methods, unless the
+        files are on different devices.
+
+        Args:
+            src: A file object opened for reading in binary mode.
+            dst: A file object opened for writing in binary mode.
+
+        Returns:
+            2-tuple:
+            - The number of bytes copied.
+            - True if the whole file was copied, False if the rest of the file has
+              to be copied through this process.
+        """
+        if os.fstat(src.fileno()).st_dev != os.fstat(dst.fileno()).st_dev:
+            return 0, False
+        return super()._kernel_copy(src, dst)
+
+    def _stream_copy(self, src, dst, hasher=None, direct: bool = False) -> int:
+        """Copies from one unbuffered file object to another, reading the next
+        blocks on a separate thread while the current one is written.
+
+        The buffers are allocated once per copy and passed between the threads
+        through two queues, the filled buffers to the writer and the written ones
+        back to the reader, so at most buffer_count blocks are read ahead.
+
+        Args:
+            src: A file object opened for reading in binary mode.
+            dst: A file object opened for writing in binary mode.
+            hasher: Optional. Given each block of data as it is copied.
+            direct: If True, one of the files was opened with O_DIRECT. See
+              CopyEngine._stream_copy.
+
+        Returns:
+            The number of bytes copied.
+
+        Raises:
+            The error raised by the reader thread, if any.
+        """
+        buffers = [self._new_buffer(direct) for _ in range(self.buffer_count)]
+        views = [memoryview(buffer) for buffer in buffers]
+        free = queue.Queue()
+        for index in range(self.buffer_count):
+            free.put(index)
+        filled = queue.Queue()
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=self._read_blocks,
+            args=(src, buffers, free, filled, stop),
+            daemon=True,
+        )
+        thread.start()
+        copied = 0
+        dropped = 0
+        try:
+            while True:
+                index, read = filled.get()
+                if index is None:
+                    raise read
+                if not read:
+                    break
+                if hasher is not None:
+                    hasher.update(views[index][:read])
+                self._write_block(dst, views[index], read, direct)
+                copied += read
+                free.put(index)
+                if self.bulk and copied - dropped >= BULK_WINDOW_SIZE:
+                    # The reader is ahead, only the data written so far is dropped.
+                    self._drop_cache(src, dst, copied)
+                    dropped = copied
+        finally:
+            # Wakes the reader if it is waiting for a buffer after a failed write.
+            stop.set()
+            free.put(0)
+            thread.join()
+        return copied
+
+    @staticmethod
+    def _read_blocks(
+        src,
+        buffers: List[bytearray | mmap.mmap],
+        free: queue.Queue,
+        filled: queue.Queue,
+        stop: threading.Event,
+    ) -> None:
+        """Fills the free buffers with the next blocks of src, until the end of the
+        file or until the copy is stopped. Run by the reader thread.
+
+        Args:
+            src: A file object opened for reading in binary mode.
+            buffers: The ring of buffers.
+            free: The indexes of the buffers that can be filled.
+            filled: Given the (index, bytes read) of each filled buffer, ending with
+              0 bytes read at the end of the file, or (None, error) if reading
+              failed.
+            stop: Set when the copy stops before the end of the file.
+        """
+        try:
+            while True:
+                index = free.get()
+                if stop.is_set():
+                    return
+                read = src.readinto(buffers[index])
+                filled.put((index, read))
+                if not read:
+                    return
+        except Exception as ex:  # pylint: disable=broad-except
+            filled.put((None, ex))
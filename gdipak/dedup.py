@@ -0,0 +1,150 @@
+"""Finds games in the library that are copies of each other."""
+
+import hashlib
+from pathlib import Path
+from typing import Callable, Dict, Hashable, Iterable, List, NamedTuple, Tuple
+
+from gdipak import file_utils
+from gdipak.checksums import hash_file
+from gdipak.file_utils import GameDir
+
+# The number of bytes at the start of each track that are hashed before deciding
+# whether the whole track needs to be hashed.
+PARTIAL_HASH_SIZE = 64 * 1024
+
+
+class Duplicate(NamedTuple):
+    """A game that is a copy of another game."""
+
+    game: GameDir
+    original: GameDir
+
+    def __str__(self) -> str:
+        return f"{self.game} is a duplicate of {self.original}"
+
+
+def find_duplicates(games: Iterable[GameDir]) -> Tuple[List[GameDir], List[Duplicate]]:
+    """Splits the games into originals and duplicates. Two games are the same if
+    their tracks have the same contents, the names of the files and the GDI file are
+    not compared.
+
+    The games are compared in stages. Only the games whose tracks have the same
+    sizes have the start of their tracks hashed, and only the games that are still
+    alike after that have their tracks fully hashed. Most tracks are never read in
+    full.
+
+    Args:
+        games: The games. They all have to be known before any can be compared, so
+          the iterable is read to the end.
+
+    Returns:
+        2-tuple:
+        - The games that are not duplicates, in the order they were given. The
+          first of each set of copies is kept.
+        - The duplicates, in the order they were given.
+    """
+    games = [
+        (
+            game
+            if game.files is not None
+            else GameDir(game.path, file_utils.get_game_files_in_dir(game.path))
+        )
+        for game in games
+    ]
+    # A game without tracks has nothing to compare.
+    groups = [[game for game in games if _get_tracks(game)]]
+    for fingerprint in (_track_sizes, _partial_hashes, _full_hashes):
+        groups = _split_groups(groups, fingerprint)
+    originals = {}
+    for group in groups:
+        for game in group[1:]:
+            originals[game.path] = group[0]
+    unique = [game for game in games if game.path not in originals]
+    duplicates = [
+        Duplicate(game, originals[game.path])
+        for game in games
+        if game.path in originals
+    ]
+    return unique, duplicates
+
+
+def _split_groups(
+    groups: List[List[GameDir]], fingerprint: Callable[[GameDir], Hashable]
+) -> List[List[GameDir]]:
+    """Splits groups of games that might be the same by a closer comparison.
+
+    Args:
+        groups: The groups of games.
+        fingerprint: Gets a value from a game that is equal for games that might be
+          the same.
+
+    Returns:
+        The new groups. Games that are unlike every other game are left out.
+    """
+    new_groups = []
+    for group in groups:
+        by_fingerprint: Dict[Hashable, List[GameDir]] = {}
+        for game in group:
+            by_fingerprint.setdefault(fingerprint(game), []).append(game)
+        new_groups.extend(
+            new_group for new_group in by_fingerprint.values() if len(new_group) > 1
+        )
+    return new_groups
+
+
+def _get_tracks(game: GameDir) -> List[Path]:
+    """Gets a game's track files.
+
+    Args:
+        game: The game.
+
+    Returns:
+        The files that are not GDI files.
+    """
+    return [file for file in game.files if file.suffix.lower() != ".gdi"]
+
+
+def _track_sizes(game: GameDir) -> Tuple[int, ...]:
+    """Gets the sizes of a game's tracks, in order of size.
+
+    Args:
+        game: The game.
+
+    Returns:
+        The sizes.
+    """
+    return tuple(sorted(track.stat().st_size for track in _get_tracks(game)))
+
+
+def _partial_hashes(game: GameDir) -> Tuple[Tuple[int, str], ...]:
+    """Hashes the start of a game's tracks.
+
+    Args:
+        game: The game.
+
+    Returns:
+        The size and partial hash of every track, sorted.
+    """
+    hashes = []
+    for track in _get_tracks(game):
+        with open(track, "rb") as file:
+            data = file.read(PARTIAL_HASH_SIZE)
+        digest = hashlib.sha1(data, usedforsecurity=False).hexdigest()
+        hashes.append((len(data), digest))
+    return tuple(sorted(hashes))
+
+
+def _full_hashes(game: GameDir) -> Tuple[Tuple[int, str], ...]:
+    """Hashes the whole of a game's tracks.
+
+    Args:
+        game: The game.
+
+    Returns:
+        The size and hash of every track, sorted.
+    """
+    hashes = []
+    for track in _get_tracks(game):
+        hasher = hash_file(track, hashlib.sha1(usedforsecurity=False))
+        hashes.append((track.stat().st_size, hasher.hexdigest()))
+    return tuple(sorted(hashes))
@@ -1,32 +1,183 @@
 """File utility functions for finding, manipulating, and creating files and
 directories."""
 
+import errno
+import os
 from pathlib import Path
 import re
-from typing import List
+import shutil
+from typing import Iterator, List, NamedTuple, Set, Tuple
+import warnings
 
 from gdipak.arg_parser import RecursiveMode
+from gdipak.checksums import MultiHasher, hash_file
+from gdipak.copy_engine import CopyEngine, is_same_file
+from gdipak.sync import fsync_dir
 
 VALID_EXTENSIONS = (".gdi", ".bin", ".raw")
+# The extensions of the track files, the game files other than the GDI file.
+TRACK_EXTENSIONS = tuple(ext for ext in VALID_EXTENSIONS if ext != ".gdi")
 # This regex takes any string of characters that contains "track" followed by a number
 # and captures the number.
 TRACK_NUMBER_REGEX = re.compile(r"^[\s\S]*track[\s\S]*?([\d]+)", re.IGNORECASE)
+# The same, for file names read from GDI files which are not decoded.
+TRACK_NUMBER_BYTES_REGEX = re.compile(rb"^[\s\S]*track[\s\S]*?([\d]+)", re.IGNORECASE)
+# Added to the name of the hidden directory a game is written to before it is moved to
+# its output directory.
+STAGING_DIR_SUFFIX = ".gdipak-staging"
+# Errors raised by rename when a directory is renamed to one that is not empty.
+DIR_EXISTS_ERRNOS = frozenset((errno.EEXIST, errno.ENOTEMPTY))
 
 
-def write_file(in_file: str | Path, out_file: str | Path) -> None:
+class GameDir(NamedTuple):
+    """A directory containing the files of one game. The files are None if the
+    directory has not been searched yet."""
+
+    path: Path
+    files: List[Path] | None
+
+    def __str__(self) -> str:
+        return str(self.path)
+
+
+def write_file(
+    in_file: str | Path,
+    out_file: str | Path,
+    engine: CopyEngine = None,
+    hasher: MultiHasher = None,
+    sync: bool = False,
+) -> None:
     """Generates a file with the given contents.
 
     Args:
         in_file: a path to a file from which to copy data.
         out_file: a path to which to write the data.
+        engine: Optional. The copy engine used to move the data. If left None a
+          copy engine with the default settings is used.
+        hasher: Optional. A hasher that is given the file's contents.
+        sync: If True, the file and its directory entry are flushed to the device
+          once the file is written.
     """
-    if in_file == out_file:
+    if is_same_file(in_file, out_file):
+        if hasher is not None:
+            # Nothing to copy, read the file instead.
+            hash_file(in_file, hasher)
         return
     out_file = Path(out_file)
     out_dir = out_file.parent
     out_dir.mkdir(parents=True, exist_ok=True)
-    in_file = Path(in_file)
-    out_file.write_bytes(in_file.read_bytes())
+    engine = CopyEngine() if engine is None else engine
+    engine(in_file, out_file, hasher, sync)
+    if sync:
+        fsync_dir(out_dir)
+
+
+def get_staging_dir(out_dir: str | Path) -> Path:
+    """Gets the hidden directory a game is written to before it is published to its
+    output directory.
+
+    It is next to the output directory, once symbolic links are resolved, so that
+    it is on the same file system. If the output directory is the root of a mount,
+    or its parent can not be written to, it is inside the output directory instead.
+
+    Args:
+        out_dir: The game's output directory.
+
+    Returns:
+        The staging directory. Note that it is not created on disk by this function.
+    """
+    out_dir = Path(out_dir).resolve()
+    if _is_dir_fixed(out_dir):
+        return out_dir / STAGING_DIR_SUFFIX
+    return out_dir.with_name(f".{out_dir.name}{STAGING_DIR_SUFFIX}")
+
+
+def remove_staging_dir(out_dir: str | Path) -> bool:
+    """Removes the staging directory of an output directory, left by a run that was
+    interrupted.
+
+    Args:
+        out_dir: The game's output directory.
+
+    Returns:
+        True if there was a staging directory.
+    """
+    staging_dir = get_staging_dir(out_dir)
+    if not staging_dir.exists():
+        return False
+    shutil.rmtree(staging_dir)
+    return True
+
+
+def publish_dir(staging_dir: str | Path, out_dir: str | Path) -> None:
+    """Moves a complete staging directory to the output directory.
+
+    If the output directory does not exist, the staging directory is renamed to it
+    and the game appears with all of its files at once. A directory that already
+    exists is never moved, as it may hold other files or be in use, each staged file
+    is moved into it instead, replacing any file with the same name.
+
+    Args:
+        staging_dir: The staging directory.
+        out_dir: The output directory. Symbolic links to it are followed.
+
+    Raises:
+        OSError if the staging directory can not be renamed for any other reason
+        than the output directory having been created meanwhile.
+    """
+    staging_dir = Path(staging_dir).absolute()
+    out_dir = Path(out_dir).resolve()
+    if not out_dir.exists():
+        try:
+            staging_dir.rename(out_dir)
+            return
+        except OSError as ex:
+            if ex.errno not in DIR_EXISTS_ERRNOS:
+                raise
+    _move_files(staging_dir, out_dir)
+
+
+def _is_dir_fixed(out_dir: Path) -> bool:
+    """Checks if an output directory can not have a directory created next to it on
+    the same file system.
+
+    Args:
+        out_dir: The resolved path to the output directory.
+
+    Returns:
+        True if the directory is the root of a mount, or its parent can not be
+        written to.
+    """
+    if not out_dir.exists():
+        return False
+    return os.path.ismount(out_dir) or not os.access(out_dir.parent, os.W_OK)
+
+
+def _move_files(staging_dir: Path, out_dir: Path) -> None:
+    """Moves each file of a staging directory into the output directory, replacing
+    any file with the same name, and removes the staging directory. Files are
+    copied if the two directories are on different file systems.
+
+    Args:
+        staging_dir: The staging directory.
+        out_dir: The output directory.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for staged_file in staging_dir.iterdir():
+        out_file = out_dir / staged_file.name
+        try:
+            staged_file.replace(out_file)
+        except OSError as ex:
+            if ex.errno != errno.EXDEV:
+                raise
+            # Copied beside the file it replaces, as it may be a hard link to a
+            # source track that must not be written through.
+            temp_file = out_dir / f".{staged_file.name}{STAGING_DIR_SUFFIX}"
+            shutil.copy2(staged_file, temp_file)
+            temp_file.replace(out_file)
+        # Renaming a hard link onto the file it links to leaves both names.
+        staged_file.unlink(missing_ok=True)
+    staging_dir.rmdir()
 
 
 def get_subdirs_in_dir(directory: str | Path, max_recursion: int = None) -> List[Path]:
@@ -40,18 +191,172 @@ def get_subdirs_in_dir(directory: str | Path, max_recursion: int = None) -> List
     Returns:
         A  list of subdirectories.
     """
-    dirs = []
-    for item in Path(directory).iterdir():
-        if not item.is_dir():
-            continue
-        dirs.append(item)
-        if max_recursion != 0:
-            if max_recursion is not None:
-                max_recursion -= 1
-            subdirs = get_subdirs_in_dir(item, max_recursion)
-            dirs.extend(subdirs)
+    return list(iter_subdirs_in_dir(directory, max_recursion))
+
+
+def iter_subdirs_in_dir(
+    directory: str | Path, max_recursion: int = None
+) -> Iterator[Path]:
+    """Walks a given directory, yielding subdirectories as they are found.
+
+    Directories are yielded before their own subdirectories and siblings are yielded
+    in name order. The walk uses an explicit stack so the depth of the tree is not
+    limited by Python's recursion limit. Each directory is only yielded once, even if
+    symbolic links make it reachable more than once.
+
+    Args:
+        directory: A path to a directory to search in.
+        max_recursion: The number of times to look in sub-directories for more
+          directories. If left None there is no limit.
+
+    Yields:
+        The subdirectories.
+    """
+    for path, _ in _walk_dirs(directory, max_recursion, list_files=False):
+        yield path
+
+
+def iter_game_dirs(
+    directory: str | Path, max_recursion: int = None, exclude: str | Path = None
+) -> Iterator[GameDir]:
+    """Walks a given directory, yielding the subdirectories that contain a game.
+
+    A game directory is one that contains exactly one GDI file. Every directory is
+    only listed once, the game files found while walking are passed along so that
+    they do not need to be listed again. Directories with more than one GDI file are
+    skipped with a warning, since there is no way to tell which one to use.
+
+    Args:
+        directory: A path to a directory to search in.
+        max_recursion: The number of times to look in sub-directories for more
+          directories. If left None there is no limit.
+        exclude: Optional. A directory that is not walked, nor anything in it. As
+          the walk is lazy, the output directory of a run is excluded so that the
+          games packaged to it are not found again. It does not have to exist.
+
+    Yields:
+        The game directories, in the same order as iter_subdirs_in_dir.
+    """
+    exclude = None if exclude is None else Path(exclude).resolve()
+    for path, files in _walk_dirs(directory, max_recursion, True, exclude):
+        gdi_count = sum(1 for file in files if file.suffix == ".gdi")
+        if gdi_count == 1:
+            yield GameDir(path, files)
+        elif gdi_count > 1:
+            warnings.warn(f"Skipping {path}, it contains more than one gdi file")
+
+
+def _walk_dirs(
+    directory: str | Path,
+    max_recursion: int,
+    list_files: bool,
+    exclude: Path = None,
+) -> Iterator[Tuple[Path, List[Path]]]:
+    """Walks a given directory.
+
+    Args:
+        directory: A path to a directory to search in.
+        max_recursion: The number of times to look in sub-directories for more
+          directories. If None there is no limit.
+        list_files: If True, the game files in every directory are collected. If
+          False, directories past max_recursion are not listed at all.
+        exclude: Optional. The resolved path of a subdirectory that is not walked.
+
+    Yields:
+        (path, game files) of each subdirectory. The game files are only listed if
+        list_files is True.
+    """
+    root_stat = os.stat(directory)
+    visited = {(root_stat.st_dev, root_stat.st_ino)}
+    subdirs, _ = _scan_dir(directory, visited, exclude=exclude)
+    # (path, depth) of directories that have been found but not yielded.
+    stack = [(path, 0) for path in reversed(subdirs)]
+    while stack:
+        path, depth = stack.pop()
+        descend = max_recursion is None or depth < max_recursion
+        subdirs, files = [], []
+        if descend or list_files:
+            subdirs, files = _scan_dir(path, visited, descend, exclude)
+        yield Path(path), files
+        stack.extend((path, depth + 1) for path in reversed(subdirs))
+
+
+def _scan_dir(
+    directory: str | Path,
+    visited: Set[Tuple[int, int]],
+    find_subdirs: bool = True,
+    exclude: Path = None,
+) -> Tuple[List[str], List[Path]]:
+    """Lists a directory's game files and the subdirectories that have not already
+    been visited.
+
+    The type of each entry comes from the directory listing itself, only the
+    subdirectories need a stat call. The listing's inode number can not be used for
+    them, as a mount point, and every directory below it, is on another device than
+    the directory that lists it.
+
+    Args:
+        directory: A path to a directory to search in.
+        visited: The (device, inode) of every directory found so far. The
+          subdirectories returned are added to it.
+        find_subdirs: If False, subdirectories are ignored.
+        exclude: Optional. The resolved path of a subdirectory that is ignored.
+
+    Returns:
+        2-tuple:
+        - A list of the paths of the subdirectories, sorted by name.
+        - A list of the game files, sorted by name.
+    """
+    subdirs = []
+    files = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if _is_game_file(entry):
+                files.append(Path(entry.path))
+            elif entry.name.endswith(STAGING_DIR_SUFFIX):
+                # Games that are still being written are not part of the library.
+                continue
+            elif find_subdirs and entry.is_dir():
+                if _is_excluded(entry, exclude):
+                    continue
+                # Follows symbolic links to where they lead.
+                entry_stat = os.stat(entry.path)
+                key = (entry_stat.st_dev, entry_stat.st_ino)
+                if key in visited:
+                    continue
+                visited.add(key)
+                subdirs.append((entry.name, entry.path))
+    subdirs.sort()
+    files.sort()
+    return [path for _, path in subdirs], files
+
+
+def _is_excluded(entry: os.DirEntry, exclude: Path | None) -> bool:
+    """Checks if a directory entry is the excluded directory. Only entries with the
+    same name are resolved.
+
+    Args:
+        entry: A directory.
+        exclude: The resolved path of the excluded directory, or None.
+
+    Returns:
+        True if the entry is the excluded directory.
+    """
+    if exclude is None or entry.name != exclude.name:
+        return False
+    return Path(entry.path).resolve() == exclude
+
 
-    return dirs
+def _is_game_file(entry: os.DirEntry) -> bool:
+    """Checks if a directory entry is a file relevant to the GDI game format.
+
+    Args:
+        entry: An entry from a directory listing.
+
+    Returns:
+        True if it is a game file.
+    """
+    return os.path.splitext(entry.name)[1] in VALID_EXTENSIONS and entry.is_file()
 
 
 def get_game_files_in_dir(directory: str | Path) -> List[Path]:
@@ -63,27 +368,26 @@ def get_game_files_in_dir(directory: str | Path) -> List[Path]:
     Returns:
         A  list of file paths.
     """
-    files = []
-    for item in Path(directory).iterdir():
-        if not item.is_file():
-            continue
-        if item.suffix in VALID_EXTENSIONS:
-            files.append(item)
-    return files
+    with os.scandir(directory) as entries:
+        return [Path(entry.path) for entry in entries if _is_game_file(entry)]
 
 
-def write_name_file(out_dir: str | Path, gdi_file: str | Path) -> None:
+def write_name_file(out_dir: str | Path, gdi_file: str | Path) -> Path:
     """Creates an empty text file with the name of the given gdi file.
 
     Args:
         out_dir: The location to write the name file.
         gdi_file: The file who's name will be used for the name file.
+
+    Returns:
+        The path to the name file.
     """
     out_dir = Path(out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
     txt_file_name = Path(gdi_file).stem
     out_file = out_dir / txt_file_name
     out_file.touch()
+    return out_file
 
 
 def transpose_path(
@@ -120,26 +424,48 @@ def transpose_path(
     return out_base_path / local_game_path.name
 
 
-def convert_file_name(file_path: str | Path) -> str:
+def convert_file_name(file_path: str | Path | bytes) -> str | bytes:
     """Based on the input file name, generates an output file name.
     Args:
         file_path: A string representing EITHER a path to a file, with extension
-            or the file name, with extension.
+            or the file name, with extension. A file name from a GDI file can be
+            given as bytes, in any encoding.
 
     Returns:
-        A string that GDEMU expects for that file's name.
+        A string that GDEMU expects for that file's name, or bytes if file_path was
+        bytes.
 
     Raises:
         ValueError, SyntaxError
     """
+    if isinstance(file_path, bytes):
+        name, ext = os.path.splitext(os.path.basename(file_path))
+        # The new name is plain ASCII whatever the encoding of the old one.
+        return _convert_file_name(name, ext.decode("ascii", "replace")).encode()
     file_path = Path(file_path)
-    name = file_path.stem
-    ext = file_path.suffix.lower()
+    return _convert_file_name(file_path.stem, file_path.suffix)
+
+
+def _convert_file_name(name: str | bytes, ext: str) -> str:
+    """Generates an output file name from the parts of an input file name.
+
+    Args:
+        name: The file name without its extension.
+        ext: The file's extension.
+
+    Returns:
+        A string that GDEMU expects for that file's name.
+
+    Raises:
+        ValueError, SyntaxError
+    """
+    ext = ext.lower()
     if not ext or ext not in VALID_EXTENSIONS:
         raise ValueError("Invalid file type")
     if ext == ".gdi":
         return "disc.gdi"
-    result = TRACK_NUMBER_REGEX.match(name)
+    regex = TRACK_NUMBER_BYTES_REGEX if isinstance(name, bytes) else TRACK_NUMBER_REGEX
+    result = regex.match(name)
     if not result:
         raise SyntaxError("File name does not contain track information")
     track_num = str(int(result.group(1)))  # removes leading zeros
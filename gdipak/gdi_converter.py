@@ -1,17 +1,17 @@
 """GDI File conversion class"""
+import os
 from pathlib import Path
-import re
 
-from gdipak.file_utils import convert_file_name
+from gdipak.gdi_model import GdiDisc
+from gdipak.sync import fsync_dir
 
 
 class GdiConverter:
     """Converts the GDI file into the format SD Card Maker expects."""
 
-    repeated_spaces_regex = re.compile(r" +")
-    repeated_tabs_regex = re.compile(r"\t+")
-
-    def __init__(self, file_path: str | Path = None, file_contents: str = None) -> None:
+    def __init__(
+        self, file_path: str | Path = None, file_contents: bytes = None
+    ) -> None:
         """Accepts either file_path or file_contents, not both.
 
         Args:
@@ -24,35 +24,60 @@ class GdiConverter:
             raise ValueError("Only one of file_path or file_contents can be defined.")
         self.file_contents = file_contents
         self.file_path = Path(file_path) if file_path else None
-        self.backup_file_path = (
-            Path(str(self.file_path) + ".bak") if self.file_path else None
-        )
-        self.backup_exists = False
 
-    def convert_file(self) -> None:
+    def convert_file(self, sync: bool = False) -> None:
         """Converts the file in place.
 
-        This method also creates a backup of the file then deletes it when the
-        conversion is finished so that users don't meet with a terrible fate.
+        The file is replaced in a single step once the converted contents are
+        written, so users don't meet with a terrible fate if the conversion is
+        interrupted.
+
+        Args:
+            sync: If True, the converted file and its directory entry are flushed
+              to the device.
+        """
+        self.convert_to(self.file_path, sync)
+
+    def convert_to(self, out_file: str | Path, sync: bool = False) -> None:
+        """Converts the file into another file, this one is not modified.
+
+        The converted contents are written to a hidden temporary file next to
+        out_file, which then replaces out_file. out_file is never left partly
+        written, so no backup is needed.
+
+        Args:
+            out_file: The path to write the converted file to. It is replaced if it
+              exists, and can be the same as file_path.
+            sync: If True, the converted contents are flushed to the device before
+              they replace out_file, and the directory entry is flushed after.
         """
         if not self.file_path:
             raise ValueError("Cannot convert file, file_path is None")
-        with self.file_path.open(mode="r+", encoding="UTF-8") as file:
-            contents = file.read()
-            self._backup_file(contents)
-            contents = self.convert_file_contents(contents)
-            file.seek(0)
-            file.truncate()
-            file.writelines(contents)
-            self._delete_backup()
-
-    def convert_file_contents(self, file_contents: str = None) -> str:
-        """Converts the file contents.
+        out_file = Path(out_file)
+        contents = self.convert_file_contents(self.file_path.read_bytes())
+        out_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file_path = out_file.with_name(f".{out_file.name}.tmp")
+        try:
+            with temp_file_path.open(mode="wb") as temp_file:
+                temp_file.write(contents)
+                if sync:
+                    temp_file.flush()
+                    os.fsync(temp_file.fileno())
+            os.replace(temp_file_path, out_file)
+        except BaseException:
+            temp_file_path.unlink(missing_ok=True)
+            raise
+        if sync:
+            fsync_dir(out_file.parent)
+
+    def convert_file_contents(self, file_contents: bytes = None) -> bytes:
+        """Converts the file contents. The contents are never decoded, so file names
+        in any encoding are kept as they are and the line endings are unchanged.
 
         Args:
-            file_contents: A string containing all of the contents of the file. These
-                files are short, so reading in the whole thing isn't a big deal. If set
-                to None, use the file_contents passed on during instantiation.
+            file_contents: All of the bytes of the file. These files are short, so
+                reading in the whole thing isn't a big deal. If set to None, use the
+                file_contents passed on during instantiation.
         Returns:
             The converted file contents.
         """
@@ -60,94 +85,9 @@ class GdiConverter:
             file_contents = self.file_contents
         if not file_contents:
             raise ValueError(
-                "file_contents should be a string representing the "
+                "file_contents should be bytes representing the "
                 "contents of a GDI file"
             )
-        file_contents = self._replace_file_names(file_contents)
-        file_contents = self._remove_extra_whitespace(file_contents)
-        return file_contents
-
-    def _backup_file(self, contents: str) -> None:
-        """Creates a backup of the file on disk.
-
-        Args:
-            contents: the contents of the file.
-        """
-        with self.backup_file_path.open(mode="w", encoding="UTF-8") as backup_file:
-            backup_file.writelines(contents)
-        self.backup_exists = True
-
-    def _delete_backup(self) -> None:
-        """Removes the backup of the file from the disk."""
-        if not self.backup_exists:
-            return
-        self.backup_file_path.unlink(missing_ok=True)
-        self.backup_exists = False
-
-    @classmethod
-    def _remove_extra_whitespace(cls, file_contents: str) -> str:
-        """Removes extra spaces and tabs from the file.
-
-        ex:
-        ' 2    600 0 2252 "MyGame (USA) (Track 2).bin" 0'
-        becomes:
-        '2 600 0 2252 "MyGame (USA) (Track 2).bin" 0'
-
-        Args:
-            file_contents: All the text from the GDI file.
-
-        Returns:
-            The modified contents of the GDI file.
-        """
-        file_contents = cls.repeated_tabs_regex.sub(
-            " ", file_contents.replace("\\", r"\\")
-        )
-        file_contents = cls.repeated_spaces_regex.sub(" ", file_contents)
-        lines = file_contents.splitlines(True)
-        for index, line in enumerate(lines):
-            if line[0] == " ":
-                lines[index] = line[1:]
-        file_contents = "".join(line for line in lines)
-        return file_contents
-
-    @classmethod
-    def _replace_file_names(cls, file_contents: str) -> str:
-        """Replaces the original file names with the new file names.
-
-        ex:
-        '2 600 0 2252 "MyGame (USA) (Track 2).bin" 0'
-        becomes:
-        '2 600 0 2252 "track02.bin" 0'
-
-        Args:
-            file_contents: All the text from the GDI file.
-
-        Returns:
-            The modified contents of the GDI file.
-        """
-        output_contents = ""
-        lines = file_contents.splitlines(True)
-        for index, line in enumerate(lines):
-            if index == 0:
-                output_contents += line  # First line holds track count
-                continue
-            start_quote_index = line.find('"')
-            end_quote_index = line.rfind('"')
-            # Line without a file name
-            if start_quote_index == -1 and end_quote_index == -1:
-                raise ValueError(
-                    f"Line {index + 1} does not reference a quoted file name."
-                )
-            # Invalid Line
-            if start_quote_index == end_quote_index:
-                raise ValueError(
-                    f"Line {index + 1} only contains a single quote, file names "
-                    "should be between two quotes."
-                )
-            start_quote_index += 1
-            file_name = line[start_quote_index:end_quote_index]
-            new_file_name = convert_file_name(file_name)
-            line = re.sub(re.escape(file_name), new_file_name, line)
-            output_contents += line
-
-        return output_contents
+        disc = GdiDisc.parse(file_contents)
+        disc.rename_files()
+        return disc.to_bytes()
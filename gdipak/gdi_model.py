@@ -0,0 +1,202 @@
+"""Structured model of the contents of a GDI file.
+
+GDI files are handled as bytes. The file names in them are in whatever encoding the
+dumping tool used, Shift-JIS for many Japanese dumps, so they are never decoded.
+"""
+
+import re
+from typing import Callable, List
+
+from gdipak import file_utils
+
+# Track types.
+AUDIO_TRACK = 0
+DATA_TRACK = 4
+
+# The first line of the file, the number of tracks.
+TRACK_COUNT_REGEX = re.compile(rb"[ \t]*(\d+)[ \t]*")
+# A track line, without its line ending. The file name is either everything between
+# the first and last quotes or a single unquoted word.
+TRACK_REGEX = re.compile(
+    rb"[ \t]*(\d+)[ \t]+(\d+)[ \t]+(\d+)[ \t]+(\d+)[ \t]+"
+    rb'(?:"(.*)"|([^ \t"]+))[ \t]+(\d+)[ \t]*'
+)
+
+
+class Track:
+    """One track of a disc, as listed on a line of the GDI file.
+
+    ex:
+    '2 600 0 2352 "MyGame (USA) (Track 2).raw" 0'
+    """
+
+    # Discs are listed by the thousand when auditing a library, so the records are
+    # kept small.
+    __slots__ = ("number", "lba", "track_type", "sector_size", "file_name", "offset")
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(
+        self,
+        number: int,
+        lba: int,
+        track_type: int,
+        sector_size: int,
+        file_name: bytes,
+        offset: int = 0,
+    ) -> None:
+        """Args:
+        number: The track number, starting at 1.
+        lba: The logical block address the track starts at.
+        track_type: AUDIO_TRACK or DATA_TRACK.
+        sector_size: The number of bytes per sector in the track file.
+        file_name: The name of the track file.
+        offset: The byte offset of the track data in the file.
+        """
+        self.number = number
+        self.lba = lba
+        self.track_type = track_type
+        self.sector_size = sector_size
+        self.file_name = file_name
+        self.offset = offset
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Track):
+            return NotImplemented
+        return all(
+            getattr(self, slot) == getattr(other, slot) for slot in self.__slots__
+        )
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{slot}={getattr(self, slot)!r}" for slot in self.__slots__)
+        return f"Track({fields})"
+
+    @property
+    def is_data(self) -> bool:
+        """True if the track holds data rather than audio."""
+        return self.track_type == DATA_TRACK
+
+    @classmethod
+    def parse(cls, line: bytes, line_number: int = 2) -> "Track":
+        """Reads a track from a line of a GDI file. The file name may be quoted, and
+        must be if it contains spaces.
+
+        Args:
+            line: The line, without its line ending.
+            line_number: The number of the line in the file, used in errors.
+
+        Returns:
+            The track.
+
+        Raises:
+            ValueError if the line is not a valid track.
+        """
+        result = TRACK_REGEX.fullmatch(line)
+        if not result:
+            if line.count(b'"') == 1:
+                raise ValueError(
+                    f"Line {line_number} only contains a single quote, file names "
+                    "should be between two quotes."
+                )
+            raise ValueError(f"Line {line_number} is not a valid track.")
+        number, lba, track_type, sector_size, quoted, unquoted, offset = result.groups()
+        file_name = unquoted if quoted is None else quoted
+        return cls(
+            int(number),
+            int(lba),
+            int(track_type),
+            int(sector_size),
+            file_name,
+            int(offset),
+        )
+
+    def to_line(self) -> bytes:
+        """Writes the track as a line of a GDI file, without a line ending.
+
+        Returns:
+            The line.
+        """
+        fields = b'%d %d %d %d "' % (
+            self.number,
+            self.lba,
+            self.track_type,
+            self.sector_size,
+        )
+        return fields + self.file_name + b'" %d' % self.offset
+
+
+class GdiDisc:
+    """The tracks of a disc, as listed in a GDI file."""
+
+    __slots__ = ("tracks", "line_ends")
+
+    def __init__(self, tracks: List[Track], line_ends: List[bytes] = None) -> None:
+        """Args:
+        tracks: The tracks, in order.
+        line_ends: Optional. The line ending of the first line and then of each
+          track, so that a file is written back with the line endings it was read
+          with. If left None, or if there are more tracks than line endings, CRLF is
+          used.
+        """
+        self.tracks = tracks
+        self.line_ends = [] if line_ends is None else line_ends
+
+    def __len__(self) -> int:
+        return len(self.tracks)
+
+    @classmethod
+    def parse(cls, file_contents: bytes) -> "GdiDisc":
+        """Reads a disc from the contents of a GDI file. Blank lines are ignored.
+
+        Args:
+            file_contents: All the bytes of the GDI file.
+
+        Returns:
+            The disc.
+
+        Raises:
+            ValueError if the contents are not a valid GDI file.
+        """
+        tracks = []
+        line_ends = []
+        track_count = None
+        for index, line in enumerate(file_contents.splitlines(True)):
+            text = line.rstrip(b"\r\n")
+            if index and not text.strip():
+                continue
+            if track_count is None:
+                result = TRACK_COUNT_REGEX.fullmatch(text)
+                if not result:
+                    raise ValueError("Line 1 does not hold the number of tracks.")
+                track_count = int(result.group(1))
+            else:
+                tracks.append(Track.parse(text, index + 1))
+            line_ends.append(line.removeprefix(text))
+        if track_count is None:
+            raise ValueError("GDI file is empty.")
+        if track_count != len(tracks):
+            raise ValueError(
+                f"GDI file lists {track_count} tracks but contains {len(tracks)}."
+            )
+        return cls(tracks, line_ends)
+
+    def rename_files(self, rename: Callable[[bytes], bytes] = None) -> None:
+        """Renames the file of every track.
+
+        Args:
+            rename: Optional. Gets the new name from a track's file name. If left
+              None the names are converted to the names GDEMU expects.
+        """
+        rename = file_utils.convert_file_name if rename is None else rename
+        for track in self.tracks:
+            track.file_name = rename(track.file_name)
+
+    def to_bytes(self) -> bytes:
+        """Writes the disc in the GDI format.
+
+        Returns:
+            The contents of the GDI file.
+        """
+        lines = [b"%d" % len(self.tracks)]
+        lines.extend(track.to_line() for track in self.tracks)
+        line_ends = self.line_ends + [b"\r\n"] * (len(lines) - len(self.line_ends))
+        return b"".join(line + line_end for line, line_end in zip(lines, line_ends))
@@ -0,0 +1,293 @@
+"""Persistent record of the progress of a run, so that an interrupted run can be
+resumed."""
+
+import enum
+from pathlib import Path
+import sqlite3
+import threading
+from typing import Callable, Iterable, Iterator, List, Set, Tuple
+
+from gdipak.file_utils import GameDir
+
+# The number of games read from the database at a time when resuming.
+PAGE_SIZE = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS games (
+    game_dir TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS games_seq ON games (seq);
+CREATE TABLE IF NOT EXISTS files (
+    game_dir TEXT NOT NULL,
+    in_file TEXT NOT NULL,
+    status TEXT NOT NULL,
+    PRIMARY KEY (game_dir, in_file)
+);
+"""
+
+
+@enum.unique
+class JobStatus(enum.Enum):
+    """Enum for the state of a game or track."""
+
+    PENDING = "pending"
+    IN_PROGRESS = "in_progress"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class JobState:
+    """Tracks the status of every game and track of a run in a SQLite database.
+    The files of each game are stored too, tracks are marked done as they are
+    packed.
+
+    The list of games is kept in the database rather than in memory. Once the input
+    directory has been fully searched a resumed run reads the remaining games back
+    from the database instead of searching again.
+    """
+
+    def __init__(
+        self, db_path: str | Path, in_dir: str | Path, out_dir: str | Path
+    ) -> None:
+        """Opens or creates the database.
+
+        Args:
+            db_path: The path to the database file.
+            in_dir: The input directory of the run.
+            out_dir: The output directory of the run.
+
+        Raises:
+            ValueError if the database belongs to a run with different directories.
+        """
+        self._lock = threading.Lock()
+        # Shared by the worker threads, every use is serialized by the lock.
+        self._connection = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+        for key, value in (("in_dir", in_dir), ("out_dir", out_dir)):
+            value = str(Path(value).resolve())
+            stored = self._get_meta(key)
+            if stored is None:
+                self._set_meta(key, value)
+            elif stored != value:
+                self.close()
+                raise ValueError(f"State database belongs to a run with {key} {stored}")
+        # Anything that was in progress when the last run stopped has to be redone.
+        self._connection.execute(
+            "UPDATE games SET status = ? WHERE status = ?",
+            (JobStatus.PENDING.value, JobStatus.IN_PROGRESS.value),
+        )
+        self._connection.commit()
+
+    def __enter__(self) -> "JobState":
+        return self
+
+    def __exit__(self, *_exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Closes the database."""
+        self._connection.close()
+
+    def games(self, discover: Callable[[], Iterable[GameDir]]) -> Iterator[GameDir]:
+        """Gets the games that still need to be packed.
+
+        Args:
+            discover: A callable returning the games in the input directory. Only
+              called if a previous run did not finish searching for games.
+
+        Yields:
+            The games that are not done, in the order they were discovered.
+        """
+        if self._get_meta("discovered") == "1":
+            yield from self._stored_games()
+            return
+        for seq, found_game in enumerate(discover()):
+            status, game = self._add_game(seq, found_game)
+            if status != JobStatus.DONE:
+                yield game
+        with self._lock:
+            self._set_meta("discovered", "1")
+            self._connection.commit()
+
+    def start_game(self, game_dir: str | Path) -> Set[Path]:
+        """Marks a game as in progress.
+
+        Args:
+            game_dir: The game's directory.
+
+        Returns:
+            The game's tracks that were already done.
+        """
+        with self._lock:
+            self._set_game_status(game_dir, JobStatus.IN_PROGRESS)
+            rows = self._connection.execute(
+                "SELECT in_file FROM files WHERE game_dir = ? AND status = ?",
+                (str(game_dir), JobStatus.DONE.value),
+            )
+            return {Path(in_file) for (in_file,) in rows}
+
+    def track_done(self, game_dir: str | Path, in_file: str | Path) -> None:
+        """Marks a track as done.
+
+        Args:
+            game_dir: The game's directory.
+            in_file: The track's source file.
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO files (game_dir, in_file, status) "
+                "VALUES (?, ?, ?)",
+                (str(game_dir), str(in_file), JobStatus.DONE.value),
+            )
+            self._connection.commit()
+
+    def finish_game(self, game_dir: str | Path, error: Exception = None) -> None:
+        """Marks a game as done, or as failed if an error is given.
+
+        Args:
+            game_dir: The game's directory.
+            error: Optional. The error that stopped the game from being packed.
+        """
+        status = JobStatus.DONE if error is None else JobStatus.FAILED
+        with self._lock:
+            self._set_game_status(game_dir, status, error)
+
+    def get_status(self, game_dir: str | Path) -> JobStatus | None:
+        """Gets the status of a game.
+
+        Args:
+            game_dir: The game's directory.
+
+        Returns:
+            The status, or None if the game is not known.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT status FROM games WHERE game_dir = ?", (str(game_dir),)
+            ).fetchone()
+        return None if row is None else JobStatus(row[0])
+
+    def _add_game(self, seq: int, game: GameDir) -> Tuple[JobStatus, GameDir]:
+        """Records a discovered game, unless it is already known.
+
+        Args:
+            seq: The order the game was discovered in.
+            game: The game.
+
+        Returns:
+            2-tuple:
+            - The status of the game.
+            - The game. For a game that is already known its files are the ones
+              recorded when it was first found, since a game that was partly packed
+              in place no longer has the same files.
+        """
+        game_dir = str(game.path)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT status FROM games WHERE game_dir = ?", (game_dir,)
+            ).fetchone()
+            if row is not None:
+                self._connection.execute(
+                    "UPDATE games SET seq = ? WHERE game_dir = ?", (seq, game_dir)
+                )
+                self._connection.commit()
+                files = self._get_game_files(game_dir)
+                return JobStatus(row[0]), GameDir(game.path, files or game.files)
+            self._connection.execute(
+                "INSERT INTO games (game_dir, seq, status) VALUES (?, ?, ?)",
+                (game_dir, seq, JobStatus.PENDING.value),
+            )
+            self._connection.executemany(
+                "INSERT INTO files (game_dir, in_file, status) VALUES (?, ?, ?)",
+                (
+                    (game_dir, str(file), JobStatus.PENDING.value)
+                    for file in game.files or ()
+                ),
+            )
+            self._connection.commit()
+        return JobStatus.PENDING, game
+
+    def _stored_games(self) -> Iterator[GameDir]:
+        """Reads the games that are not done back from the database, a page at a
+        time.
+
+        Yields:
+            The games, in the order they were discovered.
+        """
+        last_seq = -1
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    "SELECT game_dir, seq FROM games WHERE seq > ? AND status != ? "
+                    "ORDER BY seq LIMIT ?",
+                    (last_seq, JobStatus.DONE.value, PAGE_SIZE),
+                ).fetchall()
+                pages = [(row, self._get_game_files(row[0])) for row in rows]
+            if not pages:
+                return
+            for (game_dir, seq), files in pages:
+                last_seq = seq
+                yield GameDir(Path(game_dir), files)
+
+    def _get_game_files(self, game_dir: str) -> List[Path] | None:
+        """Gets the recorded files of a game.
+
+        Args:
+            game_dir: The game's directory.
+
+        Returns:
+            The game's files, or None if they were not recorded.
+        """
+        rows = self._connection.execute(
+            "SELECT in_file FROM files WHERE game_dir = ?", (game_dir,)
+        ).fetchall()
+        return [Path(in_file) for (in_file,) in rows] or None
+
+    def _set_game_status(
+        self, game_dir: str | Path, status: JobStatus, error: Exception = None
+    ) -> None:
+        """Updates the status of a game. The lock must be held.
+
+        Args:
+            game_dir: The game's directory.
+            status: The new status.
+            error: Optional. The error that stopped the game from being packed.
+        """
+        self._connection.execute(
+            "UPDATE games SET status = ?, error = ? WHERE game_dir = ?",
+            (status.value, None if error is None else str(error), str(game_dir)),
+        )
+        self._connection.commit()
+
+    def _get_meta(self, key: str) -> str | None:
+        """Reads a value describing the run.
+
+        Args:
+            key: The name of the value.
+
+        Returns:
+            The value, or None if it is not set.
+        """
+        row = self._connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def _set_meta(self, key: str, value: str) -> None:
+        """Stores a value describing the run.
+
+        Args:
+            key: The name of the value.
+            value: The value.
+        """
+        self._connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+        )
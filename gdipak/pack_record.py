@@ -0,0 +1,96 @@
+"""Records what was packed for a game so that unchanged games can be skipped."""
+
+import json
+import os
+from pathlib import Path
+from typing import Dict, List
+
+# Stored in the game's output directory. Hidden so that it is ignored by the SD card
+# maker.
+RECORD_FILE_NAME = ".gdipak.json"
+RECORD_VERSION = 1
+
+
+class PackRecord:
+    """The record of the source files a game was packed from and the output files
+    that were produced."""
+
+    def __init__(self, out_dir: str | Path) -> None:
+        """Args:
+        out_dir: The game's output directory.
+        """
+        self.path = Path(out_dir) / RECORD_FILE_NAME
+
+    def is_current(self, game_files: List[Path]) -> bool:
+        """Checks if the game was already packed from the same source files and the
+        output files have not changed since.
+
+        Args:
+            game_files: The game's source files.
+
+        Returns:
+            True if packing the game again would produce the same output.
+        """
+        try:
+            record = json.loads(self.path.read_text(encoding="UTF-8"))
+        except (OSError, ValueError):
+            return False
+        if record.get("version") != RECORD_VERSION:
+            return False
+        try:
+            if record["sources"] != self._source_stats(game_files):
+                return False
+            return record["outputs"] == self._output_stats(record["outputs"])
+        except OSError:
+            return False
+
+    def save(self, game_files: List[Path], out_files: List[Path]) -> None:
+        """Saves the record of a game that has just been packed.
+
+        Args:
+            game_files: The game's source files.
+            out_files: The files that were written to the output directory.
+        """
+        record = {
+            "version": RECORD_VERSION,
+            "sources": self._source_stats(game_files),
+            "outputs": self._output_stats(file.name for file in out_files),
+        }
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        temp_path.write_text(json.dumps(record, indent=1), encoding="UTF-8")
+        temp_path.replace(self.path)
+
+    @staticmethod
+    def _source_stats(game_files: List[Path]) -> Dict[str, List[int]]:
+        """Gets the identifying information of the source files.
+
+        Args:
+            game_files: The game's source files.
+
+        Returns:
+            A dictionary of file path to [size, modification time, inode].
+        """
+        stats = {}
+        for file in game_files:
+            file_stat = os.stat(file)
+            stats[str(file)] = [
+                file_stat.st_size,
+                file_stat.st_mtime_ns,
+                file_stat.st_ino,
+            ]
+        return stats
+
+    def _output_stats(self, names) -> Dict[str, List[int]]:
+        """Gets the identifying information of the output files.
+
+        Args:
+            names: The names of the files in the output directory.
+
+        Returns:
+            A dictionary of file name to [size, modification time].
+        """
+        stats = {}
+        for name in names:
+            file_stat = os.stat(self.path.parent / name)
+            stats[name] = [file_stat.st_size, file_stat.st_mtime_ns]
+        return stats
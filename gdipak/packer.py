@@ -1,19 +1,52 @@
 """Parses GDI formatted game dumps and formats them for
 consumption by the Madsheep SD card maker for GDEMU"""
 from abc import ABC, abstractmethod
+import errno
+from functools import partial
 from pathlib import Path
+from typing import Callable, Collection, Dict, List
 
 from gdipak import file_utils
+from gdipak.arg_parser import SyncMode
+from gdipak.checksums import MultiHasher, hash_file, write_manifest
+from gdipak.copy_engine import CopyEngine
 from gdipak.gdi_converter import GdiConverter
+from gdipak.scheduler import run_jobs
+from gdipak.sync import SyncBatch, fsync_dir
 
 
 class BasePacker(ABC):
     """Repackages all of the game files in the format needed for the SD card maker."""
 
-    def __init__(self, in_dir: str | Path, out_dir: str | Path) -> None:
-        """Saves paths to all of the input files and the output path."""
+    # If True, and the game is not packaged in place, the game is written to a
+    # staging directory and only published to the output directory once every file
+    # is complete. An interrupted run never leaves a partial game behind.
+    staged = False
+
+    def __init__(
+        self,
+        in_dir: str | Path,
+        out_dir: str | Path,
+        game_files: List[Path] = None,
+        sync: SyncMode = SyncMode.NONE,
+    ) -> None:
+        """Saves paths to all of the input files and the output path.
+
+        Args:
+            in_dir: The directory containing the game files.
+            out_dir: The directory to write the packaged game to.
+            game_files: Optional. The game files in in_dir, if they are already
+              known. If left None in_dir is searched for them.
+            sync: When the written files are flushed to the device.
+        """
+        self.sync = sync
         self.out_dir = Path(out_dir)
-        self.game_files = file_utils.get_game_files_in_dir(in_dir)
+        self.work_dir = self.out_dir
+        if self.staged and not file_utils.is_same_file(in_dir, self.out_dir):
+            self.work_dir = file_utils.get_staging_dir(self.out_dir)
+        if game_files is None:
+            game_files = file_utils.get_game_files_in_dir(in_dir)
+        self.game_files = game_files
 
         gdi_files = [file for file in self.game_files if file.suffix == ".gdi"]
         if len(gdi_files) < 1:
@@ -32,20 +65,172 @@ class BasePacker(ABC):
         """
         raise NotImplementedError
 
-    def package_game(self, *, create_name_file: bool = False) -> None:
+    def hashed_file_action(
+        self, in_file: str | Path, out_file: str | Path, hasher: MultiHasher
+    ) -> None:
+        """Performs file_action and gives the file's contents to the hasher.
+
+        By default the output file is read back once the action is done. Packers
+        that read the data anyway should override this to hash it as they go.
+
+        Args:
+            in_file: The source file.
+            out_file: The destination file.
+            hasher: The hasher to give the file's contents to.
+        """
+        self.file_action(in_file, out_file)
+        hash_file(out_file, hasher)
+
+    def gdi_file_action(self, in_file: str | Path, out_file: str | Path) -> None:
+        """Performs file_action on the GDI file, then converts the output file.
+
+        Args:
+            in_file: The source GDI file.
+            out_file: The destination GDI file.
+        """
+        self.file_action(in_file, out_file)
+        # in_file can no longer be used, could be gone.
+        GdiConverter(out_file).convert_file(self.sync == SyncMode.FILE)
+
+    def package_game(  # pylint: disable=too-many-arguments
+        self,
+        *,
+        create_name_file: bool = False,
+        track_jobs: int = 1,
+        skip_tracks: Collection[Path] = (),
+        on_track_done: Callable[[Path], None] = None,
+        checksums: bool = False,
+        sync_batch: SyncBatch = None,
+    ) -> None:
         """Performs specific action (move or copy) on all input files to create the
         output files.
 
+        The track files are handled first, largest first, up to track_jobs at a
+        time. Writing the large tracks before the free space is broken up by the
+        small ones gives the file system the best chance to keep each of them in
+        one piece. The GDI file is only handled once all of the tracks are in
+        place. Staged packers then publish the game to the output directory.
+
         Args:
-            create_name_file: If True, a name file will also be created."""
-        for in_file in self.game_files:
-            out_file = self.out_dir / file_utils.convert_file_name(in_file)
-            self.file_action(in_file, out_file)
-            # in_file can no longer be used, could be gone.
-            if out_file.suffix == ".gdi":
-                GdiConverter(out_file).convert_file()
+            create_name_file: If True, a name file will also be created.
+            track_jobs: The maximum number of track files to handle at the same
+              time.
+            skip_tracks: Track files that have already been handled, by an earlier
+              run for example. Their output must be in the work directory. A staged
+              packer given no tracks to skip discards any staging directory left by
+              an earlier run.
+            on_track_done: Optional. Called with each track file once it has been
+              handled.
+            checksums: If True, a checksum manifest of the output files is written
+              to the output directory.
+            sync_batch: Optional. In 'END' sync mode the output files are added to
+              it, to be flushed once the run is finished."""
+        staged = self.work_dir != self.out_dir
+        if staged and not skip_tracks:
+            file_utils.remove_staging_dir(self.out_dir)
+        hashers = {} if checksums else None
+        tracks = []
+        for file in self.game_files:
+            if file == self.gdi_file:
+                continue
+            if file not in skip_tracks:
+                tracks.append(file)
+            elif checksums:
+                work_file = self.get_work_file(file)
+                hashers[work_file.name] = hash_file(work_file)
+        tracks.sort(key=lambda track: track.stat().st_size, reverse=True)
+        package_track = partial(
+            self._package_track, on_done=on_track_done, hashers=hashers
+        )
+        run_jobs(package_track, tracks, track_jobs)
+        work_file = self.get_work_file(self.gdi_file)
+        self.gdi_file_action(self.gdi_file, work_file)
+        written = [self.get_work_file(file) for file in self.game_files]
         if create_name_file:
-            file_utils.write_name_file(self.out_dir, self.gdi_file)
+            written.append(file_utils.write_name_file(self.work_dir, self.gdi_file))
+        if checksums:
+            hashers[work_file.name] = hash_file(work_file)
+            written.append(write_manifest(self.work_dir, hashers))
+        self._publish(written, sync_batch)
+
+    def _publish(self, written: List[Path], sync_batch: SyncBatch = None) -> None:
+        """Flushes the written files as the sync mode asks, and publishes the game
+        to the output directory if it was staged.
+
+        Args:
+            written: Every file written to the work directory.
+            sync_batch: Optional. The batch the files are added to in 'END' sync
+              mode.
+        """
+        staged = self.work_dir != self.out_dir
+        if self.sync == SyncMode.GAME:
+            batch = SyncBatch()
+            batch.add_files(written)
+            batch.flush()
+        elif self.sync == SyncMode.FILE:
+            # The packaged files were flushed as they were written, the name file
+            # and the manifest were not.
+            game_file_count = len(self.game_files)
+            batch = SyncBatch()
+            batch.add_files(written[game_file_count:])
+            batch.flush()
+        if staged:
+            file_utils.publish_dir(self.work_dir, self.out_dir)
+            if self.sync in (SyncMode.GAME, SyncMode.FILE):
+                fsync_dir(self.out_dir)
+                # Where the staging directory was renamed, past any symbolic link.
+                fsync_dir(self.work_dir.parent)
+        if self.sync == SyncMode.END and sync_batch is not None:
+            sync_batch.add_files(self.out_dir / file.name for file in written)
+            if staged:
+                sync_batch.add_dirs([self.work_dir.parent])
+
+    def _package_track(
+        self,
+        in_file: Path,
+        on_done: Callable[[Path], None] = None,
+        hashers: Dict[str, MultiHasher] = None,
+    ) -> None:
+        """Performs specific action (move or copy) on a track file.
+
+        Args:
+            in_file: The source track file.
+            on_done: Optional. Called with the track file once it has been handled.
+            hashers: Optional. If given the checksums of the track are computed and
+              added to it, keyed by the output file name.
+        """
+        work_file = self.get_work_file(in_file)
+        if hashers is None:
+            self.file_action(in_file, work_file)
+        else:
+            hasher = MultiHasher()
+            self.hashed_file_action(in_file, work_file, hasher)
+            hashers[work_file.name] = hasher
+        if on_done:
+            on_done(in_file)
+
+    def get_out_file(self, in_file: Path) -> Path:
+        """Gets the path that a source file is packaged to.
+
+        Args:
+            in_file: The source file.
+
+        Returns:
+            The output file.
+        """
+        return self.out_dir / file_utils.convert_file_name(in_file)
+
+    def get_work_file(self, in_file: Path) -> Path:
+        """Gets the path that a source file is written to while the game is being
+        packaged, in the staging directory if there is one.
+
+        Args:
+            in_file: The source file.
+
+        Returns:
+            The file in the work directory.
+        """
+        return self.work_dir / file_utils.convert_file_name(in_file)
 
 
 class MovePacker(BasePacker):
@@ -60,11 +245,38 @@ class MovePacker(BasePacker):
             out_file: The destination file.
         """
         Path(in_file).replace(out_file)
+        if self.sync == SyncMode.FILE:
+            fsync_dir(Path(out_file).parent)
 
 
 class CopyPacker(BasePacker):
     """Copies the source files and packages them."""
 
+    staged = True
+
+    def __init__(
+        self,
+        in_dir: str | Path,
+        out_dir: str | Path,
+        game_files: List[Path] = None,
+        engine: CopyEngine = None,
+        sync: SyncMode = SyncMode.NONE,
+    ) -> None:
+        """Saves paths to all of the input files, the output path and the engine
+        used to copy the files.
+
+        Args:
+            in_dir: The directory containing the game files.
+            out_dir: The directory to write the packaged game to.
+            game_files: Optional. The game files in in_dir, if they are already
+              known. If left None in_dir is searched for them.
+            engine: Optional. The copy engine to use. If left None a copy engine
+              with the default settings is used.
+            sync: When the written files are flushed to the device.
+        """
+        super().__init__(in_dir, out_dir, game_files, sync)
+        self.engine = CopyEngine() if engine is None else engine
+
     def file_action(self, in_file: str | Path, out_file: str | Path) -> None:
         """Copies the in file contents to the out file location.
         In file will not be modified.
@@ -73,4 +285,69 @@ class CopyPacker(BasePacker):
             in_file: The source file.
             out_file: The destination file.
         """
-        file_utils.write_file(in_file, out_file)
+        file_utils.write_file(
+            in_file, out_file, self.engine, sync=self.sync == SyncMode.FILE
+        )
+
+    def hashed_file_action(
+        self, in_file: str | Path, out_file: str | Path, hasher: MultiHasher
+    ) -> None:
+        """Copies the in file contents to the out file location, giving the
+        contents to the hasher as they are copied.
+
+        Args:
+            in_file: The source file.
+            out_file: The destination file.
+            hasher: The hasher to give the file's contents to.
+        """
+        file_utils.write_file(
+            in_file, out_file, self.engine, hasher, self.sync == SyncMode.FILE
+        )
+
+    def gdi_file_action(self, in_file: str | Path, out_file: str | Path) -> None:
+        """Converts the GDI file straight into the out file location, the source is
+        read once and the copy is never rewritten.
+        In file will not be modified.
+
+        Args:
+            in_file: The source GDI file.
+            out_file: The destination GDI file.
+        """
+        GdiConverter(in_file).convert_to(out_file, self.sync == SyncMode.FILE)
+
+
+class LinkPacker(CopyPacker):
+    """Hard links the source track files and packages them. The GDI file is copied
+    because it gets modified."""
+
+    # Linking does not read the data, it has to be read back to be hashed.
+    hashed_file_action = BasePacker.hashed_file_action
+
+    def file_action(self, in_file: str | Path, out_file: str | Path) -> None:
+        """Hard links the out file to the in file, or copies it if it is the GDI
+        file or the two files are on different file systems.
+        In file will not be modified.
+
+        Args:
+            in_file: The source file.
+            out_file: The destination file.
+        """
+        in_file = Path(in_file)
+        out_file = Path(out_file)
+        if in_file.suffix == ".gdi":
+            super().file_action(in_file, out_file)
+            return
+        if file_utils.is_same_file(in_file, out_file):
+            # Unlinking out_file would remove the only name of in_file.
+            return
+        out_file.parent.mkdir(parents=True, exist_ok=True)
+        out_file.unlink(missing_ok=True)
+        try:
+            out_file.hardlink_to(in_file)
+        except OSError as ex:
+            if ex.errno != errno.EXDEV:
+                raise
+            super().file_action(in_file, out_file)
+            return
+        if self.sync == SyncMode.FILE:
+            fsync_dir(out_file.parent)
@@ -0,0 +1,297 @@
+"""Plans what packing would do, and checks that it can succeed, without reading or
+writing any game data."""
+
+import os
+from pathlib import Path
+import shutil
+import tempfile
+import time
+from typing import Dict, List, NamedTuple
+
+from gdipak import file_utils
+from gdipak.arg_parser import OperatingMode
+from gdipak.copy_engine import DEFAULT_BLOCK_SIZE, supports_reflink
+from gdipak.file_utils import GameDir
+
+# The number of bytes written to measure the throughput of the output device.
+PROBE_SIZE = 64 * 1024 * 1024
+
+# Actions performed on a file.
+COPY = "copy"
+MOVE = "move"
+LINK = "link"
+NONE = "none"
+# Actions that read and write the file's data, rather than only its metadata.
+DATA_ACTIONS = (COPY,)
+
+
+class PlannedFile(NamedTuple):
+    """What will be done with one file."""
+
+    source: Path
+    destination: Path
+    action: str
+    size: int
+    # True if the source is on the same device as the destination directory.
+    same_device: bool = True
+
+    def to_dict(self) -> Dict[str, str | int]:
+        """Converts the planned file to a JSON compatible dictionary.
+
+        Returns:
+            The dictionary.
+        """
+        return {
+            "source": str(self.source),
+            "destination": str(self.destination),
+            "action": self.action,
+            "bytes": self.size,
+        }
+
+
+class GamePlan(NamedTuple):
+    """What will be done with one game."""
+
+    game: GameDir
+    out_dir: Path
+    files: List[PlannedFile]
+    # True if the game is already packed and will be skipped.
+    skip: bool = False
+
+    def to_dict(self) -> Dict[str, str | bool | List[Dict[str, str | int]]]:
+        """Converts the game plan to a JSON compatible dictionary.
+
+        Returns:
+            The dictionary.
+        """
+        return {
+            "game": str(self.game.path),
+            "out_dir": str(self.out_dir),
+            "skip": self.skip,
+            "files": [file.to_dict() for file in self.files],
+        }
+
+
+class PreflightError(Exception):
+    """Raised before packing starts when the run can not succeed."""
+
+    def __init__(self, problems: List[str]) -> None:
+        """Args:
+        problems: A description of each problem that was found.
+        """
+        self.problems = problems
+        details = "; ".join(problems)
+        super().__init__(f"{len(problems)} problem(s) found before packing. {details}")
+
+
+def plan_game(
+    game: GameDir, out_dir: str | Path, mode: OperatingMode
+) -> List[PlannedFile]:
+    """Plans packing one game. Only the metadata of the files is read.
+
+    Args:
+        game: The game. If its files are None the directory is searched for them.
+        out_dir: The game's output directory.
+        mode: The operating mode.
+
+    Returns:
+        The planned files, the GDI file last as it is packed last.
+    """
+    out_dir = Path(out_dir)
+    files = game.files
+    if files is None:
+        files = file_utils.get_game_files_in_dir(game.path)
+    files = sorted(files, key=lambda file: file.suffix.lower() == ".gdi")
+    out_device = _get_device(out_dir)
+    planned = []
+    for file in files:
+        destination = out_dir / file_utils.convert_file_name(file)
+        file_stat = os.stat(file)
+        same_device = file_stat.st_dev == out_device
+        action = _get_action(file, destination, mode, same_device)
+        planned.append(
+            PlannedFile(file, destination, action, file_stat.st_size, same_device)
+        )
+    return planned
+
+
+def find_problems(game_plans: List[GamePlan], reflink: bool = True) -> List[str]:
+    """Checks that the planned games can be packed. Only the plans and the free
+    space of the output devices are used, no game data is read.
+
+    Args:
+        game_plans: The plans of every game in the run.
+        reflink: If True, copies on a file system that supports cloning files are
+          assumed to take no space.
+
+    Returns:
+        A description of each problem found, empty if there are none.
+    """
+    return _find_collisions(game_plans) + _check_free_space(game_plans, reflink)
+
+
+def summarize(
+    planned: List[PlannedFile], throughput: float | None
+) -> Dict[str, int | float | None]:
+    """Adds up the planned files.
+
+    Args:
+        planned: The planned files of every game.
+        throughput: The measured write throughput of the output device in bytes per
+          second, or None if it is not known.
+
+    Returns:
+        A dictionary of totals, including the estimated duration in seconds. Only
+        the files whose data is copied are counted towards the duration.
+    """
+    data_bytes = sum(file.size for file in planned if file.action in DATA_ACTIONS)
+    estimate = None
+    if throughput:
+        estimate = data_bytes / throughput
+    return {
+        "files": len(planned),
+        "bytes": sum(file.size for file in planned),
+        "data_bytes": data_bytes,
+        "throughput_bytes_per_second": throughput,
+        "estimated_seconds": estimate,
+    }
+
+
+def measure_throughput(directory: str | Path, size: int = None) -> float:
+    """Measures how fast data can be written to a directory's device. A temporary
+    file is written, flushed to the device and deleted.
+
+    Args:
+        directory: The directory to write to.
+        size: Optional. The number of bytes to write. If left None PROBE_SIZE is
+          used.
+
+    Returns:
+        The throughput in bytes per second.
+    """
+    size = PROBE_SIZE if size is None else size
+    block = bytes(min(size, DEFAULT_BLOCK_SIZE))
+    with tempfile.TemporaryFile(dir=directory, prefix=".gdipak-probe-") as file:
+        start = time.perf_counter()
+        written = 0
+        while written < size:
+            written += file.write(block[: size - written])
+        file.flush()
+        os.fsync(file.fileno())
+        elapsed = time.perf_counter() - start
+    # A clock that did not tick is as fast as it can measure.
+    return written / max(elapsed, time.get_clock_info("perf_counter").resolution)
+
+
+def _get_action(
+    in_file: Path, out_file: Path, mode: OperatingMode, same_device: bool
+) -> str:
+    """Chooses the action the packer will take for a file.
+
+    Args:
+        in_file: The source file.
+        out_file: The destination file.
+        mode: The operating mode.
+        same_device: True if the output is on the same device as the source.
+
+    Returns:
+        The action.
+    """
+    if mode == OperatingMode.MODIFY:
+        return MOVE
+    if file_utils.is_same_file(in_file, out_file):
+        return NONE
+    if mode == OperatingMode.LINK and same_device and in_file.suffix != ".gdi":
+        return LINK
+    return COPY
+
+
+def _find_collisions(game_plans: List[GamePlan]) -> List[str]:
+    """Finds games that would be packed to the same output directory, as can happen
+    when the directory structure is flattened.
+
+    Args:
+        game_plans: The plans of every game in the run.
+
+    Returns:
+        A description of each collision.
+    """
+    owners: Dict[Path, GameDir] = {}
+    problems = []
+    for game_plan in game_plans:
+        out_dir = game_plan.out_dir.absolute()
+        owner = owners.setdefault(out_dir, game_plan.game)
+        if owner.path != game_plan.game.path:
+            problems.append(
+                f"{owner} and {game_plan.game} would both be packed to {out_dir}"
+            )
+    return problems
+
+
+def _check_free_space(game_plans: List[GamePlan], reflink: bool) -> List[str]:
+    """Adds up the space the copied files need on each output device and compares
+    it to the free space. Moved and linked files take no space.
+
+    Args:
+        game_plans: The plans of every game in the run.
+        reflink: If True, copies on a file system that supports cloning files are
+          assumed to take no space.
+
+    Returns:
+        A description of each device that does not have enough free space.
+    """
+    required: Dict[int, int] = {}
+    # An existing directory on each device, and whether it can clone files.
+    directories: Dict[int, Path] = {}
+    clones: Dict[int, bool] = {}
+    for game_plan in game_plans:
+        if game_plan.skip:
+            continue
+        out_dir = _get_existing_dir(game_plan.out_dir)
+        device = os.stat(out_dir).st_dev
+        directories.setdefault(device, out_dir)
+        for file in game_plan.files:
+            if file.action not in DATA_ACTIONS:
+                continue
+            if reflink and file.same_device:
+                if device not in clones:
+                    clones[device] = supports_reflink(out_dir)
+                if clones[device]:
+                    continue
+            required[device] = required.get(device, 0) + file.size
+    problems = []
+    for device, needed in required.items():
+        free = shutil.disk_usage(directories[device]).free
+        if needed > free:
+            problems.append(
+                f"Not enough free space for {directories[device]}, {needed} bytes "
+                f"are needed and {free} bytes are free"
+            )
+    return problems
+
+
+def _get_device(directory: Path) -> int:
+    """Gets the device a directory is, or will be, on.
+
+    Args:
+        directory: The directory. It does not have to exist yet.
+
+    Returns:
+        The device of the directory or of its closest existing parent.
+    """
+    return os.stat(_get_existing_dir(directory)).st_dev
+
+
+def _get_existing_dir(directory: Path) -> Path:
+    """Gets the closest existing directory to a directory that will be written to.
+
+    Args:
+        directory: The directory. It does not have to exist yet.
+
+    Returns:
+        The directory, or its closest existing parent.
+    """
+    directory = directory.absolute()
+    while not directory.exists():
+        directory = directory.parent
+    return directory
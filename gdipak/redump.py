@@ -0,0 +1,136 @@
+"""Verifies game dumps against a Redump DAT file."""
+
+from collections import Counter
+import enum
+import hashlib
+from pathlib import Path
+from typing import Dict, List, NamedTuple
+from xml.etree import ElementTree
+
+from gdipak import file_utils
+from gdipak.checksums import hash_file
+
+
+@enum.unique
+class VerifyStatus(enum.Enum):
+    """Enum for the result of verifying a game."""
+
+    # Every track matches the same game in the DAT, and none of its tracks are
+    # missing.
+    MATCH = "match"
+    # Some tracks match a game in the DAT but others are missing or different.
+    BAD = "bad"
+    # None of the tracks are in the DAT.
+    UNKNOWN = "unknown"
+
+
+class VerifyResult(NamedTuple):
+    """The result of verifying a game."""
+
+    status: VerifyStatus
+    # The name of the game in the DAT that the tracks matched best.
+    game: str | None
+    # The tracks that are not part of that game.
+    bad_tracks: List[Path]
+
+    def __str__(self) -> str:
+        if self.game is None:
+            return self.status.value
+        text = f"{self.status.value} ({self.game})"
+        if self.bad_tracks:
+            text += ", bad tracks: " + ", ".join(file.name for file in self.bad_tracks)
+        return text
+
+
+class DatIndex:
+    """The tracks of every game in a DAT file, indexed by their SHA-1.
+
+    The DAT is read once, after which looking up a track does not depend on the
+    number of games in it.
+    """
+
+    def __init__(self, dat_file: str | Path) -> None:
+        """Reads the DAT file.
+
+        Args:
+            dat_file: The path to a Redump DAT file, in the Logiqx XML format.
+
+        Raises:
+            ValueError if the file is not a DAT file.
+        """
+        # A track can be shared by several games, revisions of the same game for
+        # example.
+        self._games_by_sha1: Dict[str, List[str]] = {}
+        self._track_counts: Dict[str, int] = {}
+        try:
+            for _event, element in ElementTree.iterparse(dat_file):
+                if element.tag == "game":
+                    self._add_game(element)
+                    # Only one game is kept in memory at a time.
+                    element.clear()
+        except ElementTree.ParseError as ex:
+            raise ValueError(f"Could not read DAT file {dat_file}: {ex}") from ex
+
+    def __len__(self) -> int:
+        return len(self._track_counts)
+
+    def find_games(self, sha1: str) -> List[str]:
+        """Finds the games that contain a track.
+
+        Args:
+            sha1: The hex digest of the track's SHA-1.
+
+        Returns:
+            The names of the games, empty if the track is not known.
+        """
+        return self._games_by_sha1.get(sha1.lower(), [])
+
+    def verify_game(
+        self, directory: str | Path, game_files: List[Path] = None
+    ) -> VerifyResult:
+        """Checks the tracks of a game against the DAT. The GDI file is not checked,
+        most tools write it differently.
+
+        Args:
+            directory: The game's directory.
+            game_files: Optional. The game's files. If left None the directory is
+              searched for them.
+
+        Returns:
+            The result.
+        """
+        if game_files is None:
+            game_files = file_utils.get_game_files_in_dir(directory)
+        tracks = [file for file in game_files if file.suffix.lower() != ".gdi"]
+        matches = {}
+        votes = Counter()
+        for track in tracks:
+            sha1 = hash_file(track, hashlib.sha1(usedforsecurity=False)).hexdigest()
+            matches[track] = self.find_games(sha1)
+            votes.update(matches[track])
+        if not votes:
+            return VerifyResult(VerifyStatus.UNKNOWN, None, tracks)
+        game, _count = votes.most_common(1)[0]
+        bad_tracks = [track for track in tracks if game not in matches[track]]
+        if bad_tracks or len(tracks) != self._track_counts[game]:
+            return VerifyResult(VerifyStatus.BAD, game, bad_tracks)
+        return VerifyResult(VerifyStatus.MATCH, game, [])
+
+    def _add_game(self, element: ElementTree.Element) -> None:
+        """Adds the tracks of a game to the index. The other files listed for it,
+        the GDI file and the CUE sheet of the Redump dump, are left out.
+
+        Args:
+            element: The game's element from the DAT.
+        """
+        name = element.get("name")
+        track_count = 0
+        for rom in element.iter("rom"):
+            suffix = Path(rom.get("name", "")).suffix.lower()
+            if suffix not in file_utils.TRACK_EXTENSIONS:
+                continue
+            track_count += 1
+            sha1 = rom.get("sha1")
+            if sha1:
+                self._games_by_sha1.setdefault(sha1.lower(), []).append(name)
+        self._track_counts[name] = track_count
@@ -0,0 +1,100 @@
+"""Runs packing jobs, optionally several at a time."""
+
+import queue
+import threading
+from typing import Any, Callable, Iterable, List, Tuple
+
+# The number of items that may wait in the queue for each worker thread. Keeps the
+# workers busy without reading far ahead of them.
+QUEUE_DEPTH = 2
+
+
+class PackingError(Exception):
+    """Raised after a run in which one or more jobs failed."""
+
+    def __init__(self, errors: List[Tuple[Any, Exception]]) -> None:
+        """Args:
+        errors: A list of (item, exception) pairs, in the order the items were
+          given.
+        """
+        self.errors = errors
+        details = "; ".join(f"{item}: {error}" for item, error in errors)
+        super().__init__(f"{len(errors)} job(s) failed. {details}")
+
+
+def run_jobs(action: Callable, items: Iterable, jobs: int = 1) -> List[Any]:
+    """Calls action once for every item.
+
+    Items are taken from the iterable as they are needed, so an iterable that is
+    still discovering items can be processed while it is running.
+
+    With a single job the items are processed one after another and the first error
+    is raised as is. With more than one job the items are passed through a bounded
+    queue to a pool of worker threads, every item is processed even if others fail,
+    and the failures are raised together afterwards.
+
+    Args:
+        action: A callable taking one item.
+        items: The items to process.
+        jobs: The maximum number of items to process at the same time.
+
+    Returns:
+        The values returned by action, in the same order as items.
+
+    Raises:
+        PackingError if more than one job was allowed and any of them failed.
+    """
+    if jobs < 1:
+        raise ValueError("jobs must be a positive number")
+    if jobs == 1:
+        return [action(item) for item in items]
+    return _run_parallel(action, items, jobs)
+
+
+def _run_parallel(action: Callable, items: Iterable, jobs: int) -> List[Any]:
+    """Feeds the items to a pool of worker threads through a bounded queue.
+
+    Args:
+        action: A callable taking one item.
+        items: The items to process.
+        jobs: The number of worker threads.
+
+    Returns:
+        The values returned by action, in the same order as items.
+
+    Raises:
+        PackingError if any of the jobs failed.
+    """
+    work = queue.Queue(maxsize=jobs * QUEUE_DEPTH)
+    # Only the results and the failed items are kept, not every item.
+    results = {}
+    errors = []
+
+    def worker() -> None:
+        while True:
+            job = work.get()
+            if job is None:
+                return
+            index, item = job
+            try:
+                results[index] = action(item)
+            except Exception as ex:  # pylint: disable=broad-except
+                errors.append((index, item, ex))
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(jobs)]
+    for thread in threads:
+        thread.start()
+    try:
+        for job in enumerate(items):
+            work.put(job)
+    finally:
+        # Let the workers finish what was queued, even if finding items failed.
+        for _ in threads:
+            work.put(None)
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        errors.sort(key=lambda error: error[0])
+        raise PackingError([(item, error) for _, item, error in errors])
+    return [results[index] for index in range(len(results))]
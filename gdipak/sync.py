@@ -0,0 +1,90 @@
+"""Flushes written files and directories to their device, so that packed games
+survive a power cut."""
+
+import os
+from pathlib import Path
+import threading
+from typing import Dict, Iterable
+
+
+def fsync_file(file_path: str | Path) -> None:
+    """Flushes a file's data and metadata to its device.
+
+    Args:
+        file_path: The file.
+    """
+    # Windows can only flush files that are open for writing.
+    flags = os.O_RDWR if os.name == "nt" else os.O_RDONLY
+    file_descriptor = os.open(file_path, flags)
+    try:
+        os.fsync(file_descriptor)
+    finally:
+        os.close(file_descriptor)
+
+
+def fsync_dir(directory: str | Path) -> None:
+    """Flushes a directory's entries to its device, so that the files created in it
+    and renamed into or out of it are kept.
+
+    Args:
+        directory: The directory.
+    """
+    if os.name == "nt":  # pragma: no cover
+        # Directories can not be opened on Windows, NTFS journals their entries.
+        return
+    file_descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(file_descriptor)
+    finally:
+        os.close(file_descriptor)
+
+
+class SyncBatch:
+    """Files and directories that have been written but not yet flushed.
+
+    Flushing many files together lets the device write them in one go, rather than
+    waiting for each file before the next one is written. Files can be added from
+    several threads.
+    """
+
+    def __init__(self) -> None:
+        # Dictionaries are used as ordered sets, each path is flushed once.
+        self._files: Dict[Path, None] = {}
+        self._dirs: Dict[Path, None] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._files) + len(self._dirs)
+
+    def add_files(self, file_paths: Iterable[str | Path]) -> None:
+        """Adds files, and the directories that contain them.
+
+        Args:
+            file_paths: The files.
+        """
+        with self._lock:
+            for file_path in file_paths:
+                file_path = Path(file_path)
+                self._files[file_path] = None
+                self._dirs[file_path.parent] = None
+
+    def add_dirs(self, directories: Iterable[str | Path]) -> None:
+        """Adds directories whose entries have changed.
+
+        Args:
+            directories: The directories.
+        """
+        with self._lock:
+            for directory in directories:
+                self._dirs[Path(directory)] = None
+
+    def flush(self) -> None:
+        """Flushes the files and then the directories, and empties the batch."""
+        with self._lock:
+            files, self._files = self._files, {}
+            dirs, self._dirs = self._dirs, {}
+        for file_path in files:
+            fsync_file(file_path)
+        for directory in dirs:
+            fsync_dir(directory)
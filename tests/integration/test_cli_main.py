@@ -1,12 +1,31 @@
 """Integration tests for gdipak"""
 
+import hashlib
+import json
+import os
+from pathlib import Path
 import pytest
 
-from tests.testing_utils import make_files, check_files, check_games, GameData
+from tests.testing_utils import (
+    make_files,
+    check_files,
+    check_games,
+    get_inode,
+    record_fsyncs,
+    GameData,
+)
 import gdipak.__main__ as cli
+from gdipak import planner
+from gdipak.arg_parser import IoMode
+from gdipak.checksums import MANIFEST_FILE_NAME
+from gdipak.copy_engine import CopyEngine, PipelineCopyEngine
+from gdipak.pack_record import RECORD_FILE_NAME
+from gdipak.packer import CopyPacker
+from gdipak.planner import PreflightError
+from gdipak.scheduler import PackingError
 
 
-class TestCliMain:
+class TestCliMain:  # pylint: disable=too-many-public-methods
     """Test building the GDI format files from the CLI."""
 
     def test_single_dir_same_out_dir_modify(self, tmp_path):
@@ -29,6 +48,24 @@ class TestCliMain:
         exts.append(None)
         check_files(dir_path, exts)
 
+    @pytest.mark.parametrize("mode", ["copy", "link"])
+    def test_single_dir_packed_relative_out_dir(self, tmp_path, monkeypatch, mode):
+        """Test copying or linking a game that is already packed onto itself, with
+        the output directory given as a relative path, leaves its files as they
+        are."""
+        game_dir = tmp_path / "g"
+        game_dir.mkdir()
+        track = os.urandom(5000)
+        (game_dir / "track01.bin").write_bytes(track)
+        (game_dir / "disc.gdi").write_bytes(b"1\r\n1 0 4 2352 track01.bin 0\r\n")
+        monkeypatch.chdir(tmp_path)
+        cli.main(["gdipak", "-i", str(game_dir), "-o", "g", "-m", mode])
+        assert (game_dir / "track01.bin").read_bytes() == track
+        assert sorted(file.name for file in game_dir.iterdir()) == [
+            "disc.gdi",
+            "track01.bin",
+        ]
+
     def test_single_dir_different_out_dir(self, tmp_path):
         """Test creating the output in a separate directory."""
         in_dir, _in_file_names, exts = make_files(tmp_path, "mygame")
@@ -41,6 +78,305 @@ class TestCliMain:
         assert len(remaining_files) == 0
         check_files(out_dir, exts)
 
+    def test_single_dir_different_out_dir_link(self, tmp_path):
+        """Test linking the output in a separate directory."""
+        in_dir, in_file_names, exts = make_files(tmp_path, "mygame")
+        out_dir = tmp_path / "processed_game"
+        out_dir.mkdir()
+        cli.main(["gdipak", "-i", str(in_dir), "-o", str(out_dir), "-m", "link"])
+
+        # src files are untouched
+        assert sorted(file.name for file in in_dir.iterdir()) == sorted(in_file_names)
+        check_files(out_dir, exts)
+        for out_file in out_dir.iterdir():
+            if out_file.suffix != ".gdi":
+                assert out_file.stat().st_nlink == 2
+
+    def test_single_dir_parallel_tracks(self, tmp_path):
+        """Test copying the tracks of a game at the same time."""
+        in_dir, _in_file_names, exts = make_files(tmp_path, "mygame")
+        out_dir = tmp_path / "processed_game"
+        out_dir.mkdir()
+        cli.main(
+            ["gdipak", "-i", str(in_dir), "-o", str(out_dir), "-m", "copy", "-t", "3"]
+        )
+        check_files(out_dir, exts)
+
+    def test_single_dir_checksums(self, tmp_path):
+        """Test writing the checksum manifest of the output files."""
+        in_dir, _in_file_names, exts = make_files(tmp_path, "mygame")
+        out_dir = tmp_path / "processed_game"
+        out_dir.mkdir()
+        cli.main(
+            ["gdipak", "-i", str(in_dir), "-o", str(out_dir), "-m", "copy"]
+            + ["--checksums"]
+        )
+        check_files(out_dir, exts, [MANIFEST_FILE_NAME])
+        manifest = (out_dir / MANIFEST_FILE_NAME).read_text(encoding="UTF-8")
+        lines = manifest.splitlines()[1:]
+        assert [line.split()[-1] for line in lines] == sorted(
+            file.name for file in out_dir.iterdir() if file.name != MANIFEST_FILE_NAME
+        )
+        for line in lines:
+            sha1, name = line.split()[-2:]
+            assert sha1 == hashlib.sha1((out_dir / name).read_bytes()).hexdigest()
+
+    @pytest.mark.parametrize("sync", ["none", "game", "file", "end"])
+    def test_recursive_sync(self, tmp_path, sync, monkeypatch):
+        """Test every output file is flushed, except in 'none' sync mode."""
+        in_path = tmp_path / "input_games"
+        in_path.mkdir()
+        out_path = tmp_path / "processed_games"
+        out_path.mkdir()
+        games_data = []
+        for name in ("game 1", "game 2"):
+            _, in_file_names, exts = make_files(in_path, name)
+            games_data.append(GameData(name, exts, in_file_names))
+        fsynced = record_fsyncs(monkeypatch)
+        cli.main(
+            ["gdipak", "-i", str(in_path), "-o", str(out_path), "-m", "copy", "-r"]
+            + ["-n", "--sync", sync]
+        )
+        check_games(games_data, out_path)
+        out_files = [file for file in out_path.rglob("*") if file.is_file()]
+        assert len(out_files) == 10
+        if sync == "none":
+            assert not fsynced
+        else:
+            assert {get_inode(file) for file in out_files} <= set(fsynced)
+
+    @pytest.mark.parametrize("io_mode", ["buffered", "bulk", "direct"])
+    @pytest.mark.parametrize("pipeline", [[], ["--pipeline"]])
+    def test_recursive_io_mode(self, tmp_path, io_mode, pipeline):
+        """Test packing a directory tree in each I/O mode, with and without the
+        pipeline."""
+        in_path = tmp_path / "input_games"
+        in_path.mkdir()
+        out_path = tmp_path / "processed_games"
+        out_path.mkdir()
+        games_data = []
+        for name in ("game 1", "game 2"):
+            _, in_file_names, exts = make_files(in_path, name)
+            games_data.append(GameData(name, exts, in_file_names))
+        cli.main(
+            ["gdipak", "-i", str(in_path), "-o", str(out_path), "-m", "copy", "-r"]
+            + ["--io-mode", io_mode]
+            + pipeline
+        )
+        check_games(games_data, out_path)
+
+    @pytest.mark.parametrize(
+        "pipeline, engine_class", [(False, CopyEngine), (True, PipelineCopyEngine)]
+    )
+    def test_get_copy_engine(self, pipeline, engine_class):
+        """Test the copy engine is only pipelined when it is asked for."""
+        engine = cli.get_copy_engine({"io_mode": IoMode.BULK, "pipeline": pipeline})
+        assert type(engine) is engine_class  # pylint: disable=unidiomatic-typecheck
+        assert engine.bulk == hasattr(os, "posix_fadvise")
+
+    def test_recursive_one_engine(self, tmp_path, monkeypatch):
+        """Test every game of a run is copied by the same copy engine."""
+        in_path = tmp_path / "input_games"
+        in_path.mkdir()
+        out_path = tmp_path / "processed_games"
+        out_path.mkdir()
+        for name in ("game 1", "game 2"):
+            make_files(in_path, name)
+        engines = []
+        get_copy_engine = cli.get_copy_engine
+
+        def record_engine(args):
+            engines.append(get_copy_engine(args))
+            return engines[-1]
+
+        packed = []
+        file_action = CopyPacker.file_action
+
+        def record_file_action(self, in_file, out_file):
+            packed.append(self.engine)
+            file_action(self, in_file, out_file)
+
+        monkeypatch.setattr(cli, "get_copy_engine", record_engine)
+        monkeypatch.setattr(CopyPacker, "file_action", record_file_action)
+        cli.main(
+            ["gdipak", "-i", str(in_path), "-o", str(out_path), "-m", "copy"]
+            + ["-r", "1", "-j", "2"]
+        )
+        assert len(engines) == 1
+        assert packed
+        assert all(engine is engines[0] for engine in packed)
+
+    def test_recursive_verify(self, tmp_path, capsys):
+        """Test verifying each game against a DAT file before it is packed."""
+        in_path = tmp_path / "input_games"
+        in_path.mkdir()
+        out_path = tmp_path / "processed_games"
+        out_path.mkdir()
+        good_path, _, _ = make_files(in_path, "good game")
+        unknown_path, _, _ = make_files(in_path, "unknown game")
+        roms = []
+        for track in sorted(good_path.glob("*(track*")):
+            track.write_bytes(track.name.encode())
+            sha1 = hashlib.sha1(track.read_bytes()).hexdigest()
+            roms.append(f'<rom name="{track.name}" sha1="{sha1}"/>')
+        for track in unknown_path.glob("*(track*"):
+            track.write_bytes(b"unknown " + track.name.encode())
+        dat_file = tmp_path / "dreamcast.dat"
+        dat_file.write_text(
+            '<datafile><game name="Good Game (USA)">'
+            + "".join(roms)
+            + "</game></datafile>",
+            encoding="UTF-8",
+        )
+        cli.main(
+            ["gdipak", "-i", str(in_path), "-o", str(out_path), "-m", "copy", "-r"]
+            + ["1", "--verify", str(dat_file)]
+        )
+        output = capsys.readouterr().out.splitlines()
+        assert output == [
+            f"{good_path}: match (Good Game (USA))",
+            f"{unknown_path}: unknown",
+        ]
+        assert (out_path / "good game" / "disc.gdi").exists()
+        assert (out_path / "unknown game" / "disc.gdi").exists()
+
+    @pytest.mark.parametrize("mode", ["skip", "link"])
+    def test_recursive_dedup(self, tmp_path, mode, capsys):
+        """Test copies of a game under different names are packed once."""
+        in_path = tmp_path / "input_games"
+        in_path.mkdir()
+        out_path = tmp_path / "processed_games"
+        out_path.mkdir()
+        for name in ("game", "game copy", "other game"):
+            game_path, _, _ = make_files(in_path, name)
+            for track in game_path.glob("*(track*"):
+                contents = track.name.split("(")[1]
+                if name == "other game":
+                    contents = "other " + contents
+                track.write_text(contents, encoding="UTF-8")
+        cli.main(
+            ["gdipak", "-i", str(in_path), "-o", str(out_path), "-m", "copy", "-r"]
+            + ["1", "-n", "--dedup", mode]
+        )
+        game_out = out_path / "game"
+        copy_out = out_path / "game copy"
+        assert (out_path / "other game" / "disc.gdi").exists()
+        if mode == "skip":
+            assert not copy_out.exists()
+            output = capsys.readouterr().out
+            assert "game copy is a duplicate of " in output
+            return
+        assert sorted(file.name for file in copy_out.iterdir()) == [
+            "disc.gdi",
+            "game copy",
+            "track01.bin",
+            "track02.bin",
+            "track03.raw",
+        ]
+        for track in game_out.glob("track*"):
+            assert (copy_out / track.name).samefile(track)
+        gdi_contents = (game_out / "disc.gdi").read_bytes()
+        assert (copy_out / "disc.gdi").read_bytes() == gdi_contents
+
+    @pytest.mark.parametrize("sync", ["game", "file", "end"])
+    def test_recursive_dedup_sync(self, tmp_path, sync, monkeypatch):
+        """Test the files linked for a duplicate game are flushed."""
+        in_path = tmp_path / "input_games"
+        in_path.mkdir()
+        out_path = tmp_path / "processed_games"
+        out_path.mkdir()
+        for name in ("game", "game copy"):
+            make_files(in_path, name)
+        fsynced = record_fsyncs(monkeypatch)
+        cli.main(
+            ["gdipak", "-i", str(in_path), "-o", str(out_path), "-m", "copy", "-r"]
+            + ["1", "-n", "--dedup", "link", "--sync", sync]
+        )
+        copy_out = out_path / "game copy"
+        copy_files = list(copy_out.iterdir())
+        assert len(copy_files) == 5
+        assert {get_inode(file) for file in copy_files} <= set(fsynced)
+        assert get_inode(copy_out) in fsynced
+
+    def test_recursive_plan(self, tmp_path, capsys, monkeypatch):
+        """Test planning a run prints the plan and packs nothing."""
+        monkeypatch.setattr(planner, "PROBE_SIZE", 1024)
+        in_path = tmp_path / "input_games"
+        in_path.mkdir()
+        out_path = tmp_path / "processed_games"
+        out_path.mkdir()
+        for name in ("game one", "game two"):
+            game_path, _, _ = make_files(in_path, name)
+            for track in game_path.glob("*(track*"):
+                track.write_bytes(bytes(10))
+        cli.main(
+            ["gdipak", "-i", str(in_path), "-o", str(out_path), "-m", "copy", "-r"]
+            + ["1", "--plan"]
+        )
+        assert not list(out_path.iterdir())
+        plan = json.loads(capsys.readouterr().out)
+        assert [game["out_dir"] for game in plan["games"]] == [
+            str(out_path / "game one"),
+            str(out_path / "game two"),
+        ]
+        files = plan["games"][0]["files"]
+        assert files[-1]["destination"] == str(out_path / "game one" / "disc.gdi")
+        assert {file["action"] for file in files} == {"copy"}
+        totals = plan["totals"]
+        assert totals["files"] == 8
+        assert totals["data_bytes"] == totals["bytes"]
+        assert totals["estimated_seconds"] == (
+            totals["data_bytes"] / totals["throughput_bytes_per_second"]
+        )
+        assert not plan["duplicates"]
+
+    def test_preflight(self, tmp_path):
+        """Test a run that passes the preflight checks is packed."""
+        in_dir, _in_file_names, exts = make_files(tmp_path, "mygame")
+        out_dir = tmp_path / "processed_game"
+        out_dir.mkdir()
+        cli.main(
+            ["gdipak", "-i", str(in_dir), "-o", str(out_dir), "-m", "copy"]
+            + ["--preflight"]
+        )
+        check_files(out_dir, exts)
+
+    def test_preflight_collision(self, tmp_path, capsys, monkeypatch):
+        """Test two games flattened to the same directory stop the run before
+        anything is packed, and are reported by the plan."""
+        monkeypatch.setattr(planner, "PROBE_SIZE", 1024)
+        in_path = tmp_path / "input_games"
+        out_path = tmp_path / "processed_games"
+        out_path.mkdir()
+        for parent in ("good", "bad"):
+            (in_path / parent).mkdir(parents=True)
+            make_files(in_path / parent, "same name")
+        args = ["gdipak", "-i", str(in_path), "-o", str(out_path), "-m", "copy"]
+        args += ["-r", "1"]
+        with pytest.raises(PreflightError) as ex:
+            cli.main(args + ["--preflight"])
+        assert "would both be packed to" in str(ex.value)
+        assert not list(out_path.iterdir())
+
+        cli.main(args + ["--plan"])
+        plan = json.loads(capsys.readouterr().out)
+        assert len(plan["problems"]) == 1
+
+    def test_plan_incremental(self, tmp_path, capsys, monkeypatch):
+        """Test planning leaves out games that would be skipped."""
+        monkeypatch.setattr(planner, "PROBE_SIZE", 1024)
+        in_dir, _in_file_names, _exts = make_files(tmp_path, "mygame")
+        out_dir = tmp_path / "processed_game"
+        out_dir.mkdir()
+        args = ["gdipak", "-i", str(in_dir), "-o", str(out_dir), "-m", "copy"]
+        args += ["--incremental"]
+        cli.main(args)
+        capsys.readouterr()
+        cli.main(args + ["--plan"])
+        plan = json.loads(capsys.readouterr().out)
+        assert plan["games"][0]["skip"] is True
+        assert plan["totals"]["files"] == 0
+
     def test_recursive_dir_same_out_dir_copy(self, tmp_path):
         """Test multiple sets of files in a single directory."""
         dir_path, mg_in_file_names, exts = make_files(tmp_path, "mygame")
@@ -182,6 +518,20 @@ class TestCliMain:
         out_path = out_path / game3_name
         check_games(games_data, out_path, fail_on_non_dirs=False)
 
+    def test_recursive_out_dir_in_in_dir(self, tmp_path):
+        """Test an output directory inside the input directory is not searched for
+        games, even though games are packaged to it while the search goes on."""
+        in_path = tmp_path / "lib"
+        in_path.mkdir()
+        _, in_file_names, exts = make_files(in_path, "gameA")
+        out_path = in_path / "zout"
+        out_path.mkdir()
+        cli.main(
+            ["gdipak", "-i", str(in_path), "-o", str(out_path), "-m", "copy", "-r", "0"]
+        )
+        check_games([GameData("gameA", exts, in_file_names)], out_path)
+        assert not (out_path / "zout").exists()
+
     def test_missing_gdi_file(self, tmp_path):
         """Tests a set of files that does not include the gdi file."""
         name = "mygame"
@@ -201,3 +551,184 @@ class TestCliMain:
         with pytest.raises(ValueError) as ex:
             cli.main(["gdipak", "-i", str(path), "-o", str(path), "-m", "modify"])
         assert "Directory contains more than one gdi file" in str(ex.value)
+
+    def test_recursive_parallel_jobs(self, tmp_path):
+        """Test packing several games at the same time."""
+        in_path = tmp_path / "input_games"
+        in_path.mkdir()
+        out_path = tmp_path / "processed_games"
+        out_path.mkdir()
+        games_data = []
+        for index in range(5):
+            name = f"game {index}"
+            _, in_file_names, exts = make_files(in_path, name)
+            games_data.append(GameData(name, exts, in_file_names))
+
+        cli.main(
+            [
+                "gdipak",
+                "-i",
+                str(in_path),
+                "-o",
+                str(out_path),
+                "-m",
+                "copy",
+                "-r",
+                "1",
+                "-j",
+                "3",
+            ]
+        )
+        check_games(games_data, out_path)
+
+    def test_recursive_parallel_jobs_errors(self, tmp_path):
+        """Test that a failed game does not stop the others from being packed."""
+        in_path = tmp_path / "input_games"
+        in_path.mkdir()
+        out_path = tmp_path / "processed_games"
+        out_path.mkdir()
+        bad_path, _, _ = make_files(in_path, "bad game")
+        # A track without a track number can not be renamed.
+        (bad_path / "bad game - broken.bin").touch()
+        _, in_file_names, exts = make_files(in_path, "good game")
+
+        with pytest.raises(PackingError) as ex:
+            cli.main(
+                ["gdipak", "-i", str(in_path), "-o", str(out_path), "-m", "copy"]
+                + ["-r", "1", "-j", "2"]
+            )
+        assert [item.path for item, _ in ex.value.errors] == [bad_path]
+        check_games([GameData("good game", exts, in_file_names)], out_path)
+
+    def test_recursive_skips_non_game_dirs(self, tmp_path):
+        """Test that directories without exactly one gdi file are skipped."""
+        in_path = tmp_path / "input_games"
+        category_path = in_path / "fighting games"
+        category_path.mkdir(parents=True)
+        _, in_file_names, exts = make_files(category_path, "some game")
+        ambiguous_path, _, _ = make_files(in_path, "two discs")
+        (ambiguous_path / "disc 2.gdi").touch()
+        out_path = tmp_path / "processed_games"
+        out_path.mkdir()
+
+        with pytest.warns(UserWarning, match="contains more than one gdi file"):
+            cli.main(
+                ["gdipak", "-i", str(in_path), "-o", str(out_path), "-m", "copy"]
+                + ["-r", "1"]
+            )
+        check_games([GameData("some game", exts, in_file_names)], out_path)
+
+    def test_incremental(self, tmp_path, monkeypatch):
+        """Test that unchanged games are skipped and changed games are repacked."""
+        in_path = tmp_path / "input_games"
+        in_path.mkdir()
+        out_path = tmp_path / "processed_games"
+        out_path.mkdir()
+        _, names1, exts1 = make_files(in_path, "game one")
+        game2_path, names2, exts2 = make_files(in_path, "game two")
+        args = ["gdipak", "-i", str(in_path), "-o", str(out_path), "-m", "copy"]
+        args += ["-r", "1", "--incremental"]
+        cli.main(args)
+        games_data = [
+            GameData("game one", exts1, names1 + [RECORD_FILE_NAME]),
+            GameData("game two", exts2, names2 + [RECORD_FILE_NAME]),
+        ]
+        check_games(games_data, out_path)
+
+        packed = []
+        package_game = CopyPacker.package_game
+
+        def record_package_game(self, **kwargs):
+            packed.append(self.gdi_file.parent.name)
+            package_game(self, **kwargs)
+
+        monkeypatch.setattr(CopyPacker, "package_game", record_package_game)
+        cli.main(args)
+        assert not packed
+
+        (game2_path / "game two(track1).bin").write_bytes(b"redumped")
+        cli.main(args)
+        assert packed == ["game two"]
+        out_track = out_path / "game two" / "track01.bin"
+        assert out_track.read_bytes() == b"redumped"
+
+    def test_single_dir_symlinked_out_dir(self, tmp_path):
+        """Test a game packed to a symbolic link is written into the directory it
+        links to, and the link and the other files there are left as they were."""
+        in_dir, in_file_names, exts = make_files(tmp_path, "mygame")
+        card_path = tmp_path / "card"
+        card_path.mkdir()
+        (card_path / "other.txt").write_text("other")
+        out_dir = tmp_path / "sd"
+        out_dir.symlink_to(card_path)
+        for _ in range(2):
+            cli.main(["gdipak", "-i", str(in_dir), "-o", str(out_dir), "-m", "copy"])
+        assert out_dir.is_symlink()
+        assert sorted(file.name for file in tmp_path.iterdir()) == [
+            "card",
+            "mygame",
+            "sd",
+        ]
+        assert (card_path / "other.txt").read_text() == "other"
+        check_files(card_path, exts, in_file_names + ["other.txt"])
+
+    @pytest.mark.parametrize("sync", ["none", "end"])
+    def test_single_dir_working_out_dir_incremental(self, tmp_path, sync, monkeypatch):
+        """Test a game packed to the working directory leaves it in place, so that
+        the pack record and the files to flush are still found there."""
+        in_dir, in_file_names, exts = make_files(tmp_path, "mygame")
+        out_dir = tmp_path / "processed_game"
+        out_dir.mkdir()
+        monkeypatch.chdir(out_dir)
+        args = ["gdipak", "-i", str(in_dir), "-o", ".", "-m", "copy"]
+        args += ["--incremental", "--sync", sync]
+        cli.main(args)
+        (in_dir / in_file_names[0]).write_bytes(b"redumped")
+        cli.main(args)
+        assert Path.cwd() == out_dir
+        assert sorted(file.name for file in tmp_path.iterdir()) == [
+            "mygame",
+            "processed_game",
+        ]
+        assert (out_dir / "track01.bin").read_bytes() == b"redumped"
+        check_files(out_dir, exts, [RECORD_FILE_NAME])
+
+    def test_resume_with_state_db(self, tmp_path, monkeypatch):
+        """Test an interrupted run is resumed where it stopped."""
+        in_path = tmp_path / "input_games"
+        in_path.mkdir()
+        games_data = []
+        for index in range(3):
+            name = f"game {index}"
+            _, _in_file_names, exts = make_files(in_path, name)
+            games_data.append(GameData(name, exts, []))
+        args = ["gdipak", "-i", str(in_path), "-o", "in-dir", "-m", "modify", "-r"]
+        args += ["--state-db", str(tmp_path / "state.db")]
+
+        moved = []
+        replace = Path.replace
+
+        def crashing_replace(self, target):
+            if len(moved) == 6:
+                raise RuntimeError("Power cut")
+            moved.append(self.name)
+            return replace(self, target)
+
+        monkeypatch.setattr(Path, "replace", crashing_replace)
+        with pytest.raises(RuntimeError):
+            cli.main(args)
+        # The first game is done, the second game has two of its tracks moved.
+        assert moved[4:] == ["game 1(track1).bin", "game 1(track2).bin"]
+
+        moved.clear()
+        monkeypatch.setattr(Path, "replace", crashing_replace)
+        cli.main(args)
+        assert moved == [
+            "game 1(track3).raw",
+            "game 1.gdi",
+            "game 2(track1).bin",
+            "game 2(track2).bin",
+            "game 2(track3).raw",
+            "game 2.gdi",
+        ]
+        check_games(games_data, in_path)
@@ -1,12 +1,15 @@
 """Functions used across various unit tests."""
 
 from collections import namedtuple
+import os
 from os import path
 from pathlib import Path
 import random
 import re
 from typing import Dict, List, Tuple
 
+import pytest
+
 
 # pylint: disable=too-few-public-methods
 class GdiGenerator:
@@ -307,3 +310,38 @@ def create_dirs_in_dir(
         subdir.mkdir()
         subdirs.append(str(subdir))
     return subdirs
+
+
+def get_inode(file_path: str | Path) -> Tuple[int, int]:
+    """Gets what identifies a file or directory, whatever path it is reached by.
+
+    Args:
+        file_path: The path to the file or directory.
+
+    Returns:
+        The device and inode number.
+    """
+    file_stat = os.stat(file_path)
+    return file_stat.st_dev, file_stat.st_ino
+
+
+def record_fsyncs(monkeypatch: pytest.MonkeyPatch) -> List[Tuple[int, int]]:
+    """Records every file and directory that is flushed to its device.
+
+    Args:
+        monkeypatch: The pytest monkeypatch fixture.
+
+    Returns:
+        A list that the device and inode number of each flushed file are appended
+        to, as returned by get_inode.
+    """
+    fsynced = []
+    fsync = os.fsync
+
+    def record_fsync(file_descriptor: int) -> None:
+        file_stat = os.fstat(file_descriptor)
+        fsynced.append((file_stat.st_dev, file_stat.st_ino))
+        fsync(file_descriptor)
+
+    monkeypatch.setattr(os, "fsync", record_fsync)
+    return fsynced
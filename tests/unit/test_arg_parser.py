@@ -4,7 +4,14 @@ from argparse import ArgumentParser
 from pathlib import Path
 import pytest
 
-from gdipak.arg_parser import ArgParser, OperatingMode, RecursiveMode
+from gdipak.arg_parser import (
+    ArgParser,
+    DedupMode,
+    IoMode,
+    OperatingMode,
+    RecursiveMode,
+    SyncMode,
+)
 
 
 class TestRecursiveMode:
@@ -39,6 +46,11 @@ class TestOperatingMode:
         mode = OperatingMode("MODIFY")
         assert mode == OperatingMode.MODIFY
 
+    def test_link(self):
+        """Test link mapping."""
+        mode = OperatingMode("LINK")
+        assert mode == OperatingMode.LINK
+
     def test_invalid(self):
         """Test invalid enum value."""
         with pytest.raises(ValueError):
@@ -74,18 +86,51 @@ class TestArgs:
         assert parsed.mode == "MODIFY"
         assert parsed.namefile is False
         assert parsed.recursive is None
+        assert parsed.jobs == 1
+        assert parsed.track_jobs == 1
+        assert parsed.incremental is False
+        assert parsed.state_db is None
+        assert parsed.checksums is False
+        assert parsed.verify is None
+        assert parsed.dedup is None
+        assert parsed.plan is False
+        assert parsed.preflight is False
+        assert parsed.sync == "NONE"
+        assert parsed.io_mode == "BUFFERED"
+        assert parsed.pipeline is False
 
     def test_valid_all_args(self):
         """Test setting optional and required arguments."""
         arg_parser = self.arg_parser._ArgParser__setup()
         parsed = arg_parser.parse_args(
-            ["-i", ".", "-o", "./out", "-m", "copy", "-r", "1", "-n"]
+            ["-i", ".", "-o", "./out", "-m", "copy", "-r", "1", "-n", "-j", "4"]
+            + ["-t", "3", "--incremental", "--state-db", "run.db", "--checksums"]
+            + ["--verify", "dreamcast.dat", "--dedup", "link", "--plan"]
+            + ["--preflight", "--sync", "game", "--io-mode", "bulk", "--pipeline"]
         )
         assert parsed.in_dir == "."
         assert parsed.out_dir == "./out"
         assert parsed.mode == "COPY"
         assert parsed.namefile is True
         assert parsed.recursive == 1
+        assert parsed.jobs == 4
+        assert parsed.track_jobs == 3
+        assert parsed.incremental is True
+        assert parsed.state_db == "run.db"
+        assert parsed.checksums is True
+        assert parsed.verify == "dreamcast.dat"
+        assert parsed.dedup == "LINK"
+        assert parsed.plan is True
+        assert parsed.preflight is True
+        assert parsed.sync == "GAME"
+        assert parsed.io_mode == "BULK"
+        assert parsed.pipeline is True
+
+    def test_valid_link_mode(self):
+        """Test selecting link mode."""
+        arg_parser = self.arg_parser._ArgParser__setup()
+        parsed = arg_parser.parse_args(["-i", ".", "-o", "./out", "-m", "link"])
+        assert parsed.mode == "LINK"
 
     def test_valid_recursive_default(self):
         """Test default recursive argument."""
@@ -144,7 +189,7 @@ class TestArgs:
             arg_parser.parse_args(["-i", ".", "-o", ".", "-m", "mogdifly"])
 
 
-class TestValidateArgs:
+class TestValidateArgs:  # pylint: disable=too-many-public-methods
     """Tests validating arguments in the argument parser."""
 
     # pylint: disable=protected-access
@@ -158,6 +203,18 @@ class TestValidateArgs:
             "mode": "COPY",
             "recursive": None,
             "namefile": False,
+            "jobs": 1,
+            "track_jobs": 1,
+            "incremental": False,
+            "state_db": None,
+            "checksums": False,
+            "verify": None,
+            "dedup": None,
+            "plan": False,
+            "preflight": False,
+            "sync": "NONE",
+            "io_mode": "BUFFERED",
+            "pipeline": False,
         }
 
     def test_current_dir(self):
@@ -256,6 +313,81 @@ class TestValidateArgs:
         args.update({"in_dir": ".", "out_dir": ".", "recursive": 1})
         self.arg_parser._ArgParser__validate_args(args)
 
+    def test_jobs_valid(self):
+        """Test a positive number of jobs is valid."""
+        args = self.base_args
+        args.update({"in_dir": ".", "out_dir": ".", "jobs": 8})
+        args = self.arg_parser._ArgParser__validate_args(args)
+        assert args["jobs"] == 8
+
+    def test_jobs_invalid(self):
+        """Test that zero jobs is not valid."""
+        args = self.base_args
+        args.update({"in_dir": ".", "out_dir": ".", "jobs": 0})
+        with pytest.raises(SystemExit):
+            self.arg_parser._ArgParser__validate_args(args)
+        args["jobs"] = 1
+
+    def test_track_jobs_invalid(self):
+        """Test that zero track jobs is not valid."""
+        args = self.base_args
+        args.update({"in_dir": ".", "out_dir": ".", "track_jobs": 0})
+        with pytest.raises(SystemExit):
+            self.arg_parser._ArgParser__validate_args(args)
+        args["track_jobs"] = 1
+
+    def test_verify_valid(self, tmp_path):
+        """Test a DAT file that exists is valid."""
+        dat_file = tmp_path / "dreamcast.dat"
+        dat_file.touch()
+        args = self.base_args
+        args.update({"in_dir": ".", "out_dir": ".", "verify": str(dat_file)})
+        args = self.arg_parser._ArgParser__validate_args(args)
+        assert args["verify"] == str(dat_file)
+        args["verify"] = None
+
+    def test_verify_missing_dat(self, tmp_path):
+        """Test that a DAT file that does not exist is not valid."""
+        args = self.base_args
+        args.update({"in_dir": ".", "out_dir": ".", "verify": str(tmp_path / "x")})
+        with pytest.raises(SystemExit):
+            self.arg_parser._ArgParser__validate_args(args)
+        args["verify"] = None
+
+    def test_dedup_valid(self):
+        """Test the dedup mode is converted to its enum."""
+        args = self.base_args
+        args.update({"in_dir": ".", "out_dir": ".", "dedup": "SKIP"})
+        args = self.arg_parser._ArgParser__validate_args(args)
+        assert args["dedup"] == DedupMode.SKIP
+        args["dedup"] = None
+
+    def test_sync_valid(self):
+        """Test the sync mode is converted to its enum."""
+        args = self.base_args
+        args.update({"in_dir": ".", "out_dir": ".", "sync": "END"})
+        args = self.arg_parser._ArgParser__validate_args(args)
+        assert args["sync"] == SyncMode.END
+        args["sync"] = "NONE"
+
+    def test_io_mode_valid(self):
+        """Test the I/O mode is converted to its enum."""
+        args = self.base_args
+        args.update({"in_dir": ".", "out_dir": ".", "io_mode": "DIRECT"})
+        args = self.arg_parser._ArgParser__validate_args(args)
+        assert args["io_mode"] == IoMode.DIRECT
+        args["io_mode"] = "BUFFERED"
+
+    def test_incremental_and_modify(self):
+        """Test that incremental mode can not be combined with modify mode."""
+        args = self.base_args
+        args.update(
+            {"in_dir": ".", "out_dir": ".", "mode": "MODIFY", "incremental": True}
+        )
+        with pytest.raises(SystemExit):
+            self.arg_parser._ArgParser__validate_args(args)
+        args.update({"mode": "COPY", "incremental": False})
+
     def test_recursive_and_modify(self):
         """Test recursive with modify is valid."""
         args = self.base_args
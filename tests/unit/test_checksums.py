@@ -0,0 +1,98 @@
+"""Tests for checksums.py"""
+
+import hashlib
+import os
+import zlib
+
+from gdipak.checksums import (
+    MANIFEST_FILE_NAME,
+    MultiHasher,
+    hash_file,
+    write_manifest,
+)
+
+
+class TestMultiHasher:
+    """Tests computing several checksums at once."""
+
+    def test_empty(self):
+        """Test the checksums of no data."""
+        hasher = MultiHasher()
+        assert hasher.size == 0
+        assert hasher.hexdigests() == {
+            "crc32": "00000000",
+            "md5": hashlib.md5(b"").hexdigest(),
+            "sha1": hashlib.sha1(b"").hexdigest(),
+        }
+
+    def test_in_parts(self):
+        """Test that data given in parts has the same checksums as all at once."""
+        data = os.urandom(1000)
+        hasher = MultiHasher()
+        hasher.update(data[:3])
+        hasher.update(memoryview(data)[3:])
+        assert hasher.size == len(data)
+        assert hasher.hexdigests() == {
+            "crc32": f"{zlib.crc32(data):08x}",
+            "md5": hashlib.md5(data).hexdigest(),
+            "sha1": hashlib.sha1(data).hexdigest(),
+        }
+
+
+class TestHashFile:
+    """Tests computing the checksums of a file."""
+
+    def test_hash_file(self, tmp_path):
+        """Test reading a file that is not a multiple of the block size."""
+        data = os.urandom(10 * 7 + 3)
+        file = tmp_path / "track01.bin"
+        file.write_bytes(data)
+        hasher = hash_file(file, block_size=7)
+        assert hasher.size == len(data)
+        assert hasher.hexdigests()["sha1"] == hashlib.sha1(data).hexdigest()
+
+    def test_given_hasher(self, tmp_path):
+        """Test the file's contents are added to a given hasher."""
+        file = tmp_path / "track01.bin"
+        file.write_bytes(b"track")
+        hasher = MultiHasher()
+        hasher.update(b"first ")
+        assert hash_file(file, hasher) is hasher
+        assert hasher.hexdigests()["md5"] == hashlib.md5(b"first track").hexdigest()
+
+
+class TestWriteManifest:
+    """Tests writing the checksum manifest of a game."""
+
+    def test_write_manifest(self, tmp_path):
+        """Test the manifest lists every file, sorted by name."""
+        hashers = {}
+        for name, data in (("track02.raw", b"audio"), ("disc.gdi", b"2")):
+            hashers[name] = MultiHasher()
+            hashers[name].update(data)
+        manifest_path = write_manifest(tmp_path, hashers)
+        assert manifest_path == tmp_path / MANIFEST_FILE_NAME
+        lines = manifest_path.read_text(encoding="UTF-8").splitlines()
+        assert lines[0] == "# size crc32 md5 sha1 name"
+        sha1 = hashlib.sha1(b"2").hexdigest()
+        assert lines[1] == (
+            f"1 {zlib.crc32(b'2'):08x} {hashlib.md5(b'2').hexdigest()} {sha1} disc.gdi"
+        )
+        assert lines[2].split() == [
+            "5",
+            f"{zlib.crc32(b'audio'):08x}",
+            hashlib.md5(b"audio").hexdigest(),
+            hashlib.sha1(b"audio").hexdigest(),
+            "track02.raw",
+        ]
+        assert len(lines) == 3
+
+    def test_replaces_manifest(self, tmp_path):
+        """Test a manifest left by an earlier run is replaced."""
+        hasher = MultiHasher()
+        hasher.update(b"2")
+        write_manifest(tmp_path, {"old.gdi": hasher})
+        manifest_path = write_manifest(tmp_path, {"disc.gdi": hasher})
+        lines = manifest_path.read_text(encoding="UTF-8").splitlines()
+        assert len(lines) == 2
+        assert lines[1].endswith(" disc.gdi")
@@ -0,0 +1,706 @@
+"""Tests for copy_engine.py"""
+
+import errno
+import io
+import os
+import sys
+import threading
+import pytest
+
+from gdipak import copy_engine
+from gdipak.checksums import MultiHasher, hash_file
+from gdipak.copy_engine import (
+    CopyEngine,
+    DEFAULT_BLOCK_SIZE,
+    PipelineCopyEngine,
+    supports_reflink,
+)
+from tests.testing_utils import get_inode, record_fsyncs
+
+
+def unsupported(*_args):
+    """Stands in for a kernel copy method the file system does not support."""
+    raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+
+class TestCopyEngine:
+    """Tests copying files with the copy engine."""
+
+    def test_default_block_size(self):
+        """Test the block size used when none is given."""
+        assert CopyEngine().block_size == DEFAULT_BLOCK_SIZE
+
+    def test_invalid_block_size(self):
+        """Test that a block size less than one byte is rejected."""
+        with pytest.raises(ValueError) as ex:
+            CopyEngine(block_size=0)
+        assert "block_size must be a positive number of bytes" in str(ex.value)
+
+    def test_empty_file(self, tmp_path):
+        """Test copying a file with no contents."""
+        in_file = tmp_path / "in.bin"
+        in_file.touch()
+        out_file = tmp_path / "out.bin"
+        copied = CopyEngine()(in_file, out_file)
+        assert copied == 0
+        assert out_file.read_bytes() == b""
+
+    def test_multiple_blocks(self, tmp_path):
+        """Test copying a file that is not a multiple of the block size."""
+        contents = os.urandom(10 * 7 + 3)
+        in_file = tmp_path / "in.bin"
+        in_file.write_bytes(contents)
+        out_file = tmp_path / "out.bin"
+        engine = CopyEngine(block_size=7, zero_copy=False)
+        copied = engine(str(in_file), str(out_file))
+        assert copied == len(contents)
+        assert out_file.read_bytes() == contents
+
+    @pytest.mark.parametrize("hashed", [False, True])
+    def test_same_file(self, tmp_path, monkeypatch, hashed):
+        """Test a file copied onto itself, given once as a relative path and once as
+        an absolute path, is left as it is."""
+        contents = os.urandom(5000)
+        in_file = tmp_path / "track01.bin"
+        in_file.write_bytes(contents)
+        monkeypatch.chdir(tmp_path)
+        hasher = MultiHasher() if hashed else None
+        copied = CopyEngine(block_size=1000)(in_file, "track01.bin", hasher)
+        assert copied == len(contents)
+        assert in_file.read_bytes() == contents
+        if hashed:
+            assert hasher.hexdigests() == hash_file(in_file).hexdigests()
+
+    def test_truncates_existing_file(self, tmp_path):
+        """Test that an existing, larger, out file is replaced."""
+        in_file = tmp_path / "in.bin"
+        in_file.write_bytes(b"short")
+        out_file = tmp_path / "out.bin"
+        out_file.write_bytes(b"a much longer set of contents")
+        CopyEngine()(in_file, out_file)
+        assert out_file.read_bytes() == b"short"
+
+    def test_partial_writes(self, tmp_path, monkeypatch):
+        """Test that short writes are retried until all data is written."""
+        contents = os.urandom(64)
+        in_file = tmp_path / "in.bin"
+        in_file.write_bytes(contents)
+        out_file = tmp_path / "out.bin"
+
+        class ShortWriter:  # pylint: disable=too-few-public-methods
+            """Only ever writes a few bytes at a time."""
+
+            def __init__(self, file):
+                self.file = file
+
+            def write(self, data):
+                """Write up to 5 bytes."""
+                return self.file.write(data[:5])
+
+        # pylint: disable=protected-access
+        stream_copy = CopyEngine._stream_copy
+        monkeypatch.setattr(
+            CopyEngine,
+            "_stream_copy",
+            lambda self, src, dst, hasher=None: stream_copy(
+                self, src, ShortWriter(dst), hasher
+            ),
+        )
+        CopyEngine(block_size=16, zero_copy=False)(in_file, out_file)
+        assert out_file.read_bytes() == contents
+
+    def test_hasher(self, tmp_path, monkeypatch):
+        """Test that the data is given to the hasher as it is copied."""
+        contents = os.urandom(10 * 7 + 3)
+        in_file = tmp_path / "in.bin"
+        in_file.write_bytes(contents)
+        out_file = tmp_path / "out.bin"
+        monkeypatch.setattr(
+            copy_engine.fcntl, "ioctl", lambda *_args: pytest.fail("Cloned")
+        )
+        monkeypatch.setattr(copy_engine, "KERNEL_COPY_METHODS", (unsupported,))
+        hasher = MultiHasher()
+        copied = CopyEngine(block_size=7)(in_file, out_file, hasher)
+        assert copied == len(contents)
+        assert out_file.read_bytes() == contents
+        assert hasher.size == len(contents)
+        assert hasher.hexdigests() == hash_file(in_file).hexdigests()
+
+    def test_sync(self, tmp_path, monkeypatch):
+        """Test the output file is flushed only when asked to."""
+        in_file = tmp_path / "in.bin"
+        in_file.write_bytes(os.urandom(100))
+        out_file = tmp_path / "out.bin"
+        fsynced = record_fsyncs(monkeypatch)
+        CopyEngine()(in_file, out_file)
+        assert not fsynced
+        CopyEngine()(in_file, out_file, sync=True)
+        assert fsynced == [get_inode(out_file)]
+        assert out_file.read_bytes() == in_file.read_bytes()
+
+
+class TestKernelCopy:
+    """Tests copying files without the data passing through the process."""
+
+    @pytest.fixture(name="in_file")
+    def make_in_file(self, tmp_path):
+        """Creates a file to copy."""
+        in_file = tmp_path / "in.bin"
+        in_file.write_bytes(os.urandom(4096 + 17))
+        yield in_file
+
+    def test_zero_copy(self, tmp_path, in_file, monkeypatch):
+        """Test that no data is copied through the process."""
+        monkeypatch.setattr(
+            CopyEngine, "_stream_copy", lambda *_args: pytest.fail("Used a buffer")
+        )
+        out_file = tmp_path / "out.bin"
+        copied = CopyEngine()(in_file, out_file)
+        assert copied == in_file.stat().st_size
+        assert out_file.read_bytes() == in_file.read_bytes()
+
+    def test_all_methods(self, tmp_path, in_file):
+        """Test each available kernel copy method on its own."""
+        for index, method in enumerate(copy_engine.KERNEL_COPY_METHODS):
+            out_file = tmp_path / f"out{index}.bin"
+            with in_file.open("rb") as src, out_file.open("wb") as dst:
+                count = method(src.fileno(), dst.fileno(), len(in_file.read_bytes()))
+            assert count == in_file.stat().st_size
+            assert out_file.read_bytes() == in_file.read_bytes()
+
+    def test_fallback_to_next_method(self, tmp_path, in_file, monkeypatch):
+        """Test an unsupported method hands off to the next one."""
+        calls = []
+
+        def small_copy(src_fd, dst_fd, _count):
+            calls.append(1)
+            if len(calls) > 2:
+                unsupported()
+            return os.write(dst_fd, os.read(src_fd, 1000))
+
+        monkeypatch.setattr(
+            copy_engine,
+            "KERNEL_COPY_METHODS",
+            (small_copy, copy_engine.KERNEL_COPY_METHODS[-1]),
+        )
+        out_file = tmp_path / "out.bin"
+        copied = CopyEngine()(in_file, out_file)
+        assert len(calls) == 3
+        assert copied == in_file.stat().st_size
+        assert out_file.read_bytes() == in_file.read_bytes()
+
+    def test_fallback_to_stream(self, tmp_path, in_file, monkeypatch):
+        """Test the buffered copy is used when no kernel method is supported."""
+        monkeypatch.setattr(copy_engine, "KERNEL_COPY_METHODS", (unsupported,) * 2)
+        out_file = tmp_path / "out.bin"
+        copied = CopyEngine(block_size=100)(in_file, out_file)
+        assert copied == in_file.stat().st_size
+        assert out_file.read_bytes() == in_file.read_bytes()
+
+    def test_error(self, tmp_path, in_file, monkeypatch):
+        """Test that errors other than unsupported operations are raised."""
+
+        def no_space(*_args):
+            raise OSError(errno.ENOSPC, "No space left on device")
+
+        monkeypatch.setattr(copy_engine, "KERNEL_COPY_METHODS", (no_space,))
+        with pytest.raises(OSError) as ex:
+            CopyEngine()(in_file, tmp_path / "out.bin")
+        assert ex.value.errno == errno.ENOSPC
+
+
+@pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="fallocate is not available"
+)
+class TestPreallocate:
+    """Tests allocating the output file's space before copying."""
+
+    @pytest.fixture(name="in_file")
+    def make_in_file(self, tmp_path):
+        """Creates a file to copy."""
+        in_file = tmp_path / "in.bin"
+        in_file.write_bytes(os.urandom(4096 * 3 + 5))
+        yield in_file
+
+    @pytest.fixture(name="allocations")
+    def record_allocations(self, monkeypatch):
+        """Records the (offset, length) of every allocation."""
+        allocations = []
+        fallocate = copy_engine.fallocate
+
+        def record_fallocate(file_descriptor, mode, offset, length):
+            assert mode == copy_engine.FALLOC_FL_KEEP_SIZE
+            allocations.append((offset, length))
+            fallocate(file_descriptor, mode, offset, length)
+
+        monkeypatch.setattr(copy_engine, "fallocate", record_fallocate)
+        yield allocations
+
+    @pytest.mark.parametrize("zero_copy", [True, False])
+    def test_preallocated(self, tmp_path, in_file, allocations, zero_copy):
+        """Test the whole file is allocated before it is copied."""
+        out_file = tmp_path / "out.bin"
+        engine = CopyEngine(block_size=1000, zero_copy=zero_copy, reflink=False)
+        copied = engine(in_file, out_file)
+        assert allocations == [(0, in_file.stat().st_size)]
+        assert copied == in_file.stat().st_size
+        assert out_file.read_bytes() == in_file.read_bytes()
+
+    def test_size_kept(self, tmp_path, in_file, monkeypatch):
+        """Test the space is allocated without growing the file, which some file
+        systems do by writing zeros to it."""
+        sizes = []
+
+        def record_size(_self, _src, dst, *_args):
+            stat = os.fstat(dst.fileno())
+            sizes.append((stat.st_size, stat.st_blocks * 512))
+            return 0
+
+        monkeypatch.setattr(CopyEngine, "_stream_copy", record_size)
+        monkeypatch.setattr(copy_engine, "KERNEL_COPY_METHODS", ())
+        CopyEngine(reflink=False)(in_file, tmp_path / "out.bin")
+        assert len(sizes) == 1
+        size, allocated = sizes[0]
+        assert size == 0
+        assert allocated >= in_file.stat().st_size
+
+    def test_hasher(self, tmp_path, in_file, allocations):
+        """Test the file is allocated when it is hashed while it is copied."""
+        out_file = tmp_path / "out.bin"
+        CopyEngine()(in_file, out_file, MultiHasher())
+        assert allocations == [(0, in_file.stat().st_size)]
+        assert out_file.read_bytes() == in_file.read_bytes()
+
+    def test_empty_file(self, tmp_path, allocations):
+        """Test nothing is allocated for an empty file."""
+        in_file = tmp_path / "in.bin"
+        in_file.touch()
+        CopyEngine(reflink=False)(in_file, tmp_path / "out.bin")
+        assert not allocations
+
+    def test_disabled(self, tmp_path, in_file, allocations):
+        """Test preallocation can be turned off."""
+        CopyEngine(reflink=False, preallocate=False)(in_file, tmp_path / "out.bin")
+        assert not allocations
+
+    def test_unsupported(self, tmp_path, in_file, monkeypatch):
+        """Test the file is copied when the file system can not allocate ahead."""
+        monkeypatch.setattr(copy_engine, "fallocate", unsupported)
+        out_file = tmp_path / "out.bin"
+        CopyEngine(reflink=False)(in_file, out_file)
+        assert out_file.read_bytes() == in_file.read_bytes()
+
+    def test_no_space(self, tmp_path, in_file, monkeypatch):
+        """Test running out of space fails before any data is copied."""
+
+        def no_space(*_args):
+            raise OSError(errno.ENOSPC, "No space left on device")
+
+        monkeypatch.setattr(copy_engine, "fallocate", no_space)
+        monkeypatch.setattr(copy_engine, "KERNEL_COPY_METHODS", ())
+        monkeypatch.setattr(
+            CopyEngine, "_stream_copy", lambda *_args: pytest.fail("Copied data")
+        )
+        with pytest.raises(OSError) as ex:
+            CopyEngine(reflink=False)(in_file, tmp_path / "out.bin")
+        assert ex.value.errno == errno.ENOSPC
+
+    def test_fallocate_error(self, tmp_path):
+        """Test fallocate raises the error of the system call."""
+        out_file = tmp_path / "out.bin"
+        out_file.touch()
+        with open(out_file, "rb") as dst:
+            with pytest.raises(OSError) as ex:
+                copy_engine.fallocate(dst.fileno(), 0, 0, 4096)
+        assert ex.value.errno == errno.EBADF
+
+    def test_input_shrank(self, tmp_path, in_file, monkeypatch):
+        """Test the space allocated past the data copied is freed if the input file
+        was shorter than the space allocated."""
+
+        def preallocate(_src, dst):
+            copy_engine.fallocate(
+                dst.fileno(), copy_engine.FALLOC_FL_KEEP_SIZE, 0, 1024 * 1024
+            )
+            return 1024 * 1024
+
+        monkeypatch.setattr(CopyEngine, "_preallocate", staticmethod(preallocate))
+        out_file = tmp_path / "out.bin"
+        CopyEngine(reflink=False)(in_file, out_file)
+        assert out_file.read_bytes() == in_file.read_bytes()
+        assert out_file.stat().st_blocks * 512 < 1024 * 1024
+
+
+@pytest.mark.skipif(
+    not hasattr(os, "posix_fadvise"), reason="posix_fadvise is not available"
+)
+class TestBulk:
+    """Tests keeping bulk copies out of the page cache."""
+
+    @pytest.fixture(name="in_file")
+    def make_in_file(self, tmp_path):
+        """Creates a file to copy."""
+        in_file = tmp_path / "in.bin"
+        in_file.write_bytes(os.urandom(4096 * 10 + 5))
+        yield in_file
+
+    @pytest.fixture(name="advice")
+    def record_advice(self, monkeypatch):
+        """Records the (offset, length, advice) of every call to posix_fadvise."""
+        advice = []
+        posix_fadvise = os.posix_fadvise
+
+        def record_posix_fadvise(file_descriptor, offset, length, value):
+            advice.append((offset, length, value))
+            posix_fadvise(file_descriptor, offset, length, value)
+
+        monkeypatch.setattr(os, "posix_fadvise", record_posix_fadvise)
+        monkeypatch.setattr(copy_engine, "BULK_WINDOW_SIZE", 4096 * 4)
+        yield advice
+
+    @pytest.mark.parametrize("zero_copy", [True, False])
+    def test_bulk(self, tmp_path, in_file, advice, zero_copy):
+        """Test the input is read sequentially and the copied data is dropped from
+        the cache after each window and at the end."""
+        out_file = tmp_path / "out.bin"
+        engine = CopyEngine(
+            block_size=4096, zero_copy=zero_copy, reflink=False, bulk=True
+        )
+        copied = engine(in_file, out_file)
+        assert copied == in_file.stat().st_size
+        assert out_file.read_bytes() == in_file.read_bytes()
+        assert advice[0] == (0, 0, os.POSIX_FADV_SEQUENTIAL)
+        # Each window is dropped from both files, and then the whole of both files.
+        dropped = [length for _, length, _ in advice[1:]]
+        assert dropped[:4] == [4096 * 4] * 2 + [4096 * 8] * 2
+        assert dropped[-2:] == [0, 0]
+        assert all(value == os.POSIX_FADV_DONTNEED for _, _, value in advice[1:])
+
+    def test_hasher(self, tmp_path, in_file, advice):
+        """Test the copied data is dropped when it is hashed while it is copied."""
+        out_file = tmp_path / "out.bin"
+        hasher = MultiHasher()
+        CopyEngine(bulk=True)(in_file, out_file, hasher)
+        assert hasher.hexdigests() == hash_file(in_file).hexdigests()
+        assert advice[-1] == (0, 0, os.POSIX_FADV_DONTNEED)
+
+    def test_not_bulk(self, tmp_path, in_file, advice):
+        """Test the kernel is given no advice by default."""
+        CopyEngine(reflink=False)(in_file, tmp_path / "out.bin")
+        assert not advice
+
+
+@pytest.mark.skipif(not hasattr(os, "O_DIRECT"), reason="O_DIRECT is not available")
+class TestDirect:
+    """Tests copying with O_DIRECT. Where the file system of the temporary directory
+    does not support it the files are opened without it, and the same results are
+    expected."""
+
+    def test_block_size_aligned(self):
+        """Test the block size is rounded up to whole aligned blocks."""
+        engine = CopyEngine(block_size=1000, direct=True)
+        assert engine.block_size == copy_engine.DIRECT_ALIGNMENT
+        assert engine.bulk == hasattr(os, "posix_fadvise")
+
+    @pytest.mark.parametrize("size", [0, 1, 4096, 4096 * 3 + 5])
+    def test_sizes(self, tmp_path, size):
+        """Test files that are and are not a whole number of aligned blocks."""
+        contents = os.urandom(size)
+        in_file = tmp_path / "in.bin"
+        in_file.write_bytes(contents)
+        out_file = tmp_path / "out.bin"
+        out_file.write_bytes(bytes(size + 10000))
+        copied = CopyEngine(block_size=4096, reflink=False, direct=True)(
+            in_file, out_file
+        )
+        assert copied == size
+        assert out_file.read_bytes() == contents
+
+    def test_hasher(self, tmp_path):
+        """Test hashing the data while it is copied."""
+        in_file = tmp_path / "in.bin"
+        in_file.write_bytes(os.urandom(4096 * 2 + 5))
+        out_file = tmp_path / "out.bin"
+        hasher = MultiHasher()
+        CopyEngine(direct=True)(in_file, out_file, hasher)
+        assert hasher.hexdigests() == hash_file(in_file).hexdigests()
+        assert hasher.size == in_file.stat().st_size
+        assert out_file.read_bytes() == in_file.read_bytes()
+
+    def test_unsupported(self, tmp_path, monkeypatch):
+        """Test files are opened without O_DIRECT when their file system rejects
+        it."""
+        os_open = os.open
+
+        def no_direct(path, flags, *args):
+            if flags & os.O_DIRECT:
+                raise OSError(errno.EINVAL, "Invalid argument")
+            return os_open(path, flags, *args)
+
+        monkeypatch.setattr(os, "open", no_direct)
+        contents = os.urandom(4096 + 5)
+        in_file = tmp_path / "in.bin"
+        in_file.write_bytes(contents)
+        out_file = tmp_path / "out.bin"
+        CopyEngine(reflink=False, direct=True)(in_file, out_file)
+        assert out_file.read_bytes() == contents
+
+    def test_open_error(self, tmp_path):
+        """Test errors other than O_DIRECT being unsupported are raised."""
+        with pytest.raises(FileNotFoundError):
+            CopyEngine(direct=True)(tmp_path / "missing.bin", tmp_path / "out.bin")
+
+
+class TestPipeline:
+    """Tests copying with a reader and a writer thread."""
+
+    @pytest.fixture(name="in_file")
+    def make_in_file(self, tmp_path):
+        """Creates a file of several blocks."""
+        in_file = tmp_path / "in.bin"
+        in_file.write_bytes(os.urandom(4096 * 10 + 5))
+        yield in_file
+
+    def test_invalid_buffer_count(self):
+        """Test that a ring of less than two buffers is rejected."""
+        with pytest.raises(ValueError) as ex:
+            PipelineCopyEngine(buffer_count=1)
+        assert "buffer_count must be at least 2" in str(ex.value)
+
+    @pytest.mark.parametrize("buffer_count", [2, 3, 20])
+    def test_copy(self, tmp_path, in_file, buffer_count):
+        """Test copying a file that is not a multiple of the block size, with more
+        and fewer buffers than blocks."""
+        out_file = tmp_path / "out.bin"
+        engine = PipelineCopyEngine(
+            buffer_count, block_size=4096, zero_copy=False, reflink=False
+        )
+        copied = engine(in_file, out_file)
+        assert copied == in_file.stat().st_size
+        assert out_file.read_bytes() == in_file.read_bytes()
+
+    def test_empty_file(self, tmp_path):
+        """Test copying a file with no contents."""
+        in_file = tmp_path / "in.bin"
+        in_file.touch()
+        out_file = tmp_path / "out.bin"
+        assert PipelineCopyEngine(zero_copy=False)(in_file, out_file) == 0
+        assert out_file.read_bytes() == b""
+
+    def test_hasher(self, tmp_path, in_file):
+        """Test hashing the data while it is copied."""
+        out_file = tmp_path / "out.bin"
+        hasher = MultiHasher()
+        PipelineCopyEngine(block_size=4096)(in_file, out_file, hasher)
+        assert hasher.hexdigests() == hash_file(in_file).hexdigests()
+        assert out_file.read_bytes() == in_file.read_bytes()
+
+    @pytest.mark.skipif(not hasattr(os, "O_DIRECT"), reason="O_DIRECT is not available")
+    def test_direct(self, tmp_path, in_file):
+        """Test padding the last block when copying with O_DIRECT."""
+        out_file = tmp_path / "out.bin"
+        engine = PipelineCopyEngine(block_size=4096, reflink=False, direct=True)
+        assert engine(in_file, out_file) == in_file.stat().st_size
+        assert out_file.read_bytes() == in_file.read_bytes()
+
+    @pytest.mark.skipif(
+        not hasattr(os, "posix_fadvise"), reason="posix_fadvise is not available"
+    )
+    def test_bulk(self, tmp_path, in_file, monkeypatch):
+        """Test the data written so far is dropped from the cache after each
+        window."""
+        dropped = []
+        posix_fadvise = os.posix_fadvise
+
+        def record_posix_fadvise(file_descriptor, offset, length, value):
+            if value == os.POSIX_FADV_DONTNEED:
+                dropped.append(length)
+            posix_fadvise(file_descriptor, offset, length, value)
+
+        monkeypatch.setattr(os, "posix_fadvise", record_posix_fadvise)
+        monkeypatch.setattr(copy_engine, "BULK_WINDOW_SIZE", 4096 * 4)
+        out_file = tmp_path / "out.bin"
+        engine = PipelineCopyEngine(
+            block_size=4096, zero_copy=False, reflink=False, bulk=True
+        )
+        engine(in_file, out_file)
+        assert out_file.read_bytes() == in_file.read_bytes()
+        assert dropped == [4096 * 4] * 2 + [4096 * 8] * 2 + [0] * 2
+
+    def test_same_device(self, tmp_path, in_file, monkeypatch):
+        """Test files on the same device are copied inside the kernel."""
+        calls = []
+
+        def kernel_copy(src_fd, dst_fd, count):
+            calls.append(count)
+            return os.sendfile(dst_fd, src_fd, None, count)
+
+        monkeypatch.setattr(copy_engine, "KERNEL_COPY_METHODS", (kernel_copy,))
+        out_file = tmp_path / "out.bin"
+        PipelineCopyEngine(reflink=False)(in_file, out_file)
+        assert calls
+        assert out_file.read_bytes() == in_file.read_bytes()
+
+    def test_other_device(self, tmp_path, in_file, monkeypatch):
+        """Test files on different devices are copied by the threads."""
+        fstat = os.fstat
+        devices = iter(range(1000))
+
+        def other_device(file_descriptor):
+            stat = list(fstat(file_descriptor))
+            stat[2] = next(devices)
+            return os.stat_result(stat)
+
+        monkeypatch.setattr(os, "fstat", other_device)
+        monkeypatch.setattr(
+            copy_engine, "KERNEL_COPY_METHODS", (lambda *_args: pytest.fail(),)
+        )
+        out_file = tmp_path / "out.bin"
+        copied = PipelineCopyEngine(block_size=4096, reflink=False)(in_file, out_file)
+        assert copied == len(in_file.read_bytes())
+        assert out_file.read_bytes() == in_file.read_bytes()
+
+    def test_read_error(self):
+        """Test an error on the reader thread is raised by the copy."""
+        # pylint: disable=protected-access
+
+        class FailingReader(io.RawIOBase):
+            """Returns one block and then fails."""
+
+            def __init__(self):
+                super().__init__()
+                self.reads = 0
+
+            def readinto(self, buffer):
+                self.reads += 1
+                if self.reads > 1:
+                    raise OSError(errno.EIO, "Input/output error")
+                buffer[:3] = b"abc"
+                return 3
+
+        dst = io.BytesIO()
+        engine = PipelineCopyEngine(block_size=16)
+        with pytest.raises(OSError) as ex:
+            engine._stream_copy(FailingReader(), dst)
+        assert ex.value.errno == errno.EIO
+        assert dst.getvalue() == b"abc"
+
+    def test_write_error(self, in_file):
+        """Test the reader thread stops when writing fails."""
+        # pylint: disable=protected-access
+
+        class FailingWriter(io.RawIOBase):
+            """Fails every write."""
+
+            def write(self, _data):
+                raise OSError(errno.ENOSPC, "No space left on device")
+
+        threads = threading.active_count()
+        engine = PipelineCopyEngine(block_size=4096)
+        with open(in_file, "rb", buffering=0) as src:
+            with pytest.raises(OSError) as ex:
+                engine._stream_copy(src, FailingWriter())
+        assert ex.value.errno == errno.ENOSPC
+        assert threading.active_count() == threads
+
+
+class TestReflink:
+    """Tests cloning files on copy-on-write file systems."""
+
+    @pytest.fixture(name="in_file")
+    def make_in_file(self, tmp_path):
+        """Creates a file to clone."""
+        in_file = tmp_path / "in.bin"
+        in_file.write_bytes(os.urandom(4096 * 3))
+        yield in_file
+
+    def test_clone_or_fallback(self, tmp_path, in_file):
+        """Test that the file system in use either clones or copies the file."""
+        out_file = tmp_path / "out.bin"
+        copied = CopyEngine()(in_file, out_file)
+        assert copied == in_file.stat().st_size
+        assert out_file.read_bytes() == in_file.read_bytes()
+
+    def test_cloned(self, tmp_path, in_file, monkeypatch):
+        """Test that no copy is made when cloning succeeds."""
+        calls = []
+
+        def ioctl(dst_fd, request, src_fd):
+            calls.append(request)
+            os.write(dst_fd, os.pread(src_fd, in_file.stat().st_size, 0))
+
+        monkeypatch.setattr(copy_engine.fcntl, "ioctl", ioctl)
+        monkeypatch.setattr(copy_engine, "KERNEL_COPY_METHODS", ())
+        monkeypatch.setattr(
+            CopyEngine, "_stream_copy", lambda *_args: pytest.fail("Copied data")
+        )
+        monkeypatch.setattr(
+            copy_engine, "fallocate", lambda *_args: pytest.fail("Preallocated")
+        )
+        copied = CopyEngine()(in_file, tmp_path / "out.bin")
+        assert calls == [copy_engine.FICLONE]
+        assert copied == in_file.stat().st_size
+
+    def test_unsupported_is_remembered(self, tmp_path, in_file, monkeypatch):
+        """Test cloning is only attempted once per pair of file systems."""
+        calls = []
+
+        def ioctl(*_args):
+            calls.append(1)
+            raise OSError(errno.ENOTTY, "Inappropriate ioctl for device")
+
+        monkeypatch.setattr(copy_engine.fcntl, "ioctl", ioctl)
+        engine = CopyEngine()
+        engine(in_file, tmp_path / "out1.bin")
+        engine(in_file, tmp_path / "out2.bin")
+        assert len(calls) == 1
+        assert (tmp_path / "out2.bin").read_bytes() == in_file.read_bytes()
+
+    def test_disabled(self, tmp_path, in_file, monkeypatch):
+        """Test cloning is not attempted when it is turned off."""
+        monkeypatch.setattr(
+            copy_engine.fcntl, "ioctl", lambda *_args: pytest.fail("Cloned")
+        )
+        out_file = tmp_path / "out.bin"
+        CopyEngine(reflink=False)(in_file, out_file)
+        assert out_file.read_bytes() == in_file.read_bytes()
+
+    def test_error(self, tmp_path, in_file, monkeypatch):
+        """Test that errors other than unsupported operations are raised."""
+
+        def ioctl(*_args):
+            raise OSError(errno.EIO, "Input/output error")
+
+        monkeypatch.setattr(copy_engine.fcntl, "ioctl", ioctl)
+        with pytest.raises(OSError) as ex:
+            CopyEngine()(in_file, tmp_path / "out.bin")
+        assert ex.value.errno == errno.EIO
+
+    def test_supports_reflink(self, tmp_path, monkeypatch):
+        """Test probing a directory for clone support."""
+        calls = []
+        monkeypatch.setattr(
+            copy_engine.fcntl, "ioctl", lambda *args: calls.append(args[1])
+        )
+        assert supports_reflink(tmp_path)
+        assert calls == [copy_engine.FICLONE]
+        assert not list(tmp_path.iterdir())
+
+    def test_supports_reflink_unsupported(self, tmp_path, monkeypatch):
+        """Test a file system that can not clone files."""
+
+        def ioctl(*_args):
+            raise OSError(errno.EOPNOTSUPP, "Operation not supported")
+
+        monkeypatch.setattr(copy_engine.fcntl, "ioctl", ioctl)
+        assert not supports_reflink(tmp_path)
+
+    def test_supports_reflink_error(self, tmp_path, monkeypatch):
+        """Test that errors other than unsupported operations are raised."""
+
+        def ioctl(*_args):
+            raise OSError(errno.EIO, "Input/output error")
+
+        monkeypatch.setattr(copy_engine.fcntl, "ioctl", ioctl)
+        with pytest.raises(OSError):
+            supports_reflink(tmp_path)
@@ -0,0 +1,73 @@
+"""Tests for dedup.py"""
+
+from gdipak import dedup
+from gdipak.dedup import Duplicate, find_duplicates
+from gdipak.file_utils import GameDir
+from tests.testing_utils import make_files
+
+
+def make_game(tmp_path, name, track_contents):
+    """Creates a game whose tracks have the given contents."""
+    game_dir, _, _ = make_files(tmp_path, name)
+    tracks = sorted(game_dir.glob("*(track*"))
+    for track, contents in zip(tracks, track_contents):
+        track.write_bytes(contents)
+    return GameDir(game_dir, sorted(game_dir.iterdir()))
+
+
+class TestFindDuplicates:
+    """Tests finding games that are copies of each other."""
+
+    def test_duplicates(self, tmp_path):
+        """Test copies under different names are found and the first is kept."""
+        contents = [b"one", b"two", b"three"]
+        game_a = make_game(tmp_path, "Game A", contents)
+        game_b = make_game(tmp_path, "Game B", [b"one", b"two", b"four!"])
+        game_c = make_game(tmp_path, "Game A (copy)", contents)
+        game_d = make_game(tmp_path, "Game A (another copy)", contents)
+        unique, duplicates = find_duplicates([game_a, game_b, game_c, game_d])
+        assert unique == [game_a, game_b]
+        assert duplicates == [Duplicate(game_c, game_a), Duplicate(game_d, game_a)]
+        assert str(duplicates[0]) == f"{game_c.path} is a duplicate of {game_a.path}"
+
+    def test_files_not_known(self, tmp_path):
+        """Test games whose directories have not been searched yet."""
+        game_a = make_game(tmp_path, "Game A", [b"one", b"two", b"three"])
+        game_b = make_game(tmp_path, "Game B", [b"one", b"two", b"three"])
+        unique, duplicates = find_duplicates(
+            [GameDir(game_a.path, None), GameDir(game_b.path, None)]
+        )
+        assert [game.path for game in unique] == [game_a.path]
+        assert sorted(unique[0].files) == game_a.files
+        assert [duplicate.game.path for duplicate in duplicates] == [game_b.path]
+
+    def test_no_tracks(self, tmp_path):
+        """Test games without tracks are never duplicates."""
+        games = []
+        for name in ("Game A", "Game B"):
+            game = make_game(tmp_path, name, [])
+            games.append(GameDir(game.path, list(game.path.glob("*.gdi"))))
+        assert find_duplicates(games) == (games, [])
+
+    def test_staged_hashing(self, tmp_path, monkeypatch):
+        """Test tracks are only read in full when everything else matches."""
+        monkeypatch.setattr(dedup, "PARTIAL_HASH_SIZE", 4)
+        hashed = []
+        hash_file = dedup.hash_file
+
+        def record_hash_file(file, hasher):
+            hashed.append(file.parent.name)
+            return hash_file(file, hasher)
+
+        monkeypatch.setattr(dedup, "hash_file", record_hash_file)
+        game_a = make_game(tmp_path, "Game A", [b"one", b"two", b"start end"])
+        # Different sizes.
+        game_b = make_game(tmp_path, "Game B", [b"one", b"two", b"three"])
+        # Different starts.
+        game_c = make_game(tmp_path, "Game C", [b"one", b"two", b"other end"])
+        # Different ends.
+        game_d = make_game(tmp_path, "Game D", [b"one", b"two", b"start END"])
+        unique, duplicates = find_duplicates([game_a, game_b, game_c, game_d])
+        assert unique == [game_a, game_b, game_c, game_d]
+        assert not duplicates
+        assert sorted(set(hashed)) == ["Game A", "Game D"]
@@ -1,13 +1,23 @@
 """Tests for utils.py"""
 
 from collections import namedtuple
+import contextlib
+import errno
+import os
 from pathlib import Path
 import pytest
 
 from gdipak.arg_parser import RecursiveMode
 from gdipak import file_utils
+from gdipak.checksums import MultiHasher, hash_file
+from gdipak.copy_engine import CopyEngine
 
-from tests.testing_utils import create_dirs_in_dir
+from tests.testing_utils import (
+    create_dirs_in_dir,
+    get_inode,
+    make_files,
+    record_fsyncs,
+)
 
 
 class TestWriteFile:
@@ -41,6 +51,31 @@ class TestWriteFile:
         assert in_file_path.exists()
         assert in_file_path.samefile(out_file_path)
 
+    def test_same_file_relative_path(self, tmp_path, monkeypatch):
+        """Tests the same file given as a relative and as an absolute path is left
+        as it is."""
+        io_dir = tmp_path / "game"
+        io_dir.mkdir()
+        in_file_path = io_dir / "track01.bin"
+        contents = b"This is the contents of the file"
+        in_file_path.write_bytes(contents)
+        monkeypatch.chdir(tmp_path)
+
+        hasher = MultiHasher()
+        file_utils.write_file(in_file_path, Path("game/track01.bin"), hasher=hasher)
+        assert in_file_path.read_bytes() == contents
+        assert hasher.size == len(contents)
+
+    def test_is_same_file(self, tmp_path, monkeypatch):
+        """Tests comparing paths to files."""
+        in_file_path = tmp_path / "track01.bin"
+        in_file_path.write_bytes(b"contents")
+        (tmp_path / "other.bin").write_bytes(b"contents")
+        monkeypatch.chdir(tmp_path)
+        assert file_utils.is_same_file(in_file_path, "track01.bin")
+        assert not file_utils.is_same_file(in_file_path, "other.bin")
+        assert not file_utils.is_same_file(in_file_path, "missing.bin")
+
     def test_same_directory(self, tmp_path):
         """Tests reading and writing from the same directory."""
         io_dir = tmp_path / "Game!"
@@ -83,6 +118,35 @@ class TestWriteFile:
         assert in_file_path.exists()
         assert in_file_path.read_bytes() == out_file_path.read_bytes()
 
+    def test_custom_engine(self, tmp_path):
+        """Test writing with a copy engine that uses a small block size."""
+        in_file_path = tmp_path / "Game! (Track 1).bin"
+        contents = bytes(range(256)) * 4
+        in_file_path.write_bytes(contents)
+
+        out_file_path = tmp_path / "outputdir" / "track01.bin"
+        file_utils.write_file(in_file_path, out_file_path, CopyEngine(block_size=3))
+        assert out_file_path.read_bytes() == contents
+
+    def test_hasher(self, tmp_path):
+        """Test the contents are hashed when copied and when there is no copy."""
+        in_file_path = tmp_path / "Game! (Track 1).bin"
+        in_file_path.write_bytes(b"This is the contents of the file")
+        expected = hash_file(in_file_path).hexdigests()
+        for out_file_path in (tmp_path / "outputdir" / "track01.bin", in_file_path):
+            hasher = MultiHasher()
+            file_utils.write_file(in_file_path, out_file_path, hasher=hasher)
+            assert hasher.hexdigests() == expected
+
+    def test_sync(self, tmp_path, monkeypatch):
+        """Test the file and its directory are flushed."""
+        in_file_path = tmp_path / "Game! (Track 1).bin"
+        in_file_path.write_bytes(b"This is the contents of the file")
+        out_file_path = tmp_path / "outputdir" / "track01.bin"
+        fsynced = record_fsyncs(monkeypatch)
+        file_utils.write_file(in_file_path, out_file_path, sync=True)
+        assert fsynced == [get_inode(out_file_path), get_inode(out_file_path.parent)]
+
 
 class TestGetSubdirsInDir:
     """Test getting the sub directories in a directory."""
@@ -140,6 +204,393 @@ class TestGetSubdirsInDir:
         for out_dir, subdir in zip(sorted(dirs), sorted(subdirs[:4])):
             assert out_dir.samefile(subdir)
 
+    def test_order(self, tmp_path):
+        """Test directories come before their subdirectories and siblings are sorted
+        by name."""
+        base = tmp_path / "basedir"
+        for subdir in ("b", "a/y", "a/x/deep", "c"):
+            (base / subdir).mkdir(parents=True)
+        dirs = file_utils.get_subdirs_in_dir(base)
+        assert dirs == [
+            base / "a",
+            base / "a" / "x",
+            base / "a" / "x" / "deep",
+            base / "a" / "y",
+            base / "b",
+            base / "c",
+        ]
+
+    def test_max_recursion_zero(self, tmp_path):
+        """Test only looking at the immediate subdirectories."""
+        base = tmp_path / "basedir"
+        (base / "a" / "b").mkdir(parents=True)
+        assert file_utils.get_subdirs_in_dir(base, 0) == [base / "a"]
+
+    def test_ignores_files(self, tmp_path):
+        """Test files are not treated as directories."""
+        base = tmp_path / "basedir"
+        (base / "a").mkdir(parents=True)
+        (base / "game.gdi").touch()
+        assert file_utils.get_subdirs_in_dir(base) == [base / "a"]
+
+    def test_symlink_loop(self, tmp_path):
+        """Test that a link to a parent directory does not cause an endless walk."""
+        base = tmp_path / "basedir"
+        (base / "a").mkdir(parents=True)
+        (base / "a" / "loop").symlink_to(base, target_is_directory=True)
+        (base / "a" / "self").symlink_to(base / "a", target_is_directory=True)
+        assert file_utils.get_subdirs_in_dir(base) == [base / "a"]
+
+    def test_symlink_to_other_tree(self, tmp_path):
+        """Test a linked directory outside of the tree is walked once."""
+        base = tmp_path / "basedir"
+        (base / "a").mkdir(parents=True)
+        other = tmp_path / "other"
+        (other / "game").mkdir(parents=True)
+        (base / "a" / "link1").symlink_to(other, target_is_directory=True)
+        (base / "a" / "link2").symlink_to(other, target_is_directory=True)
+        assert file_utils.get_subdirs_in_dir(base) == [
+            base / "a",
+            base / "a" / "link1",
+            base / "a" / "link1" / "game",
+        ]
+
+    def test_deep_tree(self, tmp_path):
+        """Test a deeply nested tree is walked completely."""
+        base = tmp_path / "basedir"
+        base.mkdir()
+        depth = 200
+        deepest = Path(*(["d"] * depth))
+        os.makedirs(base / deepest)
+        dirs = file_utils.iter_subdirs_in_dir(base)
+        assert sum(1 for _ in dirs) == depth
+
+
+class TestIterGameDirs:
+    """Tests finding the directories that contain a game."""
+
+    def test_games(self, tmp_path):
+        """Test finding games, including games nested in other games' directories."""
+        category = tmp_path / "category"
+        category.mkdir()
+        game1, names1, _ = make_files(category, "game1")
+        game2, names2, _ = make_files(game1, "game2")
+        games = list(file_utils.iter_game_dirs(tmp_path))
+        assert [game.path for game in games] == [game1, game2]
+        assert sorted(file.name for file in games[0].files) == sorted(names1)
+        assert sorted(file.name for file in games[1].files) == sorted(names2)
+        assert str(games[0]) == str(game1)
+
+    def test_no_games(self, tmp_path):
+        """Test directories without a gdi file are not games."""
+        (tmp_path / "category" / "empty").mkdir(parents=True)
+        (tmp_path / "category" / "track01.bin").touch()
+        assert not list(file_utils.iter_game_dirs(tmp_path))
+
+    def test_too_many_gdi_files(self, tmp_path):
+        """Test directories with more than one gdi file are skipped."""
+        game, _, _ = make_files(tmp_path, "game")
+        (game / "other.gdi").touch()
+        with pytest.warns(UserWarning) as record:
+            assert not list(file_utils.iter_game_dirs(tmp_path))
+        assert str(record[0].message) == (
+            f"Skipping {game}, it contains more than one gdi file"
+        )
+
+    def test_max_recursion(self, tmp_path):
+        """Test games past the recursion limit are not found, games at the limit
+        are."""
+        game1, _, _ = make_files(tmp_path, "game1")
+        game2, _, _ = make_files(game1, "game2")
+        make_files(game2, "game3")
+        games = list(file_utils.iter_game_dirs(tmp_path, 1))
+        assert [game.path for game in games] == [game1, game2]
+
+    def test_staging_dirs_ignored(self, tmp_path):
+        """Test games that are still being written are not found."""
+        game, _, _ = make_files(tmp_path, "game")
+        make_files(tmp_path, ".game" + file_utils.STAGING_DIR_SUFFIX)
+        games = list(file_utils.iter_game_dirs(tmp_path))
+        assert [found.path for found in games] == [game]
+
+    def test_exclude(self, tmp_path, monkeypatch):
+        """Test the excluded directory and the games in it are not found, however
+        its path is written."""
+        game, _, _ = make_files(tmp_path, "game")
+        out_dir = tmp_path / "out"
+        out_dir.mkdir()
+        make_files(out_dir, "packed")
+        # A directory with the same name elsewhere is still searched.
+        other, _, _ = make_files(game, "out")
+        monkeypatch.chdir(tmp_path)
+        games = list(file_utils.iter_game_dirs(tmp_path, exclude="out"))
+        assert [found.path for found in games] == [game, other]
+
+    def test_other_file_systems(self, tmp_path, monkeypatch):
+        """Test directories on different file systems with the same inode number
+        are all found."""
+        (tmp_path / "m1").mkdir()
+        (tmp_path / "m2").mkdir()
+        game1, _, _ = make_files(tmp_path / "m1", "game")
+        game2, _, _ = make_files(tmp_path / "m2", "game")
+        stat = os.stat
+
+        def mounted_stat(path, *args, **kwargs):
+            result = stat(path, *args, **kwargs)
+            path = Path(path)
+            if path.parent.name in ("m1", "m2"):
+                # The root directory of two mounted file systems.
+                fields = list(result)
+                fields[1] = 2
+                fields[2] = hash(path.parent.name)
+                return os.stat_result(fields)
+            return result
+
+        class MountedEntry:  # pylint: disable=too-few-public-methods
+            """A directory entry with the inode number of a mount's root."""
+
+            def __init__(self, entry):
+                self.entry = entry
+                # The inode number, as listed by the directory.
+                self.inode = lambda: mounted_stat(entry.path).st_ino
+
+            def __getattr__(self, name):
+                return getattr(self.entry, name)
+
+        scandir = os.scandir
+
+        @contextlib.contextmanager
+        def mounted_scandir(path):
+            with scandir(path) as entries:
+                yield [MountedEntry(entry) for entry in entries]
+
+        monkeypatch.setattr(os, "stat", mounted_stat)
+        monkeypatch.setattr(os, "scandir", mounted_scandir)
+        games = list(file_utils.iter_game_dirs(tmp_path))
+        assert [game.path for game in games] == [game1, game2]
+
+    def test_each_dir_listed_once(self, tmp_path, monkeypatch):
+        """Test no directory is listed more than once."""
+        game1, _, _ = make_files(tmp_path, "game1")
+        make_files(game1, "game2")
+        listed = []
+        scandir = os.scandir
+
+        def counting_scandir(path):
+            listed.append(str(path))
+            return scandir(path)
+
+        monkeypatch.setattr(os, "scandir", counting_scandir)
+        assert len(list(file_utils.iter_game_dirs(tmp_path))) == 2
+        assert len(listed) == len(set(listed)) == 3
+
+
+class TestStagingDir:
+    """Tests for the directory a game is written to before it is published."""
+
+    def test_get_staging_dir(self, tmp_path):
+        """Tests the staging directory is a hidden sibling of the output directory."""
+        staging_dir = file_utils.get_staging_dir(tmp_path / "out")
+        assert staging_dir == tmp_path / ".out.gdipak-staging"
+
+    def test_remove_staging_dir(self, tmp_path):
+        """Tests removing a staging directory and its files."""
+        out_dir = tmp_path / "out"
+        staging_dir = file_utils.get_staging_dir(out_dir)
+        staging_dir.mkdir()
+        (staging_dir / "track01.bin").touch()
+        assert file_utils.remove_staging_dir(out_dir)
+        assert not staging_dir.exists()
+        assert not file_utils.remove_staging_dir(out_dir)
+
+    def test_publish_new_dir(self, tmp_path):
+        """Tests a staging directory is renamed when the output directory does not
+        exist."""
+        out_dir = tmp_path / "out"
+        staging_dir = file_utils.get_staging_dir(out_dir)
+        staging_dir.mkdir()
+        (staging_dir / "disc.gdi").write_text("new")
+        inode = staging_dir.stat().st_ino
+        file_utils.publish_dir(staging_dir, out_dir)
+        assert out_dir.stat().st_ino == inode
+        assert (out_dir / "disc.gdi").read_text() == "new"
+        assert not staging_dir.exists()
+
+    def test_publish_existing_dir(self, tmp_path):
+        """Tests the staged files are moved into an existing output directory, which
+        is never moved itself, and the files they do not replace are kept."""
+        out_dir = tmp_path / "out"
+        out_dir.mkdir()
+        (out_dir / "disc.gdi").write_text("old")
+        (out_dir / "other.txt").write_text("other")
+        (out_dir / "02").mkdir()
+        staging_dir = file_utils.get_staging_dir(out_dir)
+        staging_dir.mkdir()
+        (staging_dir / "disc.gdi").write_text("new")
+        (staging_dir / "track01.bin").write_text("track")
+        # A hard link to the file it replaces.
+        os.link(out_dir / "other.txt", staging_dir / "other.txt")
+        inode = out_dir.stat().st_ino
+        file_utils.publish_dir(staging_dir, out_dir)
+        assert out_dir.stat().st_ino == inode
+        assert sorted(file.name for file in tmp_path.iterdir()) == ["out"]
+        assert sorted(file.name for file in out_dir.iterdir()) == [
+            "02",
+            "disc.gdi",
+            "other.txt",
+            "track01.bin",
+        ]
+        assert (out_dir / "disc.gdi").read_text() == "new"
+        assert (out_dir / "other.txt").read_text() == "other"
+
+    def test_publish_symlink(self, tmp_path):
+        """Tests a game published to a symbolic link is staged next to, and written
+        into, the directory it links to. The link is left as it was."""
+        target_dir = tmp_path / "card" / "sd"
+        target_dir.mkdir(parents=True)
+        (target_dir / "other.txt").write_text("other")
+        link = tmp_path / "link"
+        link.symlink_to(target_dir)
+        staging_dir = file_utils.get_staging_dir(link / "01")
+        assert staging_dir == target_dir / ".01.gdipak-staging"
+        staging_dir.mkdir()
+        (staging_dir / "disc.gdi").write_text("new")
+        file_utils.publish_dir(staging_dir, link / "01")
+        staging_dir = file_utils.get_staging_dir(link)
+        assert staging_dir == tmp_path / "card" / ".sd.gdipak-staging"
+        staging_dir.mkdir()
+        (staging_dir / "disc.gdi").write_text("new")
+        file_utils.publish_dir(staging_dir, link)
+        assert link.is_symlink()
+        assert sorted(file.name for file in tmp_path.iterdir()) == ["card", "link"]
+        assert sorted(file.name for file in target_dir.iterdir()) == [
+            "01",
+            "disc.gdi",
+            "other.txt",
+        ]
+        assert (target_dir / "01" / "disc.gdi").read_text() == "new"
+
+    def test_publish_working_dir(self, tmp_path, monkeypatch):
+        """Tests publishing to the working directory leaves it in place."""
+        out_dir = tmp_path / "out"
+        out_dir.mkdir()
+        monkeypatch.chdir(out_dir)
+        staging_dir = file_utils.get_staging_dir(".")
+        assert staging_dir == tmp_path / ".out.gdipak-staging"
+        staging_dir.mkdir()
+        (staging_dir / "disc.gdi").write_text("new")
+        file_utils.publish_dir(staging_dir, ".")
+        assert Path.cwd() == out_dir
+        assert (out_dir / "disc.gdi").read_text() == "new"
+        assert not staging_dir.exists()
+
+    @pytest.mark.parametrize("fixed", ["mount", "read_only_parent"])
+    def test_get_staging_dir_fixed(self, tmp_path, monkeypatch, fixed):
+        """Tests the staging directory is inside an output directory that is the
+        root of a mount or whose parent can not be written to."""
+        out_dir = tmp_path / "out"
+        out_dir.mkdir()
+        if fixed == "mount":
+            monkeypatch.setattr(os.path, "ismount", lambda path: path == out_dir)
+        else:
+            monkeypatch.setattr(os, "access", lambda path, _mode: path != tmp_path)
+        staging_dir = file_utils.get_staging_dir(out_dir)
+        assert staging_dir == out_dir / file_utils.STAGING_DIR_SUFFIX
+
+    def test_publish_mount(self, tmp_path, monkeypatch):
+        """Tests the files of a staging directory inside a mount point are moved
+        into it."""
+        out_dir = tmp_path / "out"
+        out_dir.mkdir()
+        (out_dir / "other.txt").write_text("other")
+        monkeypatch.setattr(os.path, "ismount", lambda path: path == out_dir)
+        staging_dir = file_utils.get_staging_dir(out_dir)
+        staging_dir.mkdir()
+        (staging_dir / "disc.gdi").write_text("new")
+        inode = out_dir.stat().st_ino
+        file_utils.publish_dir(staging_dir, out_dir)
+        assert out_dir.stat().st_ino == inode
+        assert sorted(file.name for file in out_dir.iterdir()) == [
+            "disc.gdi",
+            "other.txt",
+        ]
+
+    @pytest.mark.parametrize("error", [errno.EEXIST, errno.ENOTEMPTY])
+    def test_publish_created_meanwhile(self, tmp_path, monkeypatch, error):
+        """Tests the files are moved one by one when the output directory is created
+        while the staging directory is renamed to it."""
+        out_dir = tmp_path / "out"
+        staging_dir = file_utils.get_staging_dir(out_dir)
+        staging_dir.mkdir()
+        (staging_dir / "disc.gdi").write_text("new")
+
+        def created_rename(_self, _target):
+            out_dir.mkdir()
+            (out_dir / "other.txt").write_text("other")
+            raise OSError(error, os.strerror(error))
+
+        monkeypatch.setattr(Path, "rename", created_rename)
+        file_utils.publish_dir(staging_dir, out_dir)
+        assert sorted(file.name for file in tmp_path.iterdir()) == ["out"]
+        assert sorted(file.name for file in out_dir.iterdir()) == [
+            "disc.gdi",
+            "other.txt",
+        ]
+
+    def test_publish_other_file_system(self, tmp_path, monkeypatch):
+        """Tests the files are copied when they can not be moved."""
+        out_dir = tmp_path / "out"
+        out_dir.mkdir()
+        (out_dir / "disc.gdi").write_text("old")
+        staging_dir = file_utils.get_staging_dir(out_dir)
+        staging_dir.mkdir()
+        (staging_dir / "disc.gdi").write_text("new")
+        replace = Path.replace
+
+        def cross_device_replace(self, target):
+            if self.parent == staging_dir:
+                raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+            return replace(self, target)
+
+        monkeypatch.setattr(Path, "replace", cross_device_replace)
+        file_utils.publish_dir(staging_dir, out_dir)
+        assert sorted(file.name for file in tmp_path.iterdir()) == ["out"]
+        assert sorted(file.name for file in out_dir.iterdir()) == ["disc.gdi"]
+        assert (out_dir / "disc.gdi").read_text() == "new"
+
+    def test_publish_rename_error(self, tmp_path, monkeypatch):
+        """Tests other errors renaming the directories are raised, and the output
+        directory is left as it was."""
+        out_dir = tmp_path / "out"
+        staging_dir = file_utils.get_staging_dir(out_dir)
+        staging_dir.mkdir()
+
+        def denied(_self, _target):
+            raise OSError(errno.EACCES, "Permission denied")
+
+        monkeypatch.setattr(Path, "rename", denied)
+        with pytest.raises(OSError) as ex:
+            file_utils.publish_dir(staging_dir, out_dir)
+        assert ex.value.errno == errno.EACCES
+        assert not out_dir.exists()
+
+    def test_move_error(self, tmp_path, monkeypatch):
+        """Tests other errors moving the files one by one are raised."""
+        out_dir = tmp_path / "out"
+        out_dir.mkdir()
+        monkeypatch.setattr(os.path, "ismount", lambda path: path == out_dir)
+        staging_dir = file_utils.get_staging_dir(out_dir)
+        staging_dir.mkdir()
+        (staging_dir / "disc.gdi").write_text("new")
+
+        def denied(_self, _target):
+            raise OSError(errno.EACCES, "Permission denied")
+
+        monkeypatch.setattr(Path, "replace", denied)
+        with pytest.raises(OSError) as ex:
+            file_utils.publish_dir(staging_dir, out_dir)
+        assert ex.value.errno == errno.EACCES
+
 
 class TestGetGameFilesInDir:
     """Tests getting a list of all the files in the directory."""
@@ -367,6 +818,21 @@ class TestConvertFileName:
         )
         assert result == "track12.raw"
 
+    def test_convert_bytes(self):
+        """Tests converting file names read from a GDI file, which are not decoded."""
+        name = "ゲーム (Track 3).bin".encode("shift_jis")
+        result = file_utils.convert_file_name(name)
+        assert result == b"track03.bin"
+
+        result = file_utils.convert_file_name(b"dir/Caf\xe9 (Track 1).RAW")
+        assert result == b"track01.raw"
+
+        result = file_utils.convert_file_name(b"Caf\xe9.gdi")
+        assert result == b"disc.gdi"
+
+        with pytest.raises(ValueError):
+            file_utils.convert_file_name(b"Caf\xe9 (Track 1).cd\xe9")
+
     def test_bad_file_type(self):
         """Tests fails when given an invalid file type."""
         with pytest.raises(ValueError):
@@ -2,11 +2,10 @@
 from pathlib import Path
 from random import randint
 import string
-import textwrap
 import pytest
 
 from gdipak.gdi_converter import GdiConverter
-from tests.testing_utils import GdiGenerator
+from tests.testing_utils import GdiGenerator, get_inode, record_fsyncs
 
 
 @pytest.fixture(name="gdi_file")
@@ -32,7 +31,7 @@ class TestGdiConverter:
     def test_too_many_args(self):
         """Test passing both arguments during instantiation."""
         with pytest.raises(ValueError) as ex:
-            GdiConverter(file_path="/root", file_contents="~~missing~~")
+            GdiConverter(file_path="/root", file_contents=b"~~missing~~")
         assert "Only one of file_path or file_contents can be defined." in str(ex.value)
 
     def test_file_path_as_path(self, tmp_path):
@@ -47,13 +46,13 @@ class TestGdiConverter:
 
     def test_file_contents(self):
         """Test passing file_contents."""
-        contents = "We've been trying to reach you about your car's extended warranty."
+        contents = b"We've been trying to reach you about your car's extended warranty."
         gdi_converter = GdiConverter(file_contents=contents)
         assert gdi_converter.file_contents == contents
 
     def test_convert_file_without_file_name(self):
         """Tests failure mode when the file is not defined."""
-        gdi_converter = GdiConverter(file_contents="Content")
+        gdi_converter = GdiConverter(file_contents=b"Content")
         with pytest.raises(ValueError) as ex:
             gdi_converter.convert_file()
         assert "Cannot convert file, file_path is None" in str(ex.value)
@@ -64,95 +63,109 @@ class TestGdiConverter:
         with pytest.raises(ValueError) as ex:
             gdi_converter.convert_file_contents(gdi_converter.file_contents)
         assert (
-            "file_contents should be a string representing the contents of a GDI file"
+            "file_contents should be bytes representing the contents of a GDI file"
             in str(ex.value)
         )
 
-    # pylint: disable=protected-access
-    def test__backup_file(self, tmp_path):
-        """Test backing up the source file."""
-        file_name = "original.gdi"
-        file_contents = "Naked as the eyes of a clown"
-        file_path = tmp_path / file_name
-        file_path.write_text(file_contents)
-        gdi_converter = GdiConverter(file_path)
-        gdi_converter._backup_file(file_contents)
-        backup_file = tmp_path / (file_name + ".bak")
-        assert backup_file.exists()
-        assert gdi_converter.backup_exists
-        assert backup_file.read_text() == file_contents
-
-    # pylint: disable=protected-access
-    def test__delete_backup_exist_state_set(self, tmp_path):
-        """Test removing the backup file."""
-        file_name = "original.gdi"
-        file_path = tmp_path / file_name
-        gdi_converter = GdiConverter(file_path)
-        gdi_converter.backup_exists = True
-        backup_path = tmp_path / gdi_converter.backup_file_path
-        backup_path.touch()
-        gdi_converter._delete_backup()
-        assert not backup_path.exists()
-
-    # pylint: disable=protected-access
-    def test__delete_backup_exist_state_not_set(self, tmp_path):
-        """Test removing the backup file."""
-        file_name = "original.gdi"
-        file_path = tmp_path / file_name
-        gdi_converter = GdiConverter(file_path)
-        backup_path = tmp_path / gdi_converter.backup_file_path
-        backup_path.touch()
-        gdi_converter._delete_backup()
-        assert backup_path.exists()
-
-    # pylint: disable=protected-access
-    def test__remove_extra_whitespace(self):
-        """Tests removing extra whitespace from the file."""
+    def test_convert_file_interrupted(self, tmp_path, monkeypatch):
+        """Tests the file is left as it was, with no backup or temporary file, when
+        the conversion fails."""
+        file_contents = b'1\n1 0 4 2352 "Game (Track 1).bin" 0\n'
+        file_path = tmp_path / "original.gdi"
+        file_path.write_bytes(file_contents)
+
+        def fail_replace(_src, _dst):
+            raise OSError("Disk full")
+
+        monkeypatch.setattr("gdipak.gdi_converter.os.replace", fail_replace)
+        with pytest.raises(OSError):
+            GdiConverter(file_path).convert_file()
+        assert file_path.read_bytes() == file_contents
+        assert list(tmp_path.iterdir()) == [file_path]
+
+    def test_convert_file_contents(self):
+        """Tests replacing file names and removing extra whitespace, keeping each
+        line's ending."""
         contents = (
-            "Somebody once     told\t me the world is gonna roll me\r\n"
-            "        	I ain't the sharpest tool\n"  # noqa: W191, E101
-            "      in the        shed"
+            b"3\r\n"
+            b'1 0 4 2352 "Fella\'s Guys (Jp) (Track 1).bin" 0\n'
+            b' 2 600\t0  2352 "Fella\'s  Guys (Jp) (Track 2).raw"   0\r\n'
+            b"10    1200 4 2352 Fella's_Guys_(Track_10).bin 0 "
         )
-        output = GdiConverter(file_contents="1")._remove_extra_whitespace(contents)
-        assert output == textwrap.dedent(
-            """\
-            Somebody once told me the world is gonna roll me\r
-            I ain't the sharpest tool
-            in the shed"""
+        output = GdiConverter(file_contents=b"1").convert_file_contents(contents)
+        assert output == (
+            b"3\r\n"
+            b'1 0 4 2352 "track01.bin" 0\n'
+            b'2 600 0 2352 "track02.raw" 0\r\n'
+            b'10 1200 4 2352 "track10.bin" 0'
         )
 
-    def test__replace_file_names_replace_file_names(self):
-        """Tests replacing file names with the new naming convention."""
-        contents = "1\n1 0 4 2252 Fella's Guys (Jp) (Track 1).bin\" 0\n"
-        with pytest.raises(ValueError) as ex:
-            GdiConverter(file_contents="1")._replace_file_names(contents)
-        assert (
-            "Line 2 only contains a single quote, "
-            "file names should be between two quotes." in str(ex.value)
-        )
+    def test_convert_file_contents_not_utf8(self):
+        """Tests file names that are not UTF-8 are converted."""
+        name = "ソニックアドベンチャー (Track 1).bin".encode("shift_jis")
+        contents = b'1\r\n1 0 4 2352 "' + name + b'" 0\r\n'
+        output = GdiConverter(file_contents=contents).convert_file_contents()
+        assert output == b'1\r\n1 0 4 2352 "track01.bin" 0\r\n'
 
-    def test__replace_file_names_no_quotes(self):
-        """Tests replacing file names with the new naming convention."""
-        contents = "1\n1 0 4 2252 Fella's Guys (Jp) (Track 1).bin 0\n"
+    def test_convert_to(self, tmp_path):
+        """Tests converting a file into another directory."""
+        file_path = tmp_path / "game.gdi"
+        contents = b'1\r\n1 0 4 2352 "Game (Track 1).bin" 0\r\n'
+        file_path.write_bytes(contents)
+        out_file = tmp_path / "out" / "disc.gdi"
+        GdiConverter(file_path).convert_to(out_file)
+        assert out_file.read_bytes() == b'1\r\n1 0 4 2352 "track01.bin" 0\r\n'
+        assert file_path.read_bytes() == contents
+        assert [file.name for file in out_file.parent.iterdir()] == ["disc.gdi"]
+
+    def test_convert_to_sync(self, tmp_path, monkeypatch):
+        """Tests the converted file is flushed before it replaces the out file, and
+        the directory after."""
+        file_path = tmp_path / "game.gdi"
+        file_path.write_bytes(b'1\r\n1 0 4 2352 "Game (Track 1).bin" 0\r\n')
+        out_file = tmp_path / "disc.gdi"
+        fsynced = record_fsyncs(monkeypatch)
+        GdiConverter(file_path).convert_to(out_file, sync=True)
+        assert fsynced == [get_inode(out_file), get_inode(tmp_path)]
+
+    def test_convert_to_same_file(self, tmp_path):
+        """Tests converting a file into itself replaces it."""
+        file_path = tmp_path / "disc.gdi"
+        file_path.write_bytes(b'1\n1 0 4 2352 "Game (Track 1).bin" 0\n')
+        GdiConverter(file_path).convert_to(file_path)
+        assert file_path.read_bytes() == b'1\n1 0 4 2352 "track01.bin" 0\n'
+        assert [file.name for file in tmp_path.iterdir()] == ["disc.gdi"]
+
+    def test_convert_to_failure(self, tmp_path, monkeypatch):
+        """Tests the existing out file and the temporary file are cleaned up when
+        the write fails."""
+        file_path = tmp_path / "game.gdi"
+        file_path.write_bytes(b'1\n1 0 4 2352 "Game (Track 1).bin" 0\n')
+        out_file = tmp_path / "disc.gdi"
+        out_file.write_bytes(b"old")
+
+        def fail_replace(_src, _dst):
+            raise OSError("Disk full")
+
+        monkeypatch.setattr("gdipak.gdi_converter.os.replace", fail_replace)
+        with pytest.raises(OSError):
+            GdiConverter(file_path).convert_to(out_file)
+        assert out_file.read_bytes() == b"old"
+        assert sorted(file.name for file in tmp_path.iterdir()) == [
+            "disc.gdi",
+            "game.gdi",
+        ]
+
+    def test_convert_to_without_file_name(self):
+        """Tests converting without a source file."""
+        with pytest.raises(ValueError):
+            GdiConverter(file_contents=b"Content").convert_to("disc.gdi")
+
+    def test_convert_file_contents_invalid(self):
+        """Tests contents that are not a GDI file."""
         with pytest.raises(ValueError) as ex:
-            GdiConverter(file_contents="1")._replace_file_names(contents)
-        assert "Line 2 does not reference a quoted file name." in str(ex.value)
-
-    def test__replace_file_names(self):
-        """Tests replacing file names with the new naming convention."""
-        contents = (
-            "12\n"
-            '1 0 4 2252 "Fella\'s Guys (Jp) (Track 1).bin" 0\n'
-            '2 600 0 2252 "Fella\'s Guys (Jp) (Track 2).bin" 0\r\n'
-            '10 1200 4 2252 "Fella\'s Guys (Jp) (Track 10).bin" 0\n'
-        )
-        output = GdiConverter(file_contents="1")._replace_file_names(contents)
-        assert output == (
-            "12\n"
-            '1 0 4 2252 "track01.bin" 0\n'
-            '2 600 0 2252 "track02.bin" 0\r\n'
-            '10 1200 4 2252 "track10.bin" 0\n'
-        )
+            GdiConverter(file_contents=b"1").convert_file_contents(b"Not a GDI file")
+        assert "Line 1 does not hold the number of tracks." in str(ex.value)
 
     # pylint: disable=too-many-locals
     def test_convert_gdi(self, tmp_path, gdi_file):
@@ -0,0 +1,123 @@
+"""Tests for gdi_model.py"""
+
+import pytest
+
+from gdipak.gdi_model import AUDIO_TRACK, DATA_TRACK, GdiDisc, Track
+from tests.testing_utils import GdiGenerator
+
+
+class TestTrack:
+    """Tests reading and writing a track line."""
+
+    def test_parse_quoted(self):
+        """Tests a file name between quotes, containing spaces and quotes."""
+        track = Track.parse(b' 2    600\t0 2352 "My "Game" (Track 2).raw"  0')
+        assert track == Track(2, 600, AUDIO_TRACK, 2352, b'My "Game" (Track 2).raw')
+        assert not track.is_data
+
+    def test_parse_unquoted(self):
+        """Tests a file name without quotes."""
+        track = Track.parse(b"3 45000 4 2352 track03.bin 0")
+        assert track == Track(3, 45000, DATA_TRACK, 2352, b"track03.bin", 0)
+        assert track.is_data
+
+    def test_single_quote(self):
+        """Tests a file name with only one quote."""
+        with pytest.raises(ValueError) as ex:
+            Track.parse(b"1 0 4 2352 Fella's Guys (Jp) (Track 1).bin\" 0", 5)
+        assert (
+            "Line 5 only contains a single quote, "
+            "file names should be between two quotes." in str(ex.value)
+        )
+
+    @pytest.mark.parametrize(
+        "line",
+        [
+            b'1 0 4 "track01.bin" 0',
+            b'1 0 4 2352 "track01.bin"',
+            b'1 0 4 2352 "track01.bin" 0 extra',
+            b'1 0 four 2352 "track01.bin" 0',
+            b"1 0 4 2352",
+            b"1 0 4 2352 track 01.bin 0",
+        ],
+    )
+    def test_invalid(self, line):
+        """Tests lines with missing, extra or non numeric fields."""
+        with pytest.raises(ValueError) as ex:
+            Track.parse(line, 3)
+        assert "Line 3 is not a valid track." in str(ex.value)
+
+    def test_to_line(self):
+        """Tests writing a track."""
+        track = Track(1, 0, DATA_TRACK, 2352, b"track01.bin")
+        assert track.to_line() == b'1 0 4 2352 "track01.bin" 0'
+        assert repr(track) == (
+            "Track(number=1, lba=0, track_type=4, sector_size=2352, "
+            "file_name=b'track01.bin', offset=0)"
+        )
+
+    def test_slots(self):
+        """Tests tracks do not carry a dictionary of attributes."""
+        track = Track(1, 0, DATA_TRACK, 2352, b"track01.bin")
+        assert not hasattr(track, "__dict__")
+        assert track != b"track01.bin"
+
+
+class TestGdiDisc:
+    """Tests reading and writing a whole GDI file."""
+
+    def test_round_trip(self):
+        """Tests a generated GDI file is read and written back."""
+        contents, metadata = GdiGenerator("Game", line_end="\n")()
+        disc = GdiDisc.parse(contents.encode())
+        assert len(disc) == metadata.num_tracks
+        assert disc.line_ends == [b"\n"] * (metadata.num_tracks + 1)
+        assert [track.lba for track in disc.tracks] == metadata.offsets
+        assert GdiDisc.parse(disc.to_bytes()).to_bytes() == disc.to_bytes()
+
+    def test_rename_files(self):
+        """Tests renaming the tracks' files."""
+        disc = GdiDisc.parse(
+            b'2\r\n1 0 4 2352 "A (Track 1).bin" 0\r\n'
+            b'2 600 0 2352 "A (Track 2).raw" 0\r\n'
+        )
+        disc.rename_files()
+        assert disc.to_bytes() == (
+            b'2\r\n1 0 4 2352 "track01.bin" 0\r\n2 600 0 2352 "track02.raw" 0\r\n'
+        )
+        disc.rename_files(bytes.upper)
+        assert disc.tracks[0].file_name == b"TRACK01.BIN"
+
+    def test_blank_lines(self):
+        """Tests blank lines are ignored."""
+        disc = GdiDisc.parse(b'1\n\n1 0 4 2352 "track01.bin" 0\n  \n')
+        assert len(disc) == 1
+        assert disc.to_bytes() == b'1\n1 0 4 2352 "track01.bin" 0\n'
+
+    def test_empty(self):
+        """Tests an empty file."""
+        with pytest.raises(ValueError) as ex:
+            GdiDisc.parse(b"")
+        assert "GDI file is empty." in str(ex.value)
+
+    def test_invalid_track_count(self):
+        """Tests a first line that is not a number."""
+        with pytest.raises(ValueError) as ex:
+            GdiDisc.parse(b'one\n1 0 4 2352 "track01.bin" 0\n')
+        assert "Line 1 does not hold the number of tracks." in str(ex.value)
+
+    def test_wrong_track_count(self):
+        """Tests a file that lists more tracks than it contains."""
+        with pytest.raises(ValueError) as ex:
+            GdiDisc.parse(b'3\n1 0 4 2352 "track01.bin" 0\n')
+        assert "GDI file lists 3 tracks but contains 1." in str(ex.value)
+
+    def test_line_ends(self):
+        """Tests each line keeps its own line ending, and new lines use CRLF."""
+        disc = GdiDisc.parse(b'1\r1 0 4 2352 "track01.bin" 0')
+        assert disc.line_ends == [b"\r", b""]
+        disc.tracks.append(Track(2, 600, AUDIO_TRACK, 2352, b"track02.raw"))
+        assert disc.to_bytes() == (
+            b'2\r1 0 4 2352 "track01.bin" 0' b'2 600 0 2352 "track02.raw" 0\r\n'
+        )
+        assert GdiDisc([]).to_bytes() == b"0\r\n"
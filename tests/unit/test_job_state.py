@@ -0,0 +1,112 @@
+"""Tests for job_state.py"""
+
+from pathlib import Path
+import pytest
+
+from gdipak import job_state
+from gdipak.file_utils import GameDir
+from gdipak.job_state import JobState, JobStatus
+
+
+def make_games(count):
+    """Creates games with made up files."""
+    games = []
+    for index in range(count):
+        path = Path(f"/games/game{index}")
+        games.append(GameDir(path, [path / "game.gdi", path / "track1.bin"]))
+    return games
+
+
+class TestJobState:
+    """Tests recording the progress of a run."""
+
+    @pytest.fixture(name="db_path")
+    def make_db_path(self, tmp_path):
+        """The path to a fresh database."""
+        yield tmp_path / "state.db"
+
+    def test_new_run(self, db_path):
+        """Test a run with no previous state processes all games."""
+        games = make_games(3)
+        with JobState(db_path, "/games", "/out") as state:
+            assert list(state.games(lambda: games)) == games
+            assert state.get_status(games[0].path) == JobStatus.PENDING
+            assert state.get_status("/games/unknown") is None
+
+    def test_different_run(self, db_path):
+        """Test a database can not be used for a run with other directories."""
+        JobState(db_path, "/games", "/out").close()
+        with pytest.raises(ValueError) as ex:
+            JobState(db_path, "/games", "/other_out")
+        assert "State database belongs to a run with out_dir" in str(ex.value)
+
+    def test_game_status(self, db_path):
+        """Test marking games in progress, done and failed."""
+        games = make_games(2)
+        with JobState(db_path, "/games", "/out") as state:
+            list(state.games(lambda: games))
+            assert state.start_game(games[0].path) == set()
+            assert state.get_status(games[0].path) == JobStatus.IN_PROGRESS
+            state.finish_game(games[0].path)
+            assert state.get_status(games[0].path) == JobStatus.DONE
+            state.start_game(games[1].path)
+            state.finish_game(games[1].path, ValueError("bad"))
+            assert state.get_status(games[1].path) == JobStatus.FAILED
+
+    def test_resume_after_discovery(self, db_path):
+        """Test a resumed run reads the unfinished games from the database."""
+        games = make_games(5)
+        with JobState(db_path, "/games", "/out") as state:
+            list(state.games(lambda: games))
+            state.start_game(games[0].path)
+            state.finish_game(games[0].path)
+            state.start_game(games[1].path)
+            state.finish_game(games[1].path, ValueError("bad"))
+            # Interrupted while packing
+            state.start_game(games[2].path)
+
+        with JobState(db_path, "/games", "/out") as state:
+            assert state.get_status(games[2].path) == JobStatus.PENDING
+            resumed = list(state.games(lambda: pytest.fail("Searched again")))
+            assert resumed == games[1:]
+
+    def test_resume_in_pages(self, db_path, monkeypatch):
+        """Test games are read back a page at a time in discovery order."""
+        monkeypatch.setattr(job_state, "PAGE_SIZE", 2)
+        games = make_games(5)
+        with JobState(db_path, "/games", "/out") as state:
+            list(state.games(lambda: games))
+        with JobState(db_path, "/games", "/out") as state:
+            assert list(state.games(lambda: [])) == games
+
+    def test_resume_during_discovery(self, db_path):
+        """Test a run interrupted while searching searches again, skipping done
+        games."""
+        games = make_games(4)
+        with JobState(db_path, "/games", "/out") as state:
+            found = state.games(lambda: games)
+            first = next(found)
+            state.start_game(first.path)
+            state.finish_game(first.path)
+
+        with JobState(db_path, "/games", "/out") as state:
+            assert list(state.games(lambda: games)) == games[1:]
+
+    def test_track_status(self, db_path):
+        """Test tracks that are done are reported when the game is restarted."""
+        games = make_games(1)
+        game = games[0]
+        with JobState(db_path, "/games", "/out") as state:
+            list(state.games(lambda: games))
+            state.start_game(game.path)
+            state.track_done(game.path, game.files[1])
+        with JobState(db_path, "/games", "/out") as state:
+            assert state.start_game(game.path) == {game.files[1]}
+
+    def test_game_without_files(self, db_path):
+        """Test a game whose files were not listed during discovery."""
+        games = [GameDir(Path("/games/game"), None)]
+        with JobState(db_path, "/games", "/out") as state:
+            list(state.games(lambda: games))
+        with JobState(db_path, "/games", "/out") as state:
+            assert list(state.games(lambda: [])) == games
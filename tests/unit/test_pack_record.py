@@ -0,0 +1,91 @@
+"""Tests for pack_record.py"""
+
+import json
+import os
+
+from gdipak.pack_record import PackRecord, RECORD_FILE_NAME
+
+
+def make_game(tmp_path):
+    """Creates source and output files for a packed game."""
+    in_dir = tmp_path / "in"
+    in_dir.mkdir()
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    game_files = [in_dir / "game.gdi", in_dir / "game (track 1).bin"]
+    out_files = [out_dir / "disc.gdi", out_dir / "track01.bin"]
+    for file in game_files + out_files:
+        file.write_bytes(b"data")
+    return game_files, out_files
+
+
+class TestPackRecord:
+    """Tests recording packed games."""
+
+    def test_path(self, tmp_path):
+        """Test the record is kept in the output directory."""
+        assert PackRecord(str(tmp_path)).path == tmp_path / RECORD_FILE_NAME
+
+    def test_missing_record(self, tmp_path):
+        """Test a game that has never been packed is not current."""
+        game_files, _ = make_game(tmp_path)
+        assert not PackRecord(tmp_path / "out").is_current(game_files)
+
+    def test_current(self, tmp_path):
+        """Test a game that has not changed since it was packed."""
+        game_files, out_files = make_game(tmp_path)
+        record = PackRecord(tmp_path / "out")
+        record.save(game_files, out_files)
+        assert record.is_current(game_files)
+        assert not record.path.with_name(RECORD_FILE_NAME + ".tmp").exists()
+
+    def test_source_changed(self, tmp_path):
+        """Test a game whose source files have changed."""
+        game_files, out_files = make_game(tmp_path)
+        record = PackRecord(tmp_path / "out")
+        record.save(game_files, out_files)
+        game_files[1].write_bytes(b"new track data")
+        assert not record.is_current(game_files)
+
+    def test_source_added(self, tmp_path):
+        """Test a game that has gained a source file."""
+        game_files, out_files = make_game(tmp_path)
+        record = PackRecord(tmp_path / "out")
+        record.save(game_files, out_files)
+        new_file = game_files[0].parent / "game (track 2).bin"
+        new_file.touch()
+        assert not record.is_current(game_files + [new_file])
+
+    def test_output_changed(self, tmp_path):
+        """Test a game whose output files have been modified."""
+        game_files, out_files = make_game(tmp_path)
+        record = PackRecord(tmp_path / "out")
+        record.save(game_files, out_files)
+        stat = out_files[1].stat()
+        os.utime(out_files[1], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        assert not record.is_current(game_files)
+
+    def test_output_deleted(self, tmp_path):
+        """Test a game whose output files have been removed."""
+        game_files, out_files = make_game(tmp_path)
+        record = PackRecord(tmp_path / "out")
+        record.save(game_files, out_files)
+        out_files[1].unlink()
+        assert not record.is_current(game_files)
+
+    def test_corrupt_record(self, tmp_path):
+        """Test a record that can not be read."""
+        game_files, _ = make_game(tmp_path)
+        record = PackRecord(tmp_path / "out")
+        record.path.write_text("{not json", encoding="UTF-8")
+        assert not record.is_current(game_files)
+
+    def test_other_version(self, tmp_path):
+        """Test a record written by a different version of the format."""
+        game_files, out_files = make_game(tmp_path)
+        record = PackRecord(tmp_path / "out")
+        record.save(game_files, out_files)
+        contents = json.loads(record.path.read_text(encoding="UTF-8"))
+        contents["version"] = 0
+        record.path.write_text(json.dumps(contents), encoding="UTF-8")
+        assert not record.is_current(game_files)
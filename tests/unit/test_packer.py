@@ -1,9 +1,33 @@
 """Tests for game packer"""
 
+import errno
+from pathlib import Path
+import shutil
 import pytest
 
-from gdipak.packer import BasePacker, MovePacker, CopyPacker
-from tests.testing_utils import make_files
+from gdipak import file_utils
+from gdipak import packer as packer_module
+from gdipak.arg_parser import SyncMode
+from gdipak.checksums import MANIFEST_FILE_NAME, hash_file
+from gdipak.copy_engine import CopyEngine
+from gdipak.packer import BasePacker, MovePacker, CopyPacker, LinkPacker
+from gdipak.sync import SyncBatch
+from tests.testing_utils import get_inode, make_files, record_fsyncs
+
+
+def check_manifest(out_dir):
+    """Checks the checksum manifest matches the files in the output directory."""
+    lines = (out_dir / MANIFEST_FILE_NAME).read_text(encoding="UTF-8").splitlines()
+    out_files = sorted(
+        file for file in out_dir.iterdir() if file.name != MANIFEST_FILE_NAME
+    )
+    assert len(lines) == len(out_files) + 1
+    for line, out_file in zip(lines[1:], out_files):
+        size, crc32, md5, sha1, name = line.split(" ", 4)
+        digests = hash_file(out_file).hexdigests()
+        assert name == out_file.name
+        assert int(size) == out_file.stat().st_size
+        assert [crc32, md5, sha1] == [digests[key] for key in ("crc32", "md5", "sha1")]
 
 
 @pytest.fixture(scope="function", autouse=True)
@@ -17,11 +41,18 @@ def mock_convert_file_name(monkeypatch):
 
 @pytest.fixture(scope="function", autouse=True)
 def mock_convert_file(monkeypatch):
-    """Patch convert file function."""
+    """Patch convert file functions, converting into another file copies it."""
     monkeypatch.setattr(
-        "gdipak.gdi_converter.GdiConverter.convert_file", lambda _self: None
+        "gdipak.gdi_converter.GdiConverter.convert_file",
+        lambda _self, _sync=False: None,
     )
 
+    def copy_file(self, out_file, _sync=False):
+        if self.file_path != Path(out_file):
+            shutil.copyfile(self.file_path, out_file)
+
+    monkeypatch.setattr("gdipak.gdi_converter.GdiConverter.convert_to", copy_file)
+
 
 class TestPacker:
     """Tests for the base packer class."""
@@ -51,6 +82,17 @@ class TestPacker:
             MovePacker(game_dir, game_dir)
         assert "Directory contains more than one gdi file" in str(ex.value)
 
+    def test_given_game_files(self, tmp_path, monkeypatch):
+        """Tests the directory is not searched again when the files are known."""
+        game_dir, _, _ = make_files(tmp_path, "Bo Diddley's Conquest")
+        game_files = list(game_dir.iterdir())
+        monkeypatch.setattr(
+            "gdipak.file_utils.get_game_files_in_dir",
+            lambda _dir: pytest.fail("Searched the directory"),
+        )
+        packer = MovePacker(game_dir, game_dir, game_files=game_files)
+        assert packer.game_files == game_files
+
     def test_create_name_file(self, tmp_path):
         """Tests That the name file gets created"""
 
@@ -66,6 +108,78 @@ class TestPacker:
         packer.package_game(create_name_file=True)
         assert (game_dir / game_name).exists()
 
+    def test_parallel_tracks(self, tmp_path):
+        """Tests the GDI file is handled after all of the tracks."""
+        actions = []
+
+        class LocalPacker(BasePacker):
+            """It isn't abstract"""
+
+            def file_action(self, in_file, _out_file):
+                actions.append(in_file.suffix)
+
+        game_dir, _, _ = make_files(tmp_path, "Action at a Distance")
+        packer = LocalPacker(game_dir, game_dir)
+        packer.package_game(track_jobs=3)
+        assert sorted(actions[:-1]) == [".bin", ".bin", ".raw"]
+        assert actions[-1] == ".gdi"
+
+    def test_largest_tracks_first(self, tmp_path):
+        """Tests the tracks are handled in order of size, largest first."""
+        actions = []
+
+        class LocalPacker(BasePacker):
+            """It isn't abstract"""
+
+            def file_action(self, in_file, _out_file):
+                actions.append(in_file)
+
+        game_dir, _, _ = make_files(tmp_path, "Action at a Distance")
+        packer = LocalPacker(game_dir, game_dir)
+        tracks = [file for file in packer.game_files if file != packer.gdi_file]
+        for size, track in enumerate(tracks):
+            track.write_bytes(bytes(size * 10))
+        packer.package_game()
+        assert actions == tracks[::-1] + [packer.gdi_file]
+
+    def test_skip_tracks(self, tmp_path):
+        """Tests tracks that were already handled are skipped and handled tracks
+        are reported."""
+        actions = []
+        done = []
+
+        class LocalPacker(BasePacker):
+            """It isn't abstract"""
+
+            def file_action(self, in_file, _out_file):
+                actions.append(in_file)
+
+        game_dir, _, _ = make_files(tmp_path, "Action at a Distance")
+        packer = LocalPacker(game_dir, game_dir)
+        tracks = [file for file in packer.game_files if file != packer.gdi_file]
+        packer.package_game(skip_tracks=tracks[:1], on_track_done=done.append)
+        assert actions == tracks[1:] + [packer.gdi_file]
+        assert done == tracks[1:]
+
+    def test_checksums(self, tmp_path):
+        """Tests the output files are read back to write the checksum manifest,
+        including tracks that were already handled."""
+
+        class LocalPacker(BasePacker):
+            """It isn't abstract"""
+
+            def file_action(self, in_file, out_file):
+                out_file.write_bytes(in_file.read_bytes())
+
+        game_dir, _, _ = make_files(tmp_path, "Action at a Distance")
+        out_dir = tmp_path / "out_dir"
+        out_dir.mkdir()
+        packer = LocalPacker(game_dir, out_dir)
+        tracks = [file for file in packer.game_files if file != packer.gdi_file]
+        packer.file_action(tracks[0], packer.get_out_file(tracks[0]))
+        packer.package_game(skip_tracks=tracks[:1], checksums=True)
+        check_manifest(out_dir)
+
 
 class TestCopyPacker:
     """Tests for the copy packer class."""
@@ -98,6 +212,181 @@ class TestCopyPacker:
         for in_file in in_files:
             assert in_file in out_files
 
+    def test_default_engine(self, tmp_path):
+        """Tests that a copy engine is created when one is not given."""
+        game_dir, _, _ = make_files(tmp_path, "Melting in the Moonlight")
+        packer = CopyPacker(game_dir, game_dir)
+        assert isinstance(packer.engine, CopyEngine)
+
+    def test_custom_engine(self, tmp_path):
+        """Tests copying files with a given copy engine."""
+        game_dir, _, _ = make_files(tmp_path, "Melting in the Moonlight")
+        out_dir = tmp_path / "out_dir"
+        engine = CopyEngine(block_size=2)
+        packer = CopyPacker(game_dir, out_dir, engine=engine)
+        assert packer.engine is engine
+        packer.package_game()
+        for in_file in game_dir.iterdir():
+            assert (out_dir / in_file.name).read_bytes() == in_file.read_bytes()
+
+    def test_staged(self, tmp_path, monkeypatch):
+        """Tests the game is written to a staging directory and then published."""
+        game_dir, _, _ = make_files(tmp_path, "Melting in the Moonlight")
+        out_dir = tmp_path / "out_dir"
+        packer = CopyPacker(game_dir, out_dir)
+        assert packer.work_dir == file_utils.get_staging_dir(out_dir)
+        published = []
+        publish_dir = file_utils.publish_dir
+
+        def record_publish_dir(staging_dir, pub_dir):
+            published.append(sorted(file.name for file in staging_dir.iterdir()))
+            publish_dir(staging_dir, pub_dir)
+
+        monkeypatch.setattr(file_utils, "publish_dir", record_publish_dir)
+        packer.package_game(create_name_file=True)
+        out_files = sorted(file.name for file in out_dir.iterdir())
+        assert published == [out_files]
+        assert len(out_files) == len(packer.game_files) + 1
+        assert not packer.work_dir.exists()
+
+    def test_staged_interrupted(self, tmp_path, monkeypatch):
+        """Tests an interrupted game leaves no output directory, and that the next
+        run discards what was staged."""
+        game_dir, _, _ = make_files(tmp_path, "Melting in the Moonlight")
+        out_dir = tmp_path / "out_dir"
+        packer = CopyPacker(game_dir, out_dir)
+
+        def fail(_in_file, _out_file):
+            raise OSError("Unplugged")
+
+        monkeypatch.setattr(packer, "gdi_file_action", fail)
+        with pytest.raises(OSError):
+            packer.package_game()
+        assert not out_dir.exists()
+        assert len(list(packer.work_dir.iterdir())) == len(packer.game_files) - 1
+        (packer.work_dir / "stale.bin").touch()
+        monkeypatch.delattr(packer, "gdi_file_action")
+        packer.package_game()
+        assert not packer.work_dir.exists()
+        assert len(list(out_dir.iterdir())) == len(packer.game_files)
+
+    def test_staged_resume(self, tmp_path):
+        """Tests tracks that are already staged are kept when they are skipped."""
+        game_dir, _, _ = make_files(tmp_path, "Melting in the Moonlight")
+        out_dir = tmp_path / "out_dir"
+        packer = CopyPacker(game_dir, out_dir)
+        tracks = [file for file in packer.game_files if file != packer.gdi_file]
+        packer.file_action(tracks[0], packer.get_work_file(tracks[0]))
+        packer.package_game(skip_tracks=tracks[:1])
+        assert packer.get_out_file(tracks[0]).exists()
+        assert not packer.work_dir.exists()
+
+    def test_not_staged_in_place(self, tmp_path):
+        """Tests a game packaged into its own directory is not staged."""
+        game_dir, _, _ = make_files(tmp_path, "Melting in the Moonlight")
+        packer = CopyPacker(game_dir, str(game_dir))
+        assert packer.work_dir == game_dir
+        assert not MovePacker(game_dir, tmp_path / "out_dir").staged
+
+    def test_not_staged_in_place_alias(self, tmp_path):
+        """Tests a game packaged into its own directory, through a symbolic link or a
+        path with '..' in it, is not staged."""
+        game_dir, _, _ = make_files(tmp_path, "Melting in the Moonlight")
+        link = tmp_path / "link"
+        link.symlink_to(game_dir)
+        for out_dir in (link, game_dir / ".." / game_dir.name):
+            assert CopyPacker(game_dir, out_dir).work_dir == out_dir
+
+    def test_sync_none(self, tmp_path, monkeypatch):
+        """Tests nothing is flushed by default."""
+        game_dir, _, _ = make_files(tmp_path, "Melting in the Moonlight")
+        fsynced = record_fsyncs(monkeypatch)
+        CopyPacker(game_dir, tmp_path / "out_dir").package_game(create_name_file=True)
+        assert not fsynced
+
+    @pytest.mark.parametrize("sync", [SyncMode.GAME, SyncMode.FILE])
+    def test_sync(self, tmp_path, monkeypatch, sync):
+        """Tests every output file and the directories that name them are flushed,
+        and that the game is flushed before it is published."""
+        game_dir, _, _ = make_files(tmp_path, "Melting in the Moonlight")
+        out_dir = tmp_path / "out_dir"
+        packer = CopyPacker(game_dir, out_dir, sync=sync)
+        fsynced = record_fsyncs(monkeypatch)
+        publish_dir = file_utils.publish_dir
+        published = []
+
+        def record_publish_dir(staging_dir, pub_dir):
+            published.append(len(fsynced))
+            publish_dir(staging_dir, pub_dir)
+
+        monkeypatch.setattr(file_utils, "publish_dir", record_publish_dir)
+        packer.package_game(create_name_file=True, checksums=True)
+        out_files = list(out_dir.iterdir())
+        assert len(out_files) == len(packer.game_files) + 2
+        # The GDI file is flushed by the converter, which is patched out.
+        if sync == SyncMode.FILE:
+            out_files.remove(out_dir / packer.gdi_file.name)
+        before_publish = [get_inode(path) for path in out_files + [out_dir]]
+        publish_index = published[0]
+        assert set(fsynced[:publish_index]) == set(before_publish)
+        assert set(fsynced[publish_index:]) == {get_inode(out_dir), get_inode(tmp_path)}
+        if sync == SyncMode.GAME:
+            # Flushed as a batch, each file once.
+            assert len(fsynced[:publish_index]) == len(before_publish)
+
+    def test_sync_end(self, tmp_path, monkeypatch):
+        """Tests the output files are left to be flushed once the run is done."""
+        game_dir, _, _ = make_files(tmp_path, "Melting in the Moonlight")
+        out_dir = tmp_path / "out_dir"
+        packer = CopyPacker(game_dir, out_dir, sync=SyncMode.END)
+        fsynced = record_fsyncs(monkeypatch)
+        sync_batch = SyncBatch()
+        packer.package_game(sync_batch=sync_batch)
+        assert not fsynced
+        sync_batch.flush()
+        expected = list(out_dir.iterdir()) + [out_dir, tmp_path]
+        assert sorted(fsynced) == sorted(get_inode(path) for path in expected)
+
+    def test_gdi_converted_directly(self, tmp_path, monkeypatch):
+        """Tests the GDI file is converted into the output directory rather than
+        copied and then converted."""
+        game_dir, _, _ = make_files(tmp_path, "Melting in the Moonlight")
+        out_dir = tmp_path / "out_dir"
+        packer = CopyPacker(game_dir, out_dir)
+        copied = []
+        file_action = packer.file_action
+
+        def record_file_action(in_file, out_file):
+            copied.append(in_file)
+            file_action(in_file, out_file)
+
+        monkeypatch.setattr(packer, "file_action", record_file_action)
+        monkeypatch.setattr(
+            "gdipak.gdi_converter.GdiConverter.convert_file",
+            lambda _self, _sync=False: pytest.fail("Converted in place"),
+        )
+        packer.package_game()
+        assert packer.gdi_file not in copied
+        assert len(copied) == len(packer.game_files) - 1
+        gdi_file = out_dir / packer.gdi_file.name
+        assert gdi_file.read_bytes() == packer.gdi_file.read_bytes()
+
+    def test_checksums(self, tmp_path, monkeypatch):
+        """Tests the tracks are hashed while they are copied, not read back."""
+        game_dir, _, _ = make_files(tmp_path, "Melting in the Moonlight")
+        out_dir = tmp_path / "out_dir"
+        hashed = []
+        packer_hash_file = packer_module.hash_file
+
+        def record_hash_file(file, hasher=None):
+            hashed.append(Path(file).suffix)
+            return packer_hash_file(file, hasher)
+
+        monkeypatch.setattr(packer_module, "hash_file", record_hash_file)
+        CopyPacker(game_dir, out_dir).package_game(checksums=True)
+        assert hashed == [".gdi"]
+        check_manifest(out_dir)
+
 
 class TestMovePacker:
     """Tests for the copy packer class."""
@@ -130,3 +419,109 @@ class TestMovePacker:
             assert out_file in in_files
         for in_file in in_files:
             assert in_file in out_files
+
+    def test_sync_file(self, tmp_path, monkeypatch):
+        """Tests the directories are flushed after each file is moved."""
+        game_dir, _, _ = make_files(tmp_path, "Melting in the Moonlight")
+        out_dir = tmp_path / "out_dir"
+        out_dir.mkdir()
+        packer = MovePacker(game_dir, out_dir, sync=SyncMode.FILE)
+        fsynced = record_fsyncs(monkeypatch)
+        packer.package_game()
+        assert fsynced.count(get_inode(out_dir)) == len(packer.game_files)
+
+
+class TestLinkPacker:
+    """Tests for the link packer class."""
+
+    def test_same_directory(self, tmp_path):
+        """Tests linking files from one directory to itself."""
+        game_dir, _, _ = make_files(tmp_path, "Melting in the Moonlight")
+        in_files = [file.name for file in game_dir.iterdir()]
+        packer = LinkPacker(game_dir, game_dir)
+        packer.package_game()
+        out_files = [file.name for file in game_dir.iterdir()]
+        assert sorted(in_files) == sorted(out_files)
+
+    def test_different_directories(self, tmp_path):
+        """Tests linking files from one directory to another."""
+        game_dir, _, _ = make_files(tmp_path, "Melting in the Moonlight")
+        out_dir = tmp_path / "out_dir"
+        packer = LinkPacker(game_dir, out_dir)
+        packer.package_game()
+        assert len(list(out_dir.iterdir())) == len(list(game_dir.iterdir()))
+        for in_file in game_dir.iterdir():
+            out_file = out_dir / in_file.name
+            if in_file.suffix == ".gdi":
+                # The GDI file gets modified so it must not be shared.
+                assert not out_file.samefile(in_file)
+                assert out_file.read_bytes() == in_file.read_bytes()
+            else:
+                assert out_file.samefile(in_file)
+
+    def test_replaces_existing_file(self, tmp_path):
+        """Tests an output file that already exists is replaced by the link."""
+        game_dir, _, _ = make_files(tmp_path, "Melting in the Moonlight")
+        in_file = next(file for file in game_dir.iterdir() if file.suffix == ".bin")
+        out_file = tmp_path / "out_dir" / in_file.name
+        out_file.parent.mkdir()
+        out_file.write_bytes(b"stale")
+        LinkPacker(game_dir, out_file.parent).file_action(in_file, out_file)
+        assert out_file.samefile(in_file)
+
+    def test_same_file_relative_path(self, tmp_path, monkeypatch):
+        """Tests a file linked onto itself through a relative path is kept."""
+        game_dir, _, _ = make_files(tmp_path, "Melting in the Moonlight")
+        in_file = next(file for file in game_dir.iterdir() if file.suffix == ".bin")
+        in_file.write_bytes(b"track data")
+        monkeypatch.chdir(game_dir)
+        LinkPacker(game_dir, ".").file_action(in_file, Path(in_file.name))
+        assert in_file.read_bytes() == b"track data"
+
+    def test_sync_file(self, tmp_path, monkeypatch):
+        """Tests the output directory is flushed after each link in 'FILE' sync
+        mode."""
+        game_dir, _, _ = make_files(tmp_path, "Melting in the Moonlight")
+        in_file = next(file for file in game_dir.iterdir() if file.suffix == ".bin")
+        out_file = tmp_path / "out_dir" / in_file.name
+        fsynced = record_fsyncs(monkeypatch)
+        packer = LinkPacker(game_dir, out_file.parent, sync=SyncMode.FILE)
+        packer.file_action(in_file, out_file)
+        assert out_file.samefile(in_file)
+        assert fsynced == [get_inode(out_file.parent)]
+
+    def test_different_file_systems(self, tmp_path, monkeypatch):
+        """Tests files are copied when they cannot be linked."""
+
+        def hardlink_to(_self, _target):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+        monkeypatch.setattr(Path, "hardlink_to", hardlink_to)
+        game_dir, _, _ = make_files(tmp_path, "Melting in the Moonlight")
+        in_file = next(file for file in game_dir.iterdir() if file.suffix == ".bin")
+        in_file.write_bytes(b"track data")
+        out_file = tmp_path / "out_dir" / in_file.name
+        LinkPacker(game_dir, out_file.parent).file_action(in_file, out_file)
+        assert not out_file.samefile(in_file)
+        assert out_file.read_bytes() == b"track data"
+
+    def test_checksums(self, tmp_path):
+        """Tests the linked tracks are hashed."""
+        game_dir, _, _ = make_files(tmp_path, "Melting in the Moonlight")
+        out_dir = tmp_path / "out_dir"
+        LinkPacker(game_dir, out_dir).package_game(checksums=True)
+        check_manifest(out_dir)
+
+    def test_link_error(self, tmp_path, monkeypatch):
+        """Tests errors other than crossing file systems are raised."""
+
+        def hardlink_to(_self, _target):
+            raise OSError(errno.EMLINK, "Too many links")
+
+        monkeypatch.setattr(Path, "hardlink_to", hardlink_to)
+        game_dir, _, _ = make_files(tmp_path, "Melting in the Moonlight")
+        in_file = next(file for file in game_dir.iterdir() if file.suffix == ".bin")
+        out_file = tmp_path / "out_dir" / in_file.name
+        with pytest.raises(OSError) as ex:
+            LinkPacker(game_dir, out_file.parent).file_action(in_file, out_file)
+        assert ex.value.errno == errno.EMLINK
@@ -0,0 +1,193 @@
+"""Tests for planner.py"""
+
+from collections import namedtuple
+import errno
+from pathlib import Path
+import pytest
+
+from gdipak import planner
+from gdipak.arg_parser import OperatingMode
+from gdipak.file_utils import GameDir
+from gdipak.planner import (
+    GamePlan,
+    PlannedFile,
+    PreflightError,
+    find_problems,
+    measure_throughput,
+    plan_game,
+    summarize,
+)
+from tests.testing_utils import make_files
+
+Usage = namedtuple("Usage", "total used free")
+
+
+@pytest.fixture(name="game")
+def make_game(tmp_path):
+    """Creates a game with some track data."""
+    game_dir, _, _ = make_files(tmp_path, "Power Stone")
+    for index, track in enumerate(sorted(game_dir.glob("*(track*"))):
+        track.write_bytes(bytes(index * 100))
+    yield GameDir(game_dir, None)
+
+
+class TestPlanGame:
+    """Tests planning to pack a game."""
+
+    def test_copy(self, tmp_path, game, monkeypatch):
+        """Test every file is planned, the GDI file last, without reading any."""
+        monkeypatch.setattr(
+            "builtins.open", lambda *_args, **_kwargs: pytest.fail("Read a file")
+        )
+        out_dir = tmp_path / "out" / "Power Stone"
+        planned = plan_game(game, out_dir, OperatingMode.COPY)
+        assert planned[-1].destination.name == "disc.gdi"
+        assert sorted(file.destination.name for file in planned[:-1]) == [
+            "track01.bin",
+            "track02.bin",
+            "track03.raw",
+        ]
+        assert all(file.action == planner.COPY for file in planned)
+        assert all(file.destination.parent == out_dir for file in planned)
+        for file in planned:
+            assert file.size == file.source.stat().st_size
+        assert not out_dir.exists()
+
+    def test_modify(self, game):
+        """Test files are moved in modify mode, even in place."""
+        planned = plan_game(game, game.path, OperatingMode.MODIFY)
+        assert all(file.action == planner.MOVE for file in planned)
+
+    def test_copy_in_place(self, game):
+        """Test files whose names do not change are not copied."""
+        gdi_file = next(game.path.glob("*.gdi"))
+        gdi_file = gdi_file.rename(game.path / "disc.gdi")
+        planned = plan_game(game, game.path, OperatingMode.COPY)
+        actions = {file.source.name: file.action for file in planned}
+        assert actions.pop("disc.gdi") == planner.NONE
+        assert set(actions.values()) == {planner.COPY}
+
+    def test_link(self, tmp_path, game, monkeypatch):
+        """Test tracks are linked on the same device and copied on another."""
+        planned = plan_game(game, tmp_path / "out", OperatingMode.LINK)
+        actions = [file.action for file in planned]
+        assert actions == [planner.LINK] * 3 + [planner.COPY]
+
+        device = tmp_path.stat().st_dev
+        monkeypatch.setattr(planner, "_get_device", lambda _directory: device + 1)
+        planned = plan_game(game, tmp_path / "out", OperatingMode.LINK)
+        assert [file.action for file in planned] == [planner.COPY] * 4
+
+
+class TestSummarize:
+    """Tests adding up a plan."""
+
+    def test_summarize(self):
+        """Test only copied data counts towards the estimate."""
+        planned = [
+            PlannedFile(Path("a"), Path("b"), planner.COPY, 300),
+            PlannedFile(Path("c"), Path("d"), planner.LINK, 1000),
+            PlannedFile(Path("e"), Path("f"), planner.COPY, 100),
+        ]
+        assert summarize(planned, 200.0) == {
+            "files": 3,
+            "bytes": 1400,
+            "data_bytes": 400,
+            "throughput_bytes_per_second": 200.0,
+            "estimated_seconds": 2.0,
+        }
+
+    def test_unknown_throughput(self):
+        """Test there is no estimate without a throughput."""
+        assert summarize([], None)["estimated_seconds"] is None
+
+
+class TestMeasureThroughput:
+    """Tests measuring the output device."""
+
+    def test_measure_throughput(self, tmp_path):
+        """Test a throughput is measured and nothing is left behind."""
+        assert measure_throughput(tmp_path, size=3 * 1024 * 1024 + 5) > 0
+        assert not list(tmp_path.iterdir())
+
+    def test_error(self, tmp_path, monkeypatch):
+        """Test errors writing the probe are raised."""
+
+        def fsync(_fd):
+            raise OSError(errno.EIO, "Input/output error")
+
+        monkeypatch.setattr(planner.os, "fsync", fsync)
+        with pytest.raises(OSError):
+            measure_throughput(tmp_path, size=10)
+
+
+class TestFindProblems:
+    """Tests the checks made before packing."""
+
+    @pytest.fixture(name="game_plans")
+    def make_game_plans(self, tmp_path):
+        """Plans copying two games to different directories."""
+        game_plans = []
+        for name in ("Game A", "Game B"):
+            game_dir, _, _ = make_files(tmp_path, name)
+            for track in game_dir.glob("*(track*"):
+                track.write_bytes(bytes(1000))
+            game = GameDir(game_dir, None)
+            out_dir = tmp_path / "out" / name
+            files = plan_game(game, out_dir, OperatingMode.COPY)
+            game_plans.append(GamePlan(game, out_dir, files))
+        yield game_plans
+
+    def test_no_problems(self, game_plans):
+        """Test a run that fits and has no collisions."""
+        assert not find_problems(game_plans)
+
+    def test_collision(self, game_plans):
+        """Test two games packed to the same directory are found."""
+        collision = game_plans[1]._replace(out_dir=game_plans[0].out_dir)
+        problems = find_problems([game_plans[0], collision])
+        assert problems == [
+            f"{game_plans[0].game} and {collision.game} would both be packed to "
+            f"{game_plans[0].out_dir}"
+        ]
+
+    def test_not_enough_space(self, game_plans, monkeypatch):
+        """Test the space needed by all of the games is compared to the free
+        space."""
+        needed = sum(file.size for plan in game_plans for file in plan.files)
+        monkeypatch.setattr(planner, "supports_reflink", lambda _directory: False)
+        monkeypatch.setattr(
+            planner.shutil, "disk_usage", lambda _path: Usage(0, 0, needed - 1)
+        )
+        problems = find_problems(game_plans)
+        assert len(problems) == 1
+        assert f"{needed} bytes are needed and {needed - 1} bytes are free" in (
+            problems[0]
+        )
+        # Skipped games take no space.
+        game_plans[0] = game_plans[0]._replace(skip=True)
+        assert not find_problems(game_plans)
+
+    def test_reflink(self, game_plans, monkeypatch):
+        """Test copies that will be cloned take no space, unless cloning is off."""
+        monkeypatch.setattr(planner, "supports_reflink", lambda _directory: True)
+        monkeypatch.setattr(planner.shutil, "disk_usage", lambda _path: Usage(0, 0, 0))
+        assert not find_problems(game_plans)
+        assert find_problems(game_plans, reflink=False)
+
+    def test_moves_and_links(self, game_plans, monkeypatch):
+        """Test moved and linked files take no space."""
+        monkeypatch.setattr(planner.shutil, "disk_usage", lambda _path: Usage(0, 0, 0))
+        game_plans = [
+            plan._replace(
+                files=[file._replace(action=planner.LINK) for file in plan.files]
+            )
+            for plan in game_plans
+        ]
+        assert not find_problems(game_plans, reflink=False)
+
+    def test_preflight_error(self):
+        """Test the error lists every problem."""
+        error = PreflightError(["first", "second"])
+        assert error.problems == ["first", "second"]
+        assert str(error) == "2 problem(s) found before packing. first; second"
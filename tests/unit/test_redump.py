@@ -0,0 +1,138 @@
+"""Tests for redump.py"""
+
+import hashlib
+import pytest
+
+from gdipak.checksums import MultiHasher
+from gdipak.redump import DatIndex, VerifyResult, VerifyStatus
+from tests.testing_utils import make_files
+
+
+def write_dat(dat_file, games):
+    """Writes a DAT file.
+
+    Args:
+        dat_file: The path to write to.
+        games: A dictionary of game name to a dictionary of rom name to contents.
+    """
+    lines = ['<?xml version="1.0"?>', "<datafile>", "<header><name>Test</name>"]
+    lines.append("</header>")
+    for game, roms in games.items():
+        lines.append(f'<game name="{game}"><category>Games</category>')
+        for name, contents in roms.items():
+            sha1 = hashlib.sha1(contents).hexdigest().upper()
+            lines.append(f'<rom name="{name}" size="{len(contents)}" sha1="{sha1}"/>')
+        lines.append("</game>")
+    lines.append("</datafile>")
+    dat_file.write_text("\n".join(lines), encoding="UTF-8")
+
+
+@pytest.fixture(name="game")
+def make_game(tmp_path):
+    """Creates a game whose tracks have distinct contents."""
+    game_dir, _, _ = make_files(tmp_path, "Fur Fighters")
+    tracks = {}
+    for file in sorted(game_dir.iterdir()):
+        if file.suffix != ".gdi":
+            file.write_bytes(file.name.encode())
+            tracks[file.name] = file.read_bytes()
+    yield game_dir, tracks
+
+
+class TestDatIndex:
+    """Tests reading a DAT file and verifying games against it."""
+
+    def test_find_games(self, tmp_path):
+        """Test looking up tracks, including one shared by two games."""
+        dat_file = tmp_path / "dreamcast.dat"
+        write_dat(
+            dat_file,
+            {
+                "Game (USA)": {"Game (USA).gdi": b"gdi", "Game (Track 1).bin": b"1"},
+                "Game (Europe)": {"Game (Track 1).bin": b"1", "Track 2.raw": b"2"},
+            },
+        )
+        index = DatIndex(dat_file)
+        assert len(index) == 2
+        assert index.find_games(hashlib.sha1(b"1").hexdigest()) == [
+            "Game (USA)",
+            "Game (Europe)",
+        ]
+        assert index.find_games(hashlib.sha1(b"2").hexdigest()) == ["Game (Europe)"]
+        # GDI files are not indexed.
+        assert not index.find_games(hashlib.sha1(b"gdi").hexdigest())
+
+    def test_invalid_dat(self, tmp_path):
+        """Test a file that is not XML is rejected."""
+        dat_file = tmp_path / "dreamcast.dat"
+        dat_file.write_text("not a dat", encoding="UTF-8")
+        with pytest.raises(ValueError) as ex:
+            DatIndex(dat_file)
+        assert "Could not read DAT file" in str(ex.value)
+
+    def test_match(self, tmp_path, game):
+        """Test a game whose tracks are all in the DAT."""
+        game_dir, tracks = game
+        dat_file = tmp_path / "dreamcast.dat"
+        write_dat(dat_file, {"Fur Fighters (USA)": tracks, "Other": {"a.bin": b"a"}})
+        result = DatIndex(dat_file).verify_game(game_dir)
+        assert result == VerifyResult(VerifyStatus.MATCH, "Fur Fighters (USA)", [])
+        assert str(result) == "match (Fur Fighters (USA))"
+
+    def test_only_sha1(self, tmp_path, game, monkeypatch):
+        """Test only the SHA-1 of the tracks is computed, as the DAT is searched by
+        it."""
+        game_dir, tracks = game
+        dat_file = tmp_path / "dreamcast.dat"
+        write_dat(dat_file, {"Fur Fighters (USA)": tracks})
+        monkeypatch.setattr(
+            MultiHasher, "update", lambda *_args: pytest.fail("Computed every hash")
+        )
+        result = DatIndex(dat_file).verify_game(game_dir)
+        assert result.status == VerifyStatus.MATCH
+
+    def test_match_with_cue(self, tmp_path, game):
+        """Test the CUE sheet Redump lists for each game is not counted as a
+        track."""
+        game_dir, tracks = game
+        dat_file = tmp_path / "dreamcast.dat"
+        roms = {"Fur Fighters (USA).cue": b"cue", **tracks}
+        write_dat(dat_file, {"Fur Fighters (USA)": roms})
+        index = DatIndex(dat_file)
+        assert not index.find_games(hashlib.sha1(b"cue").hexdigest())
+        result = index.verify_game(game_dir)
+        assert result == VerifyResult(VerifyStatus.MATCH, "Fur Fighters (USA)", [])
+
+    def test_bad_track(self, tmp_path, game):
+        """Test a game with a track that does not match the DAT."""
+        game_dir, tracks = game
+        dat_file = tmp_path / "dreamcast.dat"
+        write_dat(dat_file, {"Fur Fighters (USA)": tracks})
+        bad_track = game_dir / "Fur Fighters(track2).bin"
+        bad_track.write_bytes(b"corrupt")
+        result = DatIndex(dat_file).verify_game(game_dir)
+        assert result == VerifyResult(
+            VerifyStatus.BAD, "Fur Fighters (USA)", [bad_track]
+        )
+        assert str(result).endswith("bad tracks: Fur Fighters(track2).bin")
+
+    def test_missing_track(self, tmp_path, game):
+        """Test a game with fewer tracks than the DAT."""
+        game_dir, tracks = game
+        dat_file = tmp_path / "dreamcast.dat"
+        write_dat(dat_file, {"Fur Fighters (USA)": tracks})
+        missing = game_dir / "Fur Fighters(track3).raw"
+        game_files = [file for file in game_dir.iterdir() if file != missing]
+        result = DatIndex(dat_file).verify_game(game_dir, game_files)
+        assert result == VerifyResult(VerifyStatus.BAD, "Fur Fighters (USA)", [])
+
+    def test_unknown(self, tmp_path, game):
+        """Test a game that is not in the DAT."""
+        game_dir, _tracks = game
+        dat_file = tmp_path / "dreamcast.dat"
+        write_dat(dat_file, {"Other": {"a.bin": b"a"}})
+        result = DatIndex(dat_file).verify_game(game_dir)
+        assert result.status == VerifyStatus.UNKNOWN
+        assert result.game is None
+        assert len(result.bad_tracks) == 3
+        assert str(result) == "unknown"
@@ -0,0 +1,119 @@
+"""Tests for scheduler.py"""
+
+import threading
+import pytest
+
+from gdipak.scheduler import PackingError, QUEUE_DEPTH, run_jobs
+
+
+class TestRunJobs:
+    """Tests running jobs serially and in parallel."""
+
+    def test_invalid_jobs(self):
+        """Test that less than one job is rejected."""
+        with pytest.raises(ValueError) as ex:
+            run_jobs(print, [], jobs=0)
+        assert "jobs must be a positive number" in str(ex.value)
+
+    def test_serial_order(self):
+        """Test results are returned in item order."""
+        assert run_jobs(lambda item: item * 2, range(5)) == [0, 2, 4, 6, 8]
+
+    def test_serial_error(self):
+        """Test the first error stops a serial run and is raised as is."""
+        processed = []
+
+        def action(item):
+            processed.append(item)
+            if item == 1:
+                raise ValueError("Directory does not contain a gdi file")
+
+        with pytest.raises(ValueError):
+            run_jobs(action, range(3))
+        assert processed == [0, 1]
+
+    def test_parallel_order(self):
+        """Test results are returned in item order regardless of finish order."""
+        events = [threading.Event() for _ in range(4)]
+
+        def action(index):
+            # Each job waits for the one after it, so they finish in reverse order.
+            if index + 1 < len(events):
+                events[index + 1].wait(timeout=5)
+            events[index].set()
+            return index
+
+        assert run_jobs(action, range(4), jobs=4) == [0, 1, 2, 3]
+
+    def test_parallel_errors(self):
+        """Test every item is processed and all errors are reported together."""
+        processed = []
+
+        def action(item):
+            processed.append(item)
+            if item % 2:
+                raise ValueError(f"bad {item}")
+            return item
+
+        with pytest.raises(PackingError) as ex:
+            run_jobs(action, range(6), jobs=3)
+        assert sorted(processed) == list(range(6))
+        assert [item for item, _ in ex.value.errors] == [1, 3, 5]
+        assert all(isinstance(error, ValueError) for _, error in ex.value.errors)
+        assert "3 job(s) failed. 1: bad 1; 3: bad 3; 5: bad 5" in str(ex.value)
+
+    def test_parallel_starts_before_items_are_all_found(self):
+        """Test the first item is processed while the rest are still being found."""
+        first_done = threading.Event()
+
+        def items():
+            yield 0
+            # Only continues once the first item has been processed.
+            assert first_done.wait(timeout=5)
+            yield 1
+
+        def action(item):
+            if item == 0:
+                first_done.set()
+            return item
+
+        assert run_jobs(action, items(), jobs=2) == [0, 1]
+
+    def test_parallel_bounded_read_ahead(self):
+        """Test that only a bounded number of items are taken ahead of the workers."""
+        release = threading.Event()
+        taken = []
+
+        def items():
+            for item in range(100):
+                taken.append(item)
+                yield item
+
+        def action(item):
+            release.wait(timeout=5)
+            return item
+
+        thread = threading.Thread(
+            target=lambda: run_jobs(action, items(), jobs=2), daemon=True
+        )
+        thread.start()
+        # Give the producer a chance to read as far ahead as it is allowed to.
+        thread.join(timeout=0.2)
+        # Each worker holds one item, the queue holds the rest, the producer may be
+        # blocked holding one more.
+        assert len(taken) <= 2 + 2 * QUEUE_DEPTH + 1
+        release.set()
+        thread.join(timeout=5)
+        assert len(taken) == 100
+
+    def test_parallel_error_finding_items(self):
+        """Test an error while finding items is raised after queued items finish."""
+        processed = []
+
+        def items():
+            yield 0
+            raise PermissionError("Permission denied")
+
+        with pytest.raises(PermissionError):
+            run_jobs(processed.append, items(), jobs=2)
+        assert processed == [0]
@@ -0,0 +1,68 @@
+"""Tests for flushing files to their device"""
+
+import pytest
+
+from gdipak import sync
+from gdipak.sync import SyncBatch, fsync_dir, fsync_file
+from tests.testing_utils import get_inode, record_fsyncs
+
+
+@pytest.fixture(name="fsynced")
+def fixture_fsynced(monkeypatch):
+    """Records the files that are flushed."""
+    return record_fsyncs(monkeypatch)
+
+
+class TestFsync:
+    """Tests for flushing single files and directories."""
+
+    def test_fsync_file(self, tmp_path, fsynced):
+        """Tests flushing a file."""
+        file_path = tmp_path / "track01.bin"
+        file_path.write_bytes(b"data")
+        fsync_file(file_path)
+        assert fsynced == [get_inode(file_path)]
+
+    def test_fsync_dir(self, tmp_path, fsynced):
+        """Tests flushing a directory."""
+        fsync_dir(str(tmp_path))
+        assert fsynced == [get_inode(tmp_path)]
+
+    def test_fsync_missing_file(self, tmp_path):
+        """Tests flushing a file that does not exist."""
+        with pytest.raises(FileNotFoundError):
+            fsync_file(tmp_path / "missing.bin")
+
+
+class TestSyncBatch:
+    """Tests for flushing files together."""
+
+    def test_flush(self, tmp_path, fsynced):
+        """Tests every file is flushed once, before the directories, and the batch
+        is emptied."""
+        game_dir = tmp_path / "game"
+        game_dir.mkdir()
+        files = [game_dir / "track01.bin", game_dir / "disc.gdi"]
+        for file in files:
+            file.touch()
+        batch = SyncBatch()
+        batch.add_files(files)
+        batch.add_files([str(files[0])])
+        batch.add_dirs([tmp_path, game_dir])
+        assert len(batch) == 4
+        batch.flush()
+        expected = files + [game_dir, tmp_path]
+        assert fsynced == [get_inode(path) for path in expected]
+        assert not batch
+        batch.flush()
+        assert len(fsynced) == 4
+
+    def test_flush_error(self, tmp_path, monkeypatch):
+        """Tests a file that can not be flushed fails the flush."""
+        batch = SyncBatch()
+        batch.add_files([tmp_path / "missing.bin"])
+        flushed = []
+        monkeypatch.setattr(sync, "fsync_dir", flushed.append)
+        with pytest.raises(FileNotFoundError):
+            batch.flush()
+        assert not flushed